@@ -0,0 +1,64 @@
+"""写真の取込のベンチマーク
+
+    python -m busker.benchmark WORKDIR [--scale 10k|100k|1m] [--output result.json] [--baseline old.json]
+
+WORKDIRに生成したツリーは同じ条件の場合は再利用する。結果はJSON形式で--output（省略時は標準出力）に出力し、
+--baselineを指定した場合は処理ごとの所要時間の比を標準エラー出力に出力する。
+"""
+import sys
+import json
+import logging
+import argparse
+from typing import List, Optional
+from busker.benchmark.generator import TreeGenerator
+from busker.benchmark.runner import SCALES, BenchmarkRunner, compare
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m busker.benchmark', description='Benchmark photo imports.')
+    parser.add_argument('workdir', help='directory for the generated tree, databases and the import target')
+    parser.add_argument('--scale', choices=SCALES, default='10k')
+    parser.add_argument('--count', type=int, help='number of files, overrides --scale')
+    parser.add_argument('--duplicate-rate', type=float, default=0.1)
+    parser.add_argument('--collision-rate', type=float, default=0.05)
+    parser.add_argument('--video-rate', type=float, default=0.05)
+    parser.add_argument('--video-size', type=int, default=256 * 1024)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=0, help='scan workers of the importer')
+    parser.add_argument('--executor', choices=('thread', 'process'), default='thread')
+    parser.add_argument('--dedup', choices=('full', 'staged'), default='full')
+    parser.add_argument('--output', help='write the result to this JSON file instead of stdout')
+    parser.add_argument('--baseline', help='compare with a result JSON file of another version')
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    generator = TreeGenerator(args.count or SCALES[args.scale],
+                              duplicate_rate=args.duplicate_rate,
+                              collision_rate=args.collision_rate,
+                              video_rate=args.video_rate,
+                              video_size=args.video_size,
+                              seed=args.seed)
+    runner = BenchmarkRunner(args.workdir, generator,
+                             scan_workers=args.workers, scan_executor=args.executor, dedup_mode=args.dedup)
+    result = runner.run()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        for name, ratio in compare(baseline, result).items():
+            print(f'{name}: {ratio if ratio is not None else "-"}', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
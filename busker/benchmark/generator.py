@@ -0,0 +1,125 @@
+import io
+import os
+import json
+import random
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Set, Tuple
+
+
+logger = logging.getLogger("busker.benchmark.generator")
+logger.setLevel(logging.INFO)
+
+# 生成済みのツリーの条件と件数、同じ条件の場合は生成し直さない
+MANIFEST_NAME = 'benchmark-manifest.json'
+# 写真を生成するサブフォルダー、取込元のフォルダーになる
+SOURCE_NAME = 'DCIM'
+
+# EXIFのDateTimeOriginalのタグ
+_EXIF_IFD = 0x8769
+_DATE_TIME_ORIGINAL = 0x9003
+
+
+class TreeGenerator:
+    """ベンチマーク用の写真フォルダーを生成する
+
+    写真はdirectory/DCIMの下に生成し、生成条件はdirectory/benchmark-manifest.jsonに保存する。
+
+    画像はPillowで作成したEXIF（DateTimeOriginal）付きの小さなJPEGで、画素は乱数のため全て異なる内容になる。
+    duplicate_rateの割合で生成済みのファイルと同じ内容のファイル（別フォルダー・別名）、
+    collision_rateの割合で生成済みのファイルと同じ撮影月・同じ名前で内容の異なるファイル、
+    video_rateの割合でvideo_sizeバイトの動画ファイル（乱数のバイト列）を含める。
+    seedが同じ場合は同じツリーを生成する。
+    """
+    files_per_folder = 1000
+    image_size = (64, 48)
+
+    def __init__(self,
+                 count: int,
+                 duplicate_rate: float = 0.1,
+                 collision_rate: float = 0.05,
+                 video_rate: float = 0.05,
+                 video_size: int = 256 * 1024,
+                 seed: int = 0) -> None:
+        self.count = count
+        self.duplicate_rate = duplicate_rate
+        self.collision_rate = collision_rate
+        self.video_rate = video_rate
+        self.video_size = video_size
+        self.seed = seed
+
+    def params(self) -> Dict[str, Any]:
+        return {'count': self.count,
+                'duplicate_rate': self.duplicate_rate,
+                'collision_rate': self.collision_rate,
+                'video_rate': self.video_rate,
+                'video_size': self.video_size,
+                'seed': self.seed}
+
+    def generate(self, directory: str) -> Dict[str, Any]:
+        """directoryにツリーを生成し、生成したファイルの種類ごとの件数を返す"""
+        manifest_file = os.path.join(directory, MANIFEST_NAME)
+        if os.path.exists(manifest_file):
+            with open(manifest_file, encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest['params'] == self.params():
+                logger.info(f'Benchmark tree in {directory} is up to date.')
+                return manifest['files']
+            raise FileExistsError(f'{directory} has a benchmark tree generated with other parameters.')
+
+        rand = random.Random(self.seed)
+        files = {'images': 0, 'duplicates': 0, 'collisions': 0, 'videos': 0}
+        # 生成済みの画像の(フォルダー, ファイル名, 撮影日時)
+        images: List[Tuple[str, str, datetime]] = []
+        started = datetime(2015, 1, 1)
+        for i in range(self.count):
+            folder = os.path.join(directory, SOURCE_NAME, f'{100 + i // self.files_per_folder}BUSKER')
+            if i % self.files_per_folder == 0:
+                os.makedirs(folder, exist_ok=True)
+                names: Set[str] = set()
+            dice = rand.random()
+            # 同じ撮影月に同じ名前のファイルを保存すると、取込時にファイル名の重複になる
+            # （同じフォルダーには同じ名前で保存できないため、フォルダー内で未使用の名前の場合のみ）
+            collided = rand.choice(images) if images else None
+            if collided and dice < self.duplicate_rate:
+                source_folder, source_name, captured_at = collided
+                with open(os.path.join(source_folder, source_name), 'rb') as f:
+                    data = f.read()
+                name = f'COPY_{i:07d}.JPG'
+                files['duplicates'] += 1
+            elif collided and dice < self.duplicate_rate + self.collision_rate and collided[1] not in names:
+                _, name, captured_at = collided
+                captured_at += timedelta(seconds=rand.randrange(1, 60))
+                data = self.create_image(rand, captured_at)
+                files['collisions'] += 1
+            elif dice < self.duplicate_rate + self.collision_rate + self.video_rate:
+                name = f'MOV_{i:07d}.MP4'
+                data = rand.randbytes(self.video_size)
+                files['videos'] += 1
+            else:
+                captured_at = started + timedelta(seconds=rand.randrange(10 * 365 * 24 * 3600))
+                name = f'IMG_{i:07d}.JPG'
+                data = self.create_image(rand, captured_at)
+                images.append((folder, name, captured_at))
+                files['images'] += 1
+
+            names.add(name)
+            with open(os.path.join(folder, name), 'wb') as f:
+                f.write(data)
+            if (i + 1) % 10000 == 0:
+                logger.info(f'{i + 1} / {self.count} files have been generated.')
+
+        with open(manifest_file, 'w', encoding='utf-8') as f:
+            json.dump({'params': self.params(), 'files': files}, f, indent=2)
+        return files
+
+    def create_image(self, rand: random.Random, captured_at: datetime) -> bytes:
+        from PIL import Image
+
+        width, height = self.image_size
+        img = Image.frombytes('L', self.image_size, rand.randbytes(width * height))
+        exif = Image.Exif()
+        exif.get_ifd(_EXIF_IFD)[_DATE_TIME_ORIGINAL] = captured_at.strftime('%Y:%m:%d %H:%M:%S')
+        buffer = io.BytesIO()
+        img.save(buffer, 'JPEG', exif=exif.tobytes())
+        return buffer.getvalue()
@@ -0,0 +1,157 @@
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import logging
+import platform
+import subprocess
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from busker.benchmark.generator import SOURCE_NAME, TreeGenerator
+from busker.photo.catalog_index import CatalogIndex
+from busker.photo.engine import PhotoImporter
+from busker.photo.file_info import FileInfo, read_all_files
+from busker.photo import sql
+
+
+logger = logging.getLogger("busker.benchmark.runner")
+logger.setLevel(logging.INFO)
+
+# ツリーの規模ごとのファイル数
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+
+def get_revision() -> Optional[str]:
+    """計測したソースのgitのコミット、gitで管理していない場合はNone"""
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+class BenchmarkRunner:
+    """生成したツリー（busker.benchmark.generator）で、写真の取込の各処理の所要時間を計測する
+
+    計測する処理は、read_all_files（走査、hash計算、EXIF読込）、登録済みファイル情報の検索（CatalogIndex、busker.photo.sql）、
+    copy_photos（コピーと登録）、inspect_collected_files（空のDBへの登録と、変更なしの再確認）。
+    結果はrun()で辞書として返し、JSONに保存してバージョン間で比較する（compare()）。
+    optionsはPhotoImporterのオプション（scan_workersなど）。
+    """
+    # 登録済みファイル情報の検索の計測に使うファイル数
+    lookup_sample = 10000
+
+    def __init__(self, workdir: str, generator: TreeGenerator, **options: Any) -> None:
+        self.workdir = workdir
+        self.generator = generator
+        self.options = options
+        self.tree_path = os.path.join(workdir, 'tree')
+        self.source_path = os.path.join(self.tree_path, SOURCE_NAME)
+        self.target_path = os.path.join(workdir, 'target')
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+    def run(self) -> Dict[str, Any]:
+        started_at = datetime.now()
+        files = self.generator.generate(self.tree_path)
+        count = sum(files.values())
+
+        self.results = {}
+        self.run_read_all_files(count)
+        conn = self.connect('copy.db')
+        try:
+            self.run_copy_photos(conn, count)
+            # copy_photosと同じhashのアルゴリズムで読み込む
+            with PhotoImporter(conn, **self.options).activate():
+                self.run_lookups(conn)
+        finally:
+            conn.close()
+        conn = self.connect('inspect.db')
+        try:
+            self.run_inspect(conn)
+        finally:
+            conn.close()
+
+        return {'revision': get_revision(),
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'started_at': started_at.isoformat(timespec='seconds'),
+                'params': self.generator.params(),
+                'options': self.options,
+                'files': files,
+                'results': self.results}
+
+    def connect(self, name: str):
+        database = os.path.join(self.workdir, name)
+        if os.path.exists(database):
+            os.remove(database)
+        return sqlite3.connect(database)
+
+    def measure(self, name: str, files: int, func: Callable[[], Any]) -> Any:
+        """funcの所要時間を計測してresultsに記録する"""
+        logger.info(f'Running {name}...')
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        self.results[name] = {'seconds': round(elapsed, 3),
+                              'files': files,
+                              'files_per_sec': round(files / elapsed, 1) if elapsed else None}
+        logger.info(f'{name}: {elapsed:.3f} s for {files} files.')
+        return result
+
+    def run_read_all_files(self, count: int) -> None:
+        workers = self.options.get('scan_workers', 0)
+        executor = self.options.get('scan_executor', 'thread')
+
+        def read() -> int:
+            return sum(len(file_infos) for file_infos in read_all_files(self.source_path, 1000, workers, executor))
+        self.measure('read_all_files', count, read)
+
+    def run_copy_photos(self, conn, count: int) -> None:
+        if os.path.exists(self.target_path):
+            shutil.rmtree(self.target_path)
+        importer = PhotoImporter(conn, **self.options)
+        self.measure('copy_photos', count, lambda: importer.copy_photos(self.source_path, self.target_path))
+        self.results['copy_photos']['stats'] = importer.stats()
+
+    def run_lookups(self, conn) -> None:
+        """登録済みのファイル情報の一部で、同一ファイルとファイル名の検索を計測する（copy_photosと同じ索引を使う）"""
+        sample: List[FileInfo] = []
+        for file_infos in read_all_files(self.target_path, 1000):
+            sample += file_infos[:self.lookup_sample - len(sample)]
+            if len(sample) >= self.lookup_sample:
+                break
+        for file_info in sample:
+            file_info.save_to = file_info.get_relative_path(self.target_path)
+
+        self.measure('sql.get_files_by_size__captured_at', len(sample),
+                     lambda: [sql.get_files_by_size__captured_at(conn, file_info.size, file_info.captured_at)
+                              for file_info in sample])
+        index = self.measure('catalog_index.load', sql.get_count(conn),
+                             lambda: CatalogIndex.load(conn, FileInfo.hash_engine.name))
+        self.measure('catalog_index.contains', len(sample),
+                     lambda: [index.contains(file_info) for file_info in sample])
+        # 登録済みのファイル名のため、全て連番を付けたファイル名になる
+        self.measure('catalog_index.resolve_name', len(sample),
+                     lambda: [index.resolve_name(file_info.save_to, file_info.name) for file_info in sample])
+
+    def run_inspect(self, conn) -> None:
+        """空のDBに保存先のファイルを登録し、次に変更のない保存先を確認し直す"""
+        importer = PhotoImporter(conn, **self.options)
+        count = sum(len(files) for root, dirs, files in os.walk(self.target_path))
+        # コピー直後のフォルダーは状態を保存しない（DirectorySnapshot.racy_window_ns）ため、経過するまで待つ
+        time.sleep(importer.snapshot.racy_window_ns / 10 ** 9)
+        self.measure('inspect_collected_files', count, lambda: importer.inspect(self.target_path))
+        self.results['inspect_collected_files']['stats'] = importer.stats()
+        importer.reset_stats()
+        self.measure('inspect_collected_files.unchanged', count, lambda: importer.inspect(self.target_path))
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    """処理ごとの所要時間の比（current / baseline）、1より大きい場合は遅くなっている"""
+    ratios: Dict[str, Optional[float]] = {}
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        ratios[name] = round(result['seconds'] / base['seconds'], 3) if base and base['seconds'] else None
+    return ratios
@@ -1,7 +1,6 @@
 import sqlite3
 import tkinter as tk
 import os
-import shutil
 from tkinter import filedialog, messagebox
 from datetime import datetime
 from typing import Any
@@ -9,6 +8,7 @@ from busker.tkinter.utils import center_window, MessagePanel
 from busker.file.utils import init_i18n, init_logging, FileType, get_image_capture_datetime, \
      calculate_md5, read_all_files
 from busker.file import sql
+from busker.file.fastcopy import copy_file
 import logging
 import traceback
 
@@ -182,7 +182,7 @@ class Backupper:
                         file_info['name'] = file_name
 
                     # 写真を保存先へコピー
-                    shutil.copy2(current_file, os.path.join(target_folder, file_name))
+                    copy_file(current_file, os.path.join(target_folder, file_name))
 
                     # ファイル情報の収集
                     sql.register_file_info(self.conn, file_info)
@@ -217,9 +217,14 @@ class Backupper:
         return file_info
 
 
-with sqlite3.connect('file_organizer.db') as connection:
-    init_logging('file_organizer.log', logging.INFO, 'utf-8')
-    localedir = os.path.join(os.path.dirname(__file__), 'locale')
-    init_i18n('busker', localedir, 'ja_JP')
-    app = Backupper(connection)
-    app.run()
+def main() -> None:
+    with sqlite3.connect('file_organizer.db') as connection:
+        init_logging('file_organizer.log', logging.INFO, 'utf-8')
+        localedir = os.path.join(os.path.dirname(__file__), 'locale')
+        init_i18n('busker', localedir, 'ja_JP')
+        app = Backupper(connection)
+        app.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import os
+import errno
+import shutil
+import logging
+from typing import Callable
+
+try:
+    import fcntl
+except ImportError:     # pragma: no cover
+    fcntl = None        # type: ignore
+
+
+logger = logging.getLogger("busker.file.fastcopy")
+logger.setLevel(logging.INFO)
+
+# コピー方式
+REFLINK = 'reflink'
+HARDLINK = 'hardlink'
+COPY_FILE_RANGE = 'copy_file_range'
+SENDFILE = 'sendfile'
+BUFFERED = 'buffered'
+
+# Linuxのioctl(FICLONE)、Btrfs、XFSなどでデータブロックを共有するコピーを作成する
+FICLONE = 0x40049409
+
+# 対応していないファイルシステム、OSの場合に次の方式で再試行するエラー
+_FALLBACK_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.ENOTTY, errno.EOPNOTSUPP, errno.EPERM,
+                    errno.EBADF, errno.ENOTSUP)
+
+buffer_size = 1024 * 1024
+
+
+def copy_file(src: str, dst: str, hardlink: bool = False) -> str:
+    """ファイルをコピーし、使用したコピー方式を返す
+
+    reflink、copy_file_range、sendfile、バッファー経由のコピーの順に、使用可能な方式でコピーする。
+    hardlinkがTrueの場合は、まず同一ファイルシステム内のハードリンクを試みる（保存先の変更は元ファイルにも反映される）。
+    shutil.copy2と同様に、ハードリンク以外は更新日時などのメタデータもコピーする。
+    """
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return HARDLINK
+        except FileExistsError:
+            os.remove(dst)
+            os.link(src, dst)
+            return HARDLINK
+        except OSError as e:
+            logger.debug(f'Hard link from {src} to {dst} is not available: {e}')
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        method = _copy_content(fsrc, fdst)
+    shutil.copystat(src, dst)
+    return method
+
+
+def _copy_content(fsrc, fdst) -> str:
+    src_fd = fsrc.fileno()
+    dst_fd = fdst.fileno()
+    size = os.fstat(src_fd).st_size
+
+    if fcntl is not None:
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            return REFLINK
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRORS:
+                raise
+
+    if hasattr(os, 'copy_file_range') \
+            and _copy_by(lambda offset: os.copy_file_range(src_fd, dst_fd, buffer_size * 8), size):
+        return COPY_FILE_RANGE
+
+    if hasattr(os, 'sendfile') and _copy_by(lambda offset: os.sendfile(dst_fd, src_fd, offset, buffer_size * 8), size):
+        return SENDFILE
+
+    shutil.copyfileobj(fsrc, fdst, buffer_size)
+    return BUFFERED
+
+
+def _copy_by(copy: Callable[[int], int], size: int) -> bool:
+    """カーネル内コピーの関数で全体をコピーする、最初の呼び出しが未対応エラーの場合はFalse"""
+    offset = 0
+    while True:
+        try:
+            copied = copy(offset)
+        except OSError as e:
+            if offset == 0 and e.errno in _FALLBACK_ERRORS:
+                return False
+            raise
+        if copied == 0:
+            break
+        offset += copied
+
+    if offset == 0 and size > 0:
+        # procfsなど、サイズを返すがカーネル内コピーでは読めないファイル
+        return False
+    return True
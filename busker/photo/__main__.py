@@ -0,0 +1,248 @@
+"""写真の自動整理のコマンドライン、画面なしで実行する
+
+    python -m busker.photo import SOURCE TARGET [--db photo_organizer.db] [--workers 4]
+    python -m busker.photo inspect TARGET [--db photo_organizer.db]
+    python -m busker.photo plan SOURCE TARGET --output plan.jsonl [--db photo_organizer.db]
+    python -m busker.photo execute plan.jsonl [--db photo_organizer.db]
+    python -m busker.photo watch SOURCE TARGET [--settle 2] [--polling] [--db photo_organizer.db]
+    python -m busker.photo scrub TARGET [--bytes-per-sec 50M] [--iops 200] [--limit 10000] [--db photo_organizer.db]
+    python -m busker.photo views TARGET [VIEW] [--layout %Y/%m/%d] [--db photo_organizer.db]
+
+進捗と最後の集計はJSON形式で1行ずつ標準出力に出力する。
+終了コードは、正常終了の場合は0、処理中にエラーが発生した場合は1、引数が不正な場合は2、中断した場合は130。
+"""
+import os
+import sys
+import json
+import sqlite3
+import logging
+import argparse
+import traceback
+from typing import Any, Dict, List, Optional
+from busker.utils import init_logging
+from busker.photo.engine import PhotoImporter
+from busker.photo.hasher import available_algorithms
+from busker.photo.metrics import metrics
+from busker.photo import sql
+
+
+logger = logging.getLogger("busker.photo.main")
+logger.setLevel(logging.INFO)
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+
+def parse_size(value: str) -> float:
+    """K、M、Gの単位（1024倍）を付けた数値"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    unit = units.get(value[-1:].upper(), 1)
+    try:
+        return float(value[:-1] if unit > 1 else value) * unit
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: '{value}'")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m busker.photo', description='Collect photos automatically.')
+    parser.add_argument('--db', default='photo_organizer.db', help='SQLite database file (default: %(default)s)')
+    parser.add_argument('--log', help='log file, logs are written to stderr if omitted')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='parallel workers for hashing and reading EXIF, 0 runs sequentially')
+    parser.add_argument('--executor', choices=('thread', 'process'), default='thread')
+    parser.add_argument('--dedup', choices=('full', 'staged'), default='full')
+    parser.add_argument('--hash', choices=available_algorithms(), default='md5')
+    parser.add_argument('--mmap', action='store_true', help='read files by mmap for hashing')
+    parser.add_argument('--query-stats', metavar='FILE', help='write SQL statistics to FILE as JSON')
+    parser.add_argument('--metrics', metavar='FILE', help='write per-stage metrics to FILE as JSON')
+    parser.add_argument('--metrics-textfile', metavar='FILE',
+                        help='write per-stage metrics to FILE for the node_exporter textfile collector (*.prom)')
+    parser.add_argument('--include', action='append', default=[], metavar='PATTERN',
+                        help='scan only files matching PATTERN (fnmatch), can be repeated')
+    parser.add_argument('--exclude', action='append', default=[], metavar='PATTERN',
+                        help='skip files and directories matching PATTERN in addition to the defaults')
+    parser.add_argument('--media-only', action='store_true', help='skip files other than images and videos')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help='copy photos from SOURCE to TARGET')
+    import_parser.add_argument('source')
+    import_parser.add_argument('target')
+    import_parser.add_argument('--hardlink', action='store_true', help='hard link instead of copying if possible')
+    import_parser.add_argument('--pipeline', action='store_true',
+                               help='run scanning, hashing, copying and DB writes concurrently (--dedup full only)')
+    import_parser.add_argument('--copy-workers', type=int, default=2, help='copy threads for --pipeline')
+    import_parser.add_argument('--content-store', action='store_true',
+                               help='store each unique content once under TARGET and hard link the dated files to it')
+    import_parser.add_argument('--fused', action='store_true',
+                               help='read each source file once, hashing and copying it in the same pass '
+                                    '(sequential scan only, ignores --pipeline and --hardlink)')
+    import_parser.add_argument('--near-duplicates', type=int, metavar='DISTANCE',
+                               help='report images whose perceptual hash is within DISTANCE bits of a cataloged one')
+    import_parser.add_argument('--skip-near-duplicates', action='store_true',
+                               help='do not copy images reported by --near-duplicates')
+    import_parser.add_argument('--resume', action='store_true',
+                               help='resume the interrupted import of the same SOURCE and TARGET (ignores --pipeline)')
+
+    plan_parser = subparsers.add_parser('plan', help='write the copies of an import to a plan file without copying')
+    plan_parser.add_argument('source')
+    plan_parser.add_argument('target')
+    plan_parser.add_argument('--output', required=True, metavar='FILE', help='plan file (JSON Lines)')
+    plan_parser.add_argument('--near-duplicates', type=int, metavar='DISTANCE',
+                             help='plan images whose perceptual hash is within DISTANCE bits of a cataloged one '
+                                  'as near duplicates, which are not copied')
+
+    execute_parser = subparsers.add_parser('execute', help='copy photos as planned by the plan command')
+    execute_parser.add_argument('plan')
+    execute_parser.add_argument('--hardlink', action='store_true', help='hard link instead of copying if possible')
+    execute_parser.add_argument('--copy-workers', type=int, default=2, help='copy threads')
+    execute_parser.add_argument('--content-store', action='store_true',
+                                help='store each unique content once under TARGET and hard link the dated files to it')
+
+    watch_parser = subparsers.add_parser('watch', help='import SOURCE and keep importing files added to SOURCE')
+    watch_parser.add_argument('source')
+    watch_parser.add_argument('target')
+    watch_parser.add_argument('--settle', type=float, default=PhotoImporter.watch_settle_seconds,
+                              help='seconds a file must stay unchanged before it is imported (default: %(default)s)')
+    watch_parser.add_argument('--batch-size', type=int, default=PhotoImporter.watch_batch_size)
+    watch_parser.add_argument('--polling', action='store_true', help='scan SOURCE periodically instead of inotify')
+    watch_parser.add_argument('--poll-interval', type=float, default=PhotoImporter.watch_poll_interval)
+    watch_parser.add_argument('--hardlink', action='store_true', help='hard link instead of copying if possible')
+    watch_parser.add_argument('--content-store', action='store_true',
+                              help='store each unique content once under TARGET and hard link the dated files to it')
+
+    scrub_parser = subparsers.add_parser('scrub',
+                                         help='verify files in TARGET against the sizes and hashes in the database')
+    scrub_parser.add_argument('target')
+    scrub_parser.add_argument('--threads', type=int, default=PhotoImporter.scrub_workers, help='reading threads')
+    scrub_parser.add_argument('--bytes-per-sec', type=parse_size, metavar='SIZE',
+                              help='limit reading to SIZE bytes per second, K, M and G suffixes are accepted')
+    scrub_parser.add_argument('--iops', type=float, help='limit file operations per second')
+    scrub_parser.add_argument('--limit', type=int, help='verify at most LIMIT files, least recently verified first')
+    scrub_parser.add_argument('--no-orphans', action='store_true',
+                              help='do not look for files in TARGET missing from the database')
+
+    views_parser = subparsers.add_parser('views', help='hard link the files stored by --content-store into VIEW')
+    views_parser.add_argument('target')
+    views_parser.add_argument('view', nargs='?', help='directory of the view, TARGET is rebuilt if omitted')
+    views_parser.add_argument('--layout', help='strftime format of the folders by the capture date, e.g. %%Y/%%m/%%d '
+                                               '(default: the cataloged folders and names)')
+
+    migrate_parser = subparsers.add_parser('migrate',
+                                           help='rehash files in TARGET cataloged with other algorithms than --hash')
+    migrate_parser.add_argument('target')
+
+    inspect_parser = subparsers.add_parser('inspect', help='register files already in TARGET to the database')
+    inspect_parser.add_argument('target')
+    inspect_parser.add_argument('--all', action='store_true',
+                                help='check all directories, including ones unchanged since the last inspection')
+    return parser
+
+
+def print_progress(progress: Dict[str, Any]) -> None:
+    print(json.dumps(progress, ensure_ascii=False, default=str), flush=True)
+
+
+def create_importer(conn, args: argparse.Namespace) -> PhotoImporter:
+    options: Dict[str, Any] = dict(scan_workers=args.workers,
+                                   scan_executor=args.executor,
+                                   dedup_mode=args.dedup,
+                                   hash_algorithm=args.hash,
+                                   hash_use_mmap=args.mmap,
+                                   collect_query_stats=bool(args.query_stats),
+                                   collect_metrics=bool(args.metrics or args.metrics_textfile),
+                                   include_patterns=tuple(args.include),
+                                   exclude_patterns=PhotoImporter.exclude_patterns + tuple(args.exclude),
+                                   media_only=args.media_only)
+    if args.command == 'import':
+        options.update(copy_hardlink=args.hardlink,
+                       pipeline_hash_workers=max(args.workers, 1) if args.pipeline else 0,
+                       pipeline_copy_workers=args.copy_workers,
+                       resume=args.resume,
+                       content_store=args.content_store,
+                       fused_copy=args.fused,
+                       near_duplicate_distance=args.near_duplicates,
+                       near_duplicate_action='skip' if args.skip_near_duplicates else 'flag')
+    elif args.command == 'plan':
+        options.update(near_duplicate_distance=args.near_duplicates)
+    elif args.command == 'execute':
+        options.update(copy_hardlink=args.hardlink,
+                       pipeline_copy_workers=args.copy_workers,
+                       content_store=args.content_store)
+    elif args.command == 'watch':
+        options.update(copy_hardlink=args.hardlink,
+                       content_store=args.content_store,
+                       watch_settle_seconds=args.settle,
+                       watch_batch_size=args.batch_size,
+                       watch_polling=args.polling,
+                       watch_poll_interval=args.poll_interval)
+    elif args.command == 'scrub':
+        options.update(scrub_workers=args.threads,
+                       scrub_bytes_per_sec=args.bytes_per_sec,
+                       scrub_iops=args.iops)
+    elif args.command == 'inspect':
+        options.update(inspect_all=args.all)
+    return PhotoImporter(conn, print_progress, **options)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'import' and args.skip_near_duplicates and args.near_duplicates is None:
+        parser.error('--skip-near-duplicates requires --near-duplicates')
+    if args.log:
+        init_logging(args.log, logging.INFO, 'utf-8')
+    else:
+        logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    if args.command == 'execute':
+        if not os.path.isfile(args.plan):
+            print_progress({'event': 'error', 'error': f'{args.plan} is not a file.'})
+            return EXIT_USAGE
+    else:
+        for directory in [args.source] if args.command in ('import', 'plan', 'watch') else [args.target]:
+            if not os.path.isdir(directory):
+                print_progress({'event': 'error', 'error': f'{directory} is not a directory.'})
+                return EXIT_USAGE
+
+    conn = sqlite3.connect(args.db)
+    try:
+        importer = create_importer(conn, args)
+        if args.command == 'import':
+            importer.collect(args.source, args.target)
+        elif args.command == 'plan':
+            importer.plan_photos(args.source, args.target, args.output)
+        elif args.command == 'execute':
+            importer.execute_plan(args.plan)
+        elif args.command == 'watch':
+            importer.watch(args.source, args.target)
+        elif args.command == 'scrub':
+            importer.scrub(args.target, args.limit, not args.no_orphans)
+        elif args.command == 'views':
+            importer.build_view(args.target, args.view, args.layout)
+        elif args.command == 'migrate':
+            importer.migrate(args.target)
+        else:
+            importer.inspect(args.target)
+        print_progress(dict(event='summary', **importer.stats()))
+        return EXIT_OK
+    except KeyboardInterrupt:
+        print_progress({'event': 'interrupted'})
+        return EXIT_INTERRUPTED
+    except Exception as e:
+        logger.error(f"An unknown error occurred: {e}\n{traceback.format_exc()}")
+        print_progress({'event': 'error', 'error': str(e)})
+        return EXIT_ERROR
+    finally:
+        if args.query_stats:
+            sql.query_stats.dump(args.query_stats)
+        if args.metrics:
+            metrics.dump(args.metrics)
+        if args.metrics_textfile:
+            metrics.dump_prometheus(args.metrics_textfile)
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
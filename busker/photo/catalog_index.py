@@ -0,0 +1,177 @@
+import os
+import logging
+import threading
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple, Union
+from busker.photo.file_info import FileInfo, to_digest
+from busker.photo.perceptual import BKTree
+from busker.photo import sql
+
+if TYPE_CHECKING:
+    from busker.photo.store import ObjectStore
+
+
+logger = logging.getLogger("busker.photo.catalog_index")
+logger.setLevel(logging.INFO)
+
+
+def _captured_at_key(captured_at: Union[datetime, str, None]) -> str:
+    """DBの撮影日時（文字列）とFileInfoの撮影日時（datetime）を同じ形式にする"""
+    return str(captured_at) if captured_at is not None else ''
+
+
+class CatalogIndex:
+    """登録済みファイル情報の、同一ファイル判定とファイル名重複チェック用のメモリ上の索引
+
+    実行開始時にload()でDBから読み込み、登録時にadd()で更新することで、判定ごとのSQLを不要にする。
+    同一ファイルはFileInfo.hash_engineと同じアルゴリズムのhashだけを対象とする。
+    target_pathを指定した場合、hashが未計算（段階的な同一ファイル判定で登録）または異なるアルゴリズムの登録済みファイルは、
+    サイズと撮影日時が一致するファイルの判定時に保存先のファイルからhashを計算し、flush()でDBに反映する。
+    storeを指定した場合、内容を保存済みのファイルは新しいhashでも内容を参照できるようにする（ObjectStore.rekey）。
+    """
+
+    def __init__(self, hash_algorithm: str, target_path: Optional[str] = None,
+                 store: Optional['ObjectStore'] = None) -> None:
+        self.hash_algorithm = hash_algorithm
+        self.target_path = target_path
+        self.store = store
+        # (サイズ, hashのバイト列, 撮影日時)
+        self.keys: Set[Tuple[int, Union[bytes, str], str]] = set()
+        # (サイズ, 撮影日時)、段階的な同一ファイル判定でhash計算が必要かの判定に使う
+        self.size_keys: Set[Tuple[int, str]] = set()
+        # 保存先の相対パスごとのファイル名
+        self.names: Dict[str, Set[str]] = {}
+        # (保存先の相対パス, 元のファイル名)ごとに使用済みの連番の最大値
+        self.suffixes: Dict[Tuple[str, str], int] = {}
+        # hashのない登録済みファイルの(サイズ, 撮影日時)ごとの(ID, 保存先の相対パス, 名称, 元のアルゴリズム, 元のhash)
+        self.unhashed: Dict[Tuple[int, str], List[Tuple[int, str, str, Optional[str], Optional[str]]]] = {}
+        # 保存先のファイルから計算し、DBに未反映の(hash, アルゴリズム, ID, サイズ, 元のアルゴリズム, 元のhash)、
+        # 判定と反映は別スレッドの場合がある
+        self.backfilled: List[Tuple[str, str, int, int, Optional[str], Optional[str]]] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, conn, hash_algorithm: str, target_path: Optional[str] = None,
+             store: Optional['ObjectStore'] = None) -> 'CatalogIndex':
+        """登録済みファイル情報をDBから読み込む"""
+        index = cls(hash_algorithm, target_path, store)
+        for id, size, hash, captured_at, row_hash_algorithm, save_to, name in sql.get_index_rows(conn):
+            digest = to_digest(hash) if hash is not None and row_hash_algorithm == hash_algorithm else None
+            index._add(size, digest, captured_at, save_to, name)
+            if digest is None and target_path is not None:
+                index.unhashed.setdefault((size, _captured_at_key(captured_at)), []).append(
+                    (id, save_to, name, row_hash_algorithm if hash is not None else None, hash))
+        logger.info(f'{len(index.size_keys)} file keys and {len(index.names)} folders have been indexed.')
+        return index
+
+    def _add(self, size: int, digest, captured_at, save_to: str, name: str) -> None:
+        captured_at = _captured_at_key(captured_at)
+        self.size_keys.add((size, captured_at))
+        if digest is not None:
+            self.keys.add((size, digest, captured_at))
+        self.names.setdefault(save_to, set()).add(name)
+
+    def add(self, file_info: FileInfo) -> None:
+        """登録するファイル情報を索引に追加する"""
+        self._add(file_info.size,
+                  file_info.digest if file_info.hash_algorithm == self.hash_algorithm else None,
+                  file_info.captured_at,
+                  file_info.save_to,
+                  file_info.name)
+
+    def contains(self, file_info: FileInfo) -> bool:
+        """同一ファイル（サイズ、hash、撮影日時が一致）が登録済みかを返す"""
+        if file_info.digest is None or file_info.hash_algorithm != self.hash_algorithm:
+            return False
+        captured_at = _captured_at_key(file_info.captured_at)
+        if self.unhashed and (file_info.size, captured_at) in self.unhashed:
+            self._backfill(file_info.size, captured_at)
+        return (file_info.size, file_info.digest, captured_at) in self.keys
+
+    def _backfill(self, size: int, captured_at: str) -> None:
+        """サイズと撮影日時が一致する、hashのない登録済みファイルのhashを保存先のファイルから計算する"""
+        for id, save_to, name, old_algorithm, old_hash in self.unhashed.pop((size, captured_at)):
+            full_name = os.path.join(self.target_path, save_to, name)       # type: ignore
+            if not os.path.isfile(full_name):
+                logger.warning(f'Collected file {full_name} does not exist, its hash can not be computed.')
+                continue
+            hash = FileInfo.hash_engine.hash_file(full_name)
+            self.keys.add((size, to_digest(hash), captured_at))       # type: ignore
+            with self._lock:
+                self.backfilled.append((hash, self.hash_algorithm, id, size, old_algorithm, old_hash))
+
+    def flush(self, conn) -> None:
+        """保存先のファイルから計算したhashをDBに反映する、commitは呼び出し側で行う"""
+        with self._lock:
+            backfilled, self.backfilled = self.backfilled, []
+        if backfilled:
+            sql.update_backfilled_hashes(conn, [row[:3] for row in backfilled])
+            if self.store is not None:
+                for hash, hash_algorithm, id, size, old_algorithm, old_hash in backfilled:
+                    self.store.rekey(old_algorithm, old_hash, hash_algorithm, hash, size)
+            logger.info(f'Hashes of {len(backfilled)} collected files have been computed.')
+
+    def contains_size(self, file_info: FileInfo) -> bool:
+        """サイズと撮影日時が一致するファイルが登録済みかを返す"""
+        return (file_info.size, _captured_at_key(file_info.captured_at)) in self.size_keys
+
+    def contains_name(self, save_to: str, name: str) -> bool:
+        return name in self.names.get(save_to, ())
+
+    def resolve_name(self, save_to: str, name: str) -> str:
+        """保存先フォルダーで重複しないファイル名を返す、重複する場合は連番（_01、_02…）を付ける
+
+        前回使用した連番の次から探すため、同名ファイルが多いフォルダーでも探索は定数回で済む。
+        返したファイル名は使用済みとして扱う。target_pathを指定した場合、未登録のファイルが保存先にある名前も使用しない。
+        """
+        names = self.names.setdefault(save_to, set())
+        file_name = name
+        if self._is_used(save_to, names, file_name):
+            base, extension = os.path.splitext(name)
+            count = self.suffixes.get((save_to, name), 0)
+            while self._is_used(save_to, names, file_name):
+                # ファイル名の重複がなくなるまでループする
+                count += 1
+                file_name = base + '_' + str(count).zfill(2) + extension
+            self.suffixes[(save_to, name)] = count
+        names.add(file_name)
+        return file_name
+
+    def _is_used(self, save_to: str, names: Set[str], file_name: str) -> bool:
+        if file_name in names:
+            return True
+        return self.target_path is not None and os.path.lexists(os.path.join(self.target_path, save_to, file_name))
+
+
+class SimilarImageIndex:
+    """登録済み画像の知覚hashの索引、サイズ変更や再圧縮した同じ画像（見た目が同じ画像）を検索する
+
+    BK-treeで距離の範囲内の知覚hashだけを比較するため、登録済みの全画像との比較は不要。
+    """
+
+    def __init__(self) -> None:
+        # 知覚hashごとの(保存先の相対パス, 名称)
+        self.tree: BKTree[Tuple[str, str]] = BKTree()
+
+    @classmethod
+    def load(cls, conn) -> 'SimilarImageIndex':
+        """登録済みの知覚hashをDBから読み込む"""
+        index = cls()
+        for phash, save_to, name in sql.get_perceptual_hashes(conn):
+            index.tree.add(phash, (save_to, name))
+        logger.info(f'{index.tree.size} perceptual hashes have been indexed.')
+        return index
+
+    def add(self, file_info: FileInfo) -> None:
+        if file_info.phash is not None:
+            self.tree.add(file_info.phash, (file_info.save_to, file_info.name))      # type: ignore
+
+    def find(self, file_info: FileInfo, max_distance: int) -> Optional[Tuple[int, str, str]]:
+        """知覚hashの距離がmax_distance以内で最も近い登録済み画像の(距離, 保存先の相対パス, 名称)を返す"""
+        if file_info.phash is None:
+            return None
+        results = self.tree.search(file_info.phash, max_distance)
+        if not results:
+            return None
+        distance, (save_to, name) = results[0]
+        return distance, save_to, name
@@ -0,0 +1,121 @@
+import os
+import logging
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+from busker.photo.file_info import FileInfo
+from busker.photo import sql
+
+if TYPE_CHECKING:
+    from busker.photo.catalog_index import CatalogIndex
+
+
+logger = logging.getLogger("busker.photo.dedup")
+logger.setLevel(logging.INFO)
+
+
+class StagedDeduplicator:
+    """サイズ、サンプルhash、全体hashの順に段階的に同一ファイルを判定する
+
+    サイズ（と撮影日時）が一致する登録済みファイルがない場合はhashを計算しない。
+    一致する場合は先頭・末尾のサンプルhashを比較し、サンプルhashも一致した場合のみ全体hashを計算する。
+    登録済みファイル側のhashが未計算、または異なるアルゴリズムで計算済みの場合は、
+    保存先のファイルから現在のアルゴリズムで計算してDBに反映する。
+    indexを指定した場合、サイズと撮影日時が一致するファイルの有無はDBを検索せずに索引で判定する。
+    一致する登録済みファイルはflush()まで条件ごとに1回だけ検索し、計算したhashはflush()でまとめてDBに反映する。
+    DBへの登録をまとめて行う場合、登録前のファイルはadd()で追加し、登録後にflush()で消去する。
+    """
+
+    def __init__(self, conn, target_path: str, index: Optional['CatalogIndex'] = None) -> None:
+        self.conn = conn
+        self.target_path = target_path
+        self.index = index
+        # 登録待ちのファイル情報、(サイズ, 撮影日時)ごと
+        self.pending: Dict[Tuple[int, Any], List[FileInfo]] = {}
+        # 検索済みの登録済みファイル情報、(サイズ, 撮影日時)ごと
+        self.candidates: Dict[Tuple[int, Any], List[FileInfo]] = {}
+        # 保存先のファイルからhashを計算し、DBに未反映の登録済みファイル情報、IDごと
+        self.updated: Dict[int, FileInfo] = {}
+        self.unique_size = 0
+        self.sample_hashed = 0
+        self.full_hashed = 0
+
+    def find_same_file(self, file_info: FileInfo) -> Optional[FileInfo]:
+        """同一ファイルが登録済みの場合、登録済みファイル情報を返す"""
+        if self.index and not self.index.contains_size(file_info):
+            self.unique_size += 1
+            return None
+
+        key = (file_info.size, file_info.captured_at)
+        if key not in self.candidates:
+            self.candidates[key] = sql.get_files_by_size__captured_at(self.conn, file_info.size, file_info.captured_at)
+        candidates = self.candidates[key] + self.pending.get(key, [])
+        if not candidates:
+            self.unique_size += 1
+            return None
+
+        # hashが計算済み（キャッシュ済み）の場合はサンプルhashの比較を省略する
+        if file_info.hash is None:
+            self.sample_hashed += 1
+            sample_hash = file_info.compute_sample_hash()
+            candidates = [candidate for candidate in candidates if self._fill_sample_hash(candidate) == sample_hash]
+            if not candidates:
+                return None
+            self.full_hashed += 1
+
+        hash = file_info.compute_hash()
+        for candidate in candidates:
+            if self._fill_hash(candidate) == hash:
+                return candidate
+        return None
+
+    def add(self, file_info: FileInfo) -> None:
+        """登録待ちのファイル情報を判定対象に追加する、ファイルは保存先に存在すること"""
+        self.pending.setdefault((file_info.size, file_info.captured_at), []).append(file_info)
+
+    def flush(self) -> None:
+        """計算したhashをDBに反映し、登録待ちと検索済みのファイル情報を消去する、commitは呼び出し側で行う"""
+        if self.updated:
+            sql.update_hashes_many(self.conn, list(self.updated.values()))
+            self.updated = {}
+        self.pending = {}
+        self.candidates = {}
+
+    def _catalog_file(self, candidate: FileInfo) -> Optional[str]:
+        full_name = os.path.join(self.target_path, candidate.save_to, candidate.name)
+        if os.path.isfile(full_name):
+            return full_name
+
+        logger.warning(f'Collected file {full_name} does not exist, its hash can not be computed.')
+        return None
+
+    def _reset_other_hash_algorithm(self, candidate: FileInfo) -> None:
+        if candidate.hash_algorithm != FileInfo.hash_engine.name:
+            candidate.hash = None       # type: ignore
+            candidate.sample_hash = None
+            candidate.hash_algorithm = FileInfo.hash_engine.name
+
+    def _fill_sample_hash(self, candidate: FileInfo) -> Optional[str]:
+        self._reset_other_hash_algorithm(candidate)
+        if candidate.sample_hash is None:
+            full_name = self._catalog_file(candidate)
+            if full_name:
+                candidate.sample_hash = FileInfo.read_sample_hash(full_name, candidate.size)
+                self._update_hashes(candidate)
+        return candidate.sample_hash
+
+    def _fill_hash(self, candidate: FileInfo) -> Optional[str]:
+        self._reset_other_hash_algorithm(candidate)
+        if candidate.hash is None:
+            full_name = self._catalog_file(candidate)
+            if full_name:
+                candidate.hash = FileInfo.read_hash(full_name)
+                self._update_hashes(candidate)
+        return candidate.hash
+
+    def _update_hashes(self, candidate: FileInfo) -> None:
+        # 登録待ちのファイル情報は、登録時に計算済みのhashが反映される
+        if candidate.id is not None:
+            self.updated[candidate.id] = candidate
+
+    def log_summary(self) -> None:
+        logger.info(f'Staged dedup: {self.unique_size} unique sizes, {self.sample_hashed} sample hashed, '
+                    f'{self.full_hashed} full hashed.')
@@ -0,0 +1,738 @@
+import os
+import time
+import shutil
+import sqlite3
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial, wraps
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from busker.file.fastcopy import copy_file
+from busker.photo.file_info import FileInfo, read_all_files
+from busker.photo.hash_cache import HashCache
+from busker.photo.dedup import StagedDeduplicator
+from busker.photo.catalog_index import CatalogIndex, SimilarImageIndex
+from busker.photo.hasher import HashEngine
+from busker.photo.pipeline import ImportPipeline
+from busker.photo.journal import ImportJournal, partial_name, PARTIAL_SUFFIX, STAGING_FOLDER
+from busker.photo.snapshot import DirectorySnapshot
+from busker.photo.scrub import Scrubber
+from busker.photo.store import OBJECTS_FOLDER, SHARED, ObjectStore
+from busker.photo.walker import FileWalker, WalkItem
+from busker.photo.watch import Debouncer, create_watcher
+from busker.photo.metrics import metrics
+from busker.photo.migration import backfill_perceptual_hashes, migrate_hash_algorithm
+from busker.photo import plan
+from busker.photo import sql
+
+
+logger = logging.getLogger("busker.photo.engine")
+logger.setLevel(logging.INFO)
+
+# 読み込みと同時にコピーした場合のコピー方式（FileInfo.load_copying）
+FUSED = 'fused'
+
+
+def activated(method: Callable[..., Any]) -> Callable[..., Any]:
+    """PhotoImporterのメソッドを、設定を反映した状態（PhotoImporter.activate）で実行する"""
+    @wraps(method)
+    def wrapper(self: 'PhotoImporter', *args: Any, **kwargs: Any) -> Any:
+        with self.activate():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class PhotoImporter:
+    """写真を元の場所から保存先へコピーし、ファイル情報をDBに収集する処理
+
+    画面（busker.photo.organizer）とコマンドライン（python -m busker.photo）の共通の処理で、tkinterには依存しない。
+    設定はクラス属性で、インスタンスごとに変更する場合はキーワード引数で指定する。
+    progressを指定した場合、進捗を{'event': イベント名, ...}の辞書で通知する。
+    """
+    # ファイル情報収集（MD5計算、EXIF読込）の並列数、0の場合は逐次処理
+    scan_workers = 0
+    # 並列処理の方式、'thread'または'process'
+    scan_executor = 'thread'
+    # 同一ファイルの判定方式、'full'は全ファイルのMD5で判定、'staged'はサイズ、サンプルhash、MD5の順に段階的に判定
+    dedup_mode = 'full'
+    # hash計算のアルゴリズム（busker.photo.hasher.available_algorithms()を参照）と読み込み方式
+    hash_algorithm = 'md5'
+    hash_use_mmap = False
+    # SQL文ごとの実行統計を収集し、収集処理の終了時にログ出力する
+    collect_query_stats = False
+    # 保存先が同じファイルシステムの場合、コピーせずにハードリンクを作成する（保存先の変更は元ファイルにも反映される）
+    copy_hardlink = False
+    # 1以上の場合、コピー処理を段階ごとのスレッドで並行処理する（ImportPipeline）、hash計算とコピーのスレッド数
+    # dedup_mode = 'full'の場合のみ有効
+    pipeline_hash_workers = 0
+    pipeline_copy_workers = 2
+    # 元フォルダーと保存先が同じ、中断した取込処理を途中から再開する（ImportPipelineは使用しない）
+    resume = False
+    # 保存先の確認で、前回の確認から変更のないフォルダーも含めて全てのファイルを確認する
+    inspect_all = False
+    # 走査するファイル名のパターン（fnmatch形式）、includeを指定した場合は一致するファイルのみ走査する
+    # excludeに一致するフォルダーは配下を走査しない
+    include_patterns: Tuple[str, ...] = ()
+    exclude_patterns: Tuple[str, ...] = ('.DS_Store', 'Thumbs.db', 'desktop.ini', '@eaDir', '#recycle',
+                                         '*' + PARTIAL_SUFFIX, OBJECTS_FOLDER)
+    # 画像・動画（FileType）以外のファイルを走査しない
+    media_only = False
+    # 知覚hashの距離がこの値以内の画像が登録済みの場合、見た目が同じ画像とする（Noneの場合は判定しない）
+    # 'flag'はコピーして通知のみ、'skip'はコピーしない、ImportPipelineは使用しない
+    near_duplicate_distance: Optional[int] = None
+    near_duplicate_action = 'flag'
+    # 件数と段階ごとの処理時間を収集し（busker.photo.metrics）、コピー中は処理速度と残り時間を定期的に通知する
+    collect_metrics = False
+    # 元ファイルを1回だけ読み込み、hash計算・EXIF読込と同時に保存先へコピーする（FileInfo.load_copying）
+    # 同一ファイルの場合はコピーしたファイルを削除する。低速なカードリーダー、ネットワーク上の元フォルダー向け
+    # scan_workers = 0の場合のみ有効で、copy_hardlink、ImportPipelineとは併用しない
+    fused_copy = False
+    # ファイルの内容をhashごとに1つだけ保存し、年・月のフォルダーにはハードリンクを作成する（busker.photo.store）
+    # 保存先はハードリンクに対応したファイルシステムであること、ImportPipelineは使用しない
+    content_store = False
+    # 監視（watch）で、ファイルのサイズと更新日時がこの秒数変わらなくなってから取り込む
+    watch_settle_seconds = 2.0
+    # 監視で一度に取り込むファイル数の上限
+    watch_batch_size = 50
+    # inotifyを使用せずに、watch_poll_interval秒ごとに走査する（inotifyを使用できない場合も走査する）
+    watch_polling = False
+    watch_poll_interval = 5.0
+    # 保存先の確認（scrub）で読み込むスレッド数と、1秒あたりの読み込みバイト数・読み込み回数の上限（Noneは無制限）
+    scrub_workers = 2
+    scrub_bytes_per_sec: Optional[float] = None
+    scrub_iops: Optional[float] = None
+
+    def __init__(self, conn, progress: Optional[Callable[[Dict[str, Any]], None]] = None, **options: Any) -> None:
+        for key, value in options.items():
+            if not hasattr(type(self), key):
+                raise TypeError(f"Unknown option '{key}'.")
+            setattr(self, key, value)
+        if self.near_duplicate_action not in ('flag', 'skip'):
+            raise ValueError(f"Unknown near_duplicate_action '{self.near_duplicate_action}', use 'flag' or 'skip'.")
+        self.conn = conn
+        self.progress = progress
+        # テーブル定義
+        sql.create_table_file_info(conn)
+        # FileInfoに反映するhashの計算方法、実行中だけ反映する（activate）
+        self.hash_engine = HashEngine(self.hash_algorithm, use_mmap=self.hash_use_mmap)
+        other_hashes = sql.get_count_by_other_hash_algorithm(conn, self.hash_algorithm)
+        if other_hashes:
+            # 同一ファイルの判定に必要なファイルは、判定時に保存先のファイルから再計算する（CatalogIndex、StagedDeduplicator）
+            logger.info(f'{other_hashes} files in the catalog have hashes of other algorithms than '
+                        f'{self.hash_algorithm}, they are rehashed when needed. '
+                        f'Run "python -m busker.photo --hash {self.hash_algorithm} migrate TARGET" to rehash all.')
+        # 前回実行時から変更のないファイルはhash計算を省略する
+        self.hash_cache = HashCache(conn)
+        # 保存先のフォルダーごとの状態、変更のないフォルダーは保存先の確認を省略する
+        self.snapshot = DirectorySnapshot(conn)
+        # 登録済みファイル情報の索引、収集処理ごとに読み込む
+        self.index: Optional[CatalogIndex] = None
+        # 元フォルダーのファイル数、collect_metricsがTrueの場合のみ残り時間の見積もりのために別のスレッドで数える
+        self.total_files: Optional[int] = None
+        self.similar_index: Optional[SimilarImageIndex] = None
+        # 監視中の取込で、読み込みと同時にコピーするフォルダー（watch）
+        self.staging_folder: Optional[str] = None
+        self.walker = FileWalker(self.include_patterns, self.exclude_patterns, self.media_only)
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.scanned = 0
+        self.registered = 0
+        self.copied = 0
+        self.duplicated = 0
+        # 見た目が同じ画像が登録済みだったファイル数
+        self.near_duplicated = 0
+        # 再開した取込処理で処理済みのためスキップしたファイル数
+        self.skipped = 0
+        # コピー方式ごとのファイル数
+        self.copy_methods: Dict[str, int] = {}
+        self.walker.files = 0
+        self.walker.skipped = dict.fromkeys(self.walker.skipped, 0)
+        self.hash_cache.hits = self.hash_cache.misses = 0
+        self.started_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        """収集処理の件数と経過時間（秒）"""
+        return {'scanned': self.scanned,
+                'registered': self.registered,
+                'copied': self.copied,
+                'duplicated': self.duplicated,
+                'near_duplicated': self.near_duplicated,
+                'skipped': self.skipped,
+                'copy_methods': dict(self.copy_methods),
+                'filtered': dict(self.walker.skipped),
+                'cache_hits': self.hash_cache.hits,
+                'cache_misses': self.hash_cache.misses,
+                'elapsed': round(time.monotonic() - self.started_at, 3)}
+
+    def report(self, event: str, **fields: Any) -> None:
+        if self.progress:
+            self.progress(dict(event=event, **fields))
+
+    @contextmanager
+    def activate(self) -> Iterator[None]:
+        """hashの計算方法、知覚hashの計算、計測の設定を実行中だけ反映し、終了時に元に戻す
+
+        設定はプロセス全体で共有する（FileInfo、sql.query_stats、metrics）ため、同じプロセスの他のPhotoImporterの
+        実行に設定を残さない。異なる設定の取込処理を同時に実行することはできない。
+        """
+        previous = (FileInfo.hash_engine, FileInfo.with_phash, sql.query_stats.enabled, metrics.enabled)
+        FileInfo.hash_engine = self.hash_engine
+        FileInfo.with_phash = self.near_duplicate_distance is not None
+        sql.query_stats.enabled = self.collect_query_stats
+        metrics.enabled = self.collect_metrics
+        try:
+            yield
+        finally:
+            FileInfo.hash_engine, FileInfo.with_phash, sql.query_stats.enabled, metrics.enabled = previous
+
+    @activated
+    def collect(self, source_path: str, target_path: str) -> None:
+        """写真を元の場所から保存先へコピーする、保存先に未登録のファイルがある場合は先にDBへ登録する"""
+        # 登録済みファイル情報の索引は収集処理ごとに読み込み直す
+        self.index = None
+        self.similar_index = None
+        self.reset_stats()
+        metrics.reset()
+        self.total_files = None
+
+        # 中断した取込処理のコピー途中のファイルは、保存先の確認の前に削除する
+        journal = ImportJournal(self.conn, source_path, target_path)
+        journal.start(self.resume)
+        if metrics.enabled:
+            # 取込処理と並行して数え、数え終わるまでは残り時間を見積もらない
+            threading.Thread(target=self.count_files, args=(source_path, journal),
+                             name='busker-count', daemon=True).start()
+
+        # 保存先フォルダーにあるファイルの情報がDBに未登録の場合は追加登録する
+        if sql.get_count(self.conn):
+            self.inspect(target_path)
+
+        self.report('copy_started')
+        logger.info('Copying and collecting photos...')
+        # 写真を元の場所から保存先にコピーし、DBにファイル情報を登録する
+        if self.pipeline_hash_workers and self.dedup_mode == 'full' and not self.resume \
+                and self.near_duplicate_distance is None and not self.is_fused() and not self.content_store:
+            self.copy_photos_by_pipeline(source_path, target_path)
+        else:
+            self.copy_photos(source_path, target_path, journal)
+        journal.finish()
+        self.walker.log_summary()
+        self.report('copy_finished')
+        logger.info('Coping and collecting photos has finished.')
+        if sql.query_stats.enabled:
+            sql.query_stats.log_summary()
+        if metrics.enabled:
+            metrics.log_summary()
+
+    @activated
+    def watch(self, source_path: str, target_path: str, stop: Optional[threading.Event] = None) -> None:
+        """元フォルダーを監視し、追加されたファイルを書き込みが終わってから順次取り込む、stopを設定するまで終わらない
+
+        開始時に一度collectで元フォルダー全体を取り込み、以降は追加・変更されたファイルだけを
+        watch_batch_size件ずつcopy_photosで取り込むため、元フォルダー全体は走査し直さない。
+        collect中に追加されたファイルを見逃さないよう、監視はcollectの前に開始する（取込済みのファイルは同一ファイルになる）。
+        """
+        watcher = create_watcher(source_path, self.walker, self.watch_polling, self.watch_poll_interval)
+        try:
+            self.collect(source_path, target_path)
+            # copy_photosの取込ごとの準備（キャッシュの読み込み、読み込みと同時にコピーするフォルダーの作成）は一度だけ行う
+            self.hash_cache.load(source_path)
+            if self.is_fused():
+                self.staging_folder = self.prepare_staging_folder(target_path)
+            debouncer = Debouncer(self.watch_settle_seconds)
+            self.report('watch_started', path=source_path)
+            logger.info(f'Watching {source_path} by {type(watcher).__name__}.')
+            while stop is None or not stop.is_set():
+                for full_name in watcher.poll(min(self.watch_settle_seconds, 1.0)):
+                    debouncer.add(full_name)
+                files = [(path, [entry]) for path, entries in debouncer.ready() for entry in entries]
+                for start in range(0, len(files), self.watch_batch_size):
+                    self.ingest(source_path, target_path, files[start:start + self.watch_batch_size])
+        finally:
+            watcher.close()
+            if self.staging_folder is not None:
+                shutil.rmtree(self.staging_folder, ignore_errors=True)
+                self.staging_folder = None
+            self.report('watch_finished')
+
+    def ingest(self, source_path: str, target_path: str, files: List[WalkItem]) -> None:
+        """監視で検出したファイルを取り込む、取込ごとの準備はwatchで済ませておく"""
+        self.report('ingest_started', files=len(files))
+        self.copy_photos(source_path, target_path, walk=files, setup=False)
+
+    def scrub(self, target_path: str, limit: Optional[int] = None, orphans: bool = True) -> Dict[str, Any]:
+        """保存先のファイルが登録済みのサイズ、hashと一致するかを、確認日時の古い順に最大limit件確認する（Scrubber）
+
+        orphansがTrueの場合は、保存先にありDBに登録されていないファイルも探す。
+        """
+        self.report('scrub_started')
+        scrubber = Scrubber(self.conn, target_path, self.scrub_workers, self.scrub_bytes_per_sec, self.scrub_iops,
+                            self.walker, self.progress)
+        summary = scrubber.run(limit, orphans)
+        self.report('scrub_finished', **summary,
+                    missing_files=scrubber.missing, changed_files=scrubber.changed,
+                    unreadable_files=scrubber.unreadable, orphaned_files=scrubber.orphaned)
+        return summary
+
+    @activated
+    def inspect(self, target_path: str) -> None:
+        """保存先フォルダーにあるファイル情報が未収集の場合、DBに追加収集する"""
+        self.report('inspect_started')
+        logger.info('Collecting photo information...')
+        self.inspect_collected_files(target_path)
+        if FileInfo.with_phash:
+            # 見た目が同じ画像の判定を有効にする前に登録した画像は、保存先のファイルから知覚hashを計算する
+            backfill_perceptual_hashes(self.conn, target_path)
+        self.conn.commit()
+        self.report('inspect_finished')
+        logger.info('Collecting photo information has finished.')
+
+    def load_index(self, target_path: str) -> CatalogIndex:
+        """登録済みファイル情報の索引を読み込む、実行中は登録ごとに索引を更新して使い回す
+
+        hashのない登録済みファイルは、判定に必要になった時点で保存先のファイルからhashを計算する（CatalogIndex.flush）。
+        """
+        if self.index is None:
+            self.index = CatalogIndex.load(self.conn, FileInfo.hash_engine.name, target_path,
+                                           ObjectStore.open_existing(self.conn, target_path))
+        return self.index
+
+    def load_similar_index(self) -> SimilarImageIndex:
+        """登録済み画像の知覚hashの索引を読み込む"""
+        if self.similar_index is None:
+            self.similar_index = SimilarImageIndex.load(self.conn)
+        return self.similar_index
+
+    def inspect_collected_files(self, target_path: str) -> None:
+        """保存先フォルダーにあるファイル情報が未収集の場合、DBに追加収集する
+
+        inspect_allがFalseの場合、前回の確認から変更のないフォルダー（DirectorySnapshot）のファイルは確認しない。
+        登録済みのファイルはファイル名だけで判定するため、hash計算とEXIF読込は未登録のファイルだけ行う。
+        """
+        index = self.load_index(target_path)
+        self.hash_cache.load(target_path)
+        self.snapshot.load(target_path)
+        if self.inspect_all:
+            self.snapshot.entries = {}
+        deduplicator = StagedDeduplicator(self.conn, target_path, index)
+        for file_infos in read_all_files(target_path, 1000, self.scan_workers, self.scan_executor,
+                                         cache=self.hash_cache, with_hash=self.dedup_mode != 'staged',
+                                         walk=self.snapshot.walk(target_path, self.walker), lazy=True):
+            new_file_infos: List[FileInfo] = []
+            for file_info in file_infos:
+                file_info.save_to = file_info.get_relative_path(target_path)
+                # ファイルがすでに収集済みかをチェックする、収集済みの場合は特に処理なし
+                if not index.contains_name(file_info.save_to, file_info.name):
+                    # 未収集の場合、ファイルの名称、サイズとMD5で同一ファイルが既に収集済みかをチェックする
+                    if self.is_collected(index, deduplicator, file_info):
+                        # 同一ファイルが既に収集済の場合は特に処理なし
+                        logger.debug(f'Picture {file_info.full_name} info already exists, it will not be collected.')     # noqa
+                    else:           # 同ファイルが未収集の場合、追加収集する
+                        index.add(file_info)
+                        deduplicator.add(file_info)
+                        new_file_infos.append(file_info)
+                        logger.debug(f'File {file_info.full_name} has been added to the database.')     # noqa
+            sql.register_file_infos(self.conn, new_file_infos)
+            index.flush(self.conn)
+            deduplicator.flush()
+            self.registered += len(new_file_infos)
+            self.report('batch', registered=self.registered)
+        self.hash_cache.flush()
+        # フォルダーの状態は、登録したファイル情報と一緒にcommitする
+        self.snapshot.flush(target_path)
+        if self.dedup_mode == 'staged':
+            deduplicator.log_summary()
+
+    @activated
+    def copy_photos(self, source_path: str, target_path: str, journal: Optional[ImportJournal] = None,
+                    walk: Optional[Iterable[WalkItem]] = None, setup: bool = True) -> None:
+        """指定フォルダー下にある写真ファイルを保存先にコピーし、ファイル情報をDBに収集する
+
+        journalを指定した場合、処理済みの元ファイルをバッチごとに記録し、再開した取込処理の処理済みファイルはスキップする。
+        walkを指定した場合は走査せずに、walkのファイルだけをコピーする。
+        setupがFalseの場合、キャッシュの読み込み、読み込みと同時にコピーするフォルダーの作成・削除、
+        保存先のフォルダーの状態の書き込みは呼び出し側で行う（監視中の取込）。
+        """
+        current_path = ''
+        # コピー先のフォルダーごとの、取込処理で作成したか
+        target_folders: Dict[str, bool] = {}
+        index = self.load_index(target_path)
+        if setup:
+            self.hash_cache.load(source_path)
+            staging_folder = self.prepare_staging_folder(target_path, journal) if self.is_fused() else None
+        else:
+            staging_folder = self.staging_folder if self.is_fused() else None
+        deduplicator = StagedDeduplicator(self.conn, target_path, index)
+        store = ObjectStore(self.conn, target_path) if self.content_store else None
+        for file_infos in read_all_files(source_path, 500, self.scan_workers, self.scan_executor,
+                                         cache=self.hash_cache, with_hash=self.dedup_mode != 'staged',
+                                         walk=walk if walk is not None else
+                                         self.walker.walk(source_path, skip=journal.is_done if journal else None),
+                                         lazy=staging_folder is not None):
+            new_file_infos: List[FileInfo] = []
+            for file_info in file_infos:
+                self.scanned += 1
+                source_name = file_info.name
+                # 現在処理中のフォルダー名を通知する
+                if current_path != file_info.path:
+                    current_path = file_info.path
+                    self.report('directory', path=current_path)
+                    logger.info(f'Collecting files from directory {current_path}.')
+
+                # 読み込みと同時にコピーしたファイル、キャッシュから読み込んだファイルはNone
+                staged_file = None
+                if staging_folder is not None:
+                    staged_file = os.path.join(staging_folder, partial_name(source_name))
+                    if not file_info.load_copying(staged_file):
+                        staged_file = None
+
+                # ファイルの名称、サイズとMD5で同一ファイルが既に収集済みかをチェックする
+                if self.is_collected(index, deduplicator, file_info):
+                    # 同一ファイルが既に収集済の場合は特に処理なし
+                    self.duplicated += 1
+                    metrics.inc('duplicates')
+                    if journal:
+                        journal.add(file_info.path, source_name, 'duplicated')
+                    logger.debug(f'Picture {file_info.full_name} already exists, it will not be copied.')     # noqa
+                    if staged_file:
+                        os.remove(staged_file)
+                elif self.check_near_duplicate(file_info):
+                    # 見た目が同じ画像が登録済みで、コピーしない場合
+                    if staged_file:
+                        os.remove(staged_file)
+                    if journal:
+                        journal.add(file_info.path, source_name, 'near_duplicated')
+                else:           # 同ファイルが未収集の場合、追加収集する
+                    target_folder = os.path.join(target_path, file_info.save_to)
+                    if target_folder not in target_folders:
+                        # 保存先フォルダーに年・月ごとにサブフォルダーを作成する
+                        target_folders[target_folder] = not os.path.isdir(target_folder)
+                        os.makedirs(target_folder, exist_ok=True)
+                    original_file = file_info.full_name
+
+                    # ファイル名重複チェック
+                    file_name = index.resolve_name(file_info.save_to, file_info.name)
+                    if file_name != file_info.name:
+                        metrics.inc('collisions')
+
+                    # 写真を保存先へコピー、中断時にコピー途中のファイルが残らないよう別名でコピーしてから名前を変更する
+                    target_file = os.path.join(target_folder, file_name)
+                    if journal:
+                        journal.add_folder(file_info.save_to)
+                    with metrics.timer('copy'):
+                        file_info.copy_method = self.write_target(store, original_file, target_file, file_info,
+                                                                  staged_file, journal.run_id if journal else None)
+                    metrics.inc('copied_files')
+                    metrics.inc('copied_bytes', file_info.size)
+                    self.copy_methods[file_info.copy_method] = self.copy_methods.get(file_info.copy_method, 0) + 1
+                    # コピー先のファイルも次回以降のhash計算を省略する
+                    self.hash_cache.put(target_folder, file_name, os.stat(target_file),
+                                        file_info.hash_algorithm, file_info.hash, file_info.captured_at,
+                                        file_info.phash)
+
+                    # ファイル情報の収集
+                    file_info.name = file_name
+                    index.add(file_info)
+                    deduplicator.add(file_info)
+                    if self.near_duplicate_distance is not None:
+                        self.load_similar_index().add(file_info)
+                    new_file_infos.append(file_info)
+                    if journal:
+                        journal.add(file_info.path, source_name, 'copied')
+                    logger.info(f'\tFile {original_file} has been copied to {target_file} by {file_info.copy_method}.')
+            sql.register_file_infos(self.conn, new_file_infos)
+            index.flush(self.conn)
+            deduplicator.flush()
+            self.hash_cache.flush()
+            if store is not None:
+                store.flush()
+            if journal:
+                # 処理済みファイルの記録は、ファイル情報と同じトランザクションでcommitする
+                journal.flush(current_path)
+            self.conn.commit()
+            self.copied += len(new_file_infos)
+            self.report('batch', scanned=self.scanned, copied=self.copied, duplicated=self.duplicated)
+            self.report_throughput()
+        if journal:
+            self.skipped = journal.skipped
+        if setup:
+            # コピーしたファイルは登録済みのため、次回の保存先の確認では変更なしとする
+            for target_folder, created in target_folders.items():
+                self.snapshot.refresh(target_folder, created)
+            self.snapshot.flush(target_path)
+            self.conn.commit()
+            if staging_folder is not None:
+                shutil.rmtree(staging_folder, ignore_errors=True)
+        if store is not None:
+            store.log_summary()
+        logger.info(f'Copied files by method: {self.copy_methods}')
+        if self.dedup_mode == 'staged':
+            deduplicator.log_summary()
+
+    def write_target(self, store: Optional[ObjectStore], source_file: str, target_file: str, file_info: FileInfo,
+                     staged_file: Optional[str] = None, run_id: Optional[int] = None) -> str:
+        """元ファイルを保存先のファイルとして書き込み、コピー方式を返す
+
+        staged_fileは読み込みと同時にコピー済みのファイル（fused_copy）で、コピーせずに移動する。
+        storeを指定した場合は内容をstoreに保存し、保存先のファイルは内容へのハードリンクにする。
+        中断時にコピー途中のファイルが残らないよう、別名（run_idの取込処理の名前）でコピーしてから名前を変更する。
+        """
+        if store is None:
+            if staged_file:
+                # 同じファイルシステム内で名前を変更するだけ
+                os.replace(staged_file, target_file)
+                return FUSED
+            partial_file = os.path.join(os.path.dirname(target_file),
+                                        partial_name(os.path.basename(target_file), run_id))
+            method = copy_file(source_file, partial_file, self.copy_hardlink)
+            os.replace(partial_file, target_file)
+            return method
+
+        if staged_file:
+            method = store.add(file_info, staged_file, lambda src, dst: os.replace(src, dst) or FUSED)
+            if method == SHARED:
+                os.remove(staged_file)
+        else:
+            if file_info.hash is None:
+                # 段階的な同一ファイル判定では、全体hashを計算していないファイルがある
+                file_info.hash = FileInfo.read_hash(source_file)
+            method = store.add(file_info, source_file, lambda src, dst: copy_file(src, dst, self.copy_hardlink))
+        store.link(file_info, target_file)
+        return method
+
+    def is_fused(self) -> bool:
+        """fused_copyが有効か、遅延読込は逐次処理の場合のみのため、並列処理とハードリンクの場合は無効"""
+        return self.fused_copy and self.scan_workers == 0 and not self.copy_hardlink
+
+    def prepare_staging_folder(self, target_path: str, journal: Optional[ImportJournal] = None) -> str:
+        """読み込みと同時にコピーする、実行中の処理だけが使用するフォルダーを作成する
+
+        journalを指定した場合は取込処理ごとの名前にし、中断した場合はImportJournal.start()で削除する。
+        フォルダー名はPARTIAL_SUFFIXで終わるため、保存先の確認（exclude_patterns）では走査しない。
+        """
+        os.makedirs(target_path, exist_ok=True)
+        if journal is None:
+            return tempfile.mkdtemp(prefix=STAGING_FOLDER + '.', suffix=PARTIAL_SUFFIX, dir=target_path)
+        staging_folder = os.path.join(target_path, partial_name(STAGING_FOLDER, journal.run_id))
+        os.makedirs(staging_folder, exist_ok=True)
+        return staging_folder
+
+    @activated
+    def plan_photos(self, source_path: str, target_path: str, plan_file: str) -> None:
+        """写真をコピーせずに、取込の計画（busker.photo.plan）をplan_fileに出力する
+
+        copy_photosと同じく同一ファイルと保存先のファイル名を判定するが、計画には全体hashが必要なため、
+        dedup_modeにかかわらず全体hashで判定する。保存先に未登録のファイルがある場合は先にDBへ登録する。
+        """
+        self.index = None
+        self.similar_index = None
+        self.reset_stats()
+        if sql.get_count(self.conn):
+            self.inspect(target_path)
+
+        self.report('plan_started')
+        index = self.load_index(target_path)
+        self.hash_cache.load(source_path)
+        with plan.PlanWriter(plan_file, source_path, target_path, FileInfo.hash_engine.name) as writer:
+            for file_infos in read_all_files(source_path, 500, self.scan_workers, self.scan_executor,
+                                             cache=self.hash_cache, walk=self.walker.walk(source_path)):
+                for file_info in file_infos:
+                    self.scanned += 1
+                    source_name = file_info.name
+                    if index.contains(file_info):
+                        self.duplicated += 1
+                        writer.add(plan.DUPLICATE, file_info, source_name)
+                    elif self.check_near_duplicate(file_info):
+                        writer.add(plan.NEAR_DUPLICATE, file_info, source_name)
+                    else:
+                        # 計画内のファイル同士も同一ファイルとファイル名の重複を判定する
+                        file_info.name = index.resolve_name(file_info.save_to, file_info.name)
+                        index.add(file_info)
+                        if self.near_duplicate_distance is not None:
+                            self.load_similar_index().add(file_info)
+                        writer.add(plan.COPY, file_info, source_name)
+                self.hash_cache.flush()
+                index.flush(self.conn)
+                self.conn.commit()
+                self.report('batch', scanned=self.scanned, duplicated=self.duplicated)
+        # 計画した登録は実行時にDBから読み込み直す
+        self.index = None
+        self.report('plan_finished', **writer.counts)
+
+    @activated
+    def execute_plan(self, plan_file: str, batch_size: int = 500) -> None:
+        """plan_photosで出力した計画のコピーを、pipeline_copy_workers個のスレッドで行い、batch_size件ずつ登録する
+
+        コピーは元ファイルのフォルダーごとにまとめて行う（plan.sort_for_locality）。計画後に登録されたファイル、
+        計画後に変更された元ファイルはコピーしない。同じ計画を再実行した場合、コピー済みのファイルは登録済みとしてスキップする。
+        """
+        self.index = None
+        self.reset_stats()
+        header, entries = plan.read_plan(plan_file)
+        target_path = header['target']
+        index = self.load_index(target_path)
+        copies = plan.sort_for_locality([entry for entry in entries if entry.action == plan.COPY])
+        self.report('execute_started', files=len(copies))
+        # コピー先のフォルダーごとの、取込処理で作成したか
+        target_folders: Dict[str, bool] = {}
+        store = ObjectStore(self.conn, target_path) if self.content_store else None
+        with ThreadPoolExecutor(max_workers=max(self.pipeline_copy_workers, 1),
+                                thread_name_prefix='busker-copy') as pool:
+            for start in range(0, len(copies), batch_size):
+                futures = []
+                for entry in copies[start:start + batch_size]:
+                    self.scanned += 1
+                    file_info = plan.create_file_info(header, entry)
+                    if index.contains(file_info):
+                        self.duplicated += 1
+                        continue
+                    if not self.is_planned_source(file_info, entry.name):
+                        self.skipped += 1
+                        continue
+                    # 計画後に同じ名前のファイルが登録された場合は、ファイル名を決め直す
+                    file_info.name = index.resolve_name(file_info.save_to, file_info.name)      # type: ignore
+                    index.add(file_info)
+                    target_folder = os.path.join(target_path, file_info.save_to)
+                    if target_folder not in target_folders:
+                        target_folders[target_folder] = not os.path.isdir(target_folder)
+                    futures.append(pool.submit(self.copy_planned_file, target_path, file_info, entry.name, store))
+
+                new_file_infos: List[FileInfo] = []
+                for future in futures:
+                    file_info, target_stat = future.result()
+                    self.copy_methods[file_info.copy_method] = self.copy_methods.get(file_info.copy_method, 0) + 1
+                    self.hash_cache.put(os.path.join(target_path, file_info.save_to), file_info.name, target_stat,
+                                        file_info.hash_algorithm, file_info.hash, file_info.captured_at,
+                                        file_info.phash)
+                    new_file_infos.append(file_info)
+                sql.register_file_infos(self.conn, new_file_infos)
+                index.flush(self.conn)
+                self.hash_cache.flush()
+                if store is not None:
+                    store.flush()
+                self.conn.commit()
+                self.copied += len(new_file_infos)
+                self.report('batch', scanned=self.scanned, copied=self.copied, duplicated=self.duplicated)
+                self.report_throughput()
+
+        for target_folder, created in target_folders.items():
+            self.snapshot.refresh(target_folder, created)
+        self.snapshot.flush(target_path)
+        self.conn.commit()
+        self.report('execute_finished')
+        logger.info(f'Executed plan {plan_file}: {self.copied} copied, {self.duplicated} duplicated, '
+                    f'{self.skipped} changed after planning.')
+
+    def migrate(self, target_path: str) -> Tuple[int, int]:
+        """他のアルゴリズムで計算済みのhashを、hash_algorithmで再計算する（busker.photo.migration）"""
+        self.report('migrate_started')
+        migrated, missing = migrate_hash_algorithm(self.conn, target_path, self.hash_engine)
+        self.report('migrate_finished', migrated=migrated, missing=missing)
+        return migrated, missing
+
+    @activated
+    def build_view(self, target_path: str, view_path: Optional[str] = None, layout: Optional[str] = None) -> None:
+        """content_storeで保存した内容から、ビューのフォルダーをハードリンクで作成する（ObjectStore.build_view）
+
+        view_pathを省略した場合は保存先、layoutを省略した場合は登録済みの保存先とファイル名で作り直す。
+        """
+        store = ObjectStore(self.conn, target_path)
+        counts = store.build_view(view_path or target_path, layout)
+        self.report('view_built', **counts)
+
+    def is_planned_source(self, file_info: FileInfo, source_name: str) -> bool:
+        """元ファイルが計画時から変更されていないかを、サイズと更新日時で確認する"""
+        source_file = os.path.join(file_info.path, source_name)
+        try:
+            stat = os.stat(source_file)
+        except OSError:
+            logger.warning(f'Planned file {source_file} does not exist, it will not be copied.')
+            return False
+        if stat.st_size != file_info.size or datetime.fromtimestamp(stat.st_mtime) != file_info.modified_at:
+            logger.warning(f'Planned file {source_file} has been changed after planning, it will not be copied.')
+            return False
+        return True
+
+    def copy_planned_file(self, target_path: str, file_info: FileInfo, source_name: str,
+                          store: Optional[ObjectStore] = None):
+        """計画した元ファイルを保存先にコピーし、(ファイル情報, コピー先のstat)を返す、コピー用のスレッドで実行する"""
+        original_file = os.path.join(file_info.path, source_name)
+        target_folder = os.path.join(target_path, file_info.save_to)
+        os.makedirs(target_folder, exist_ok=True)
+        target_file = os.path.join(target_folder, file_info.name)
+        with metrics.timer('copy'):
+            file_info.copy_method = self.write_target(store, original_file, target_file, file_info)
+        metrics.inc('copied_files')
+        metrics.inc('copied_bytes', file_info.size)
+        logger.info(f'\tFile {original_file} has been copied to {target_file} by {file_info.copy_method}.')
+        return file_info, os.stat(target_file)
+
+    def copy_photos_by_pipeline(self, source_path: str, target_path: str) -> None:
+        """copy_photosと同じ処理を、ImportPipelineで走査、hash計算、コピー、DB登録を並行して行う"""
+        database = sql.get_database_file(self.conn)
+        if not database:
+            raise ValueError('ImportPipeline requires a database file, in-memory databases can not be shared.')
+        # DBへの書き込みはパイプラインの書き込みスレッドが別の接続で行うため、先にcommitしておく
+        self.conn.commit()
+        pipeline = ImportPipeline(partial(sqlite3.connect, database),
+                                  self.pipeline_hash_workers,
+                                  self.pipeline_copy_workers,
+                                  batch_size=500,
+                                  copy_hardlink=self.copy_hardlink,
+                                  progress=self.progress,
+                                  walker=self.walker)
+        try:
+            pipeline.run(source_path, target_path)
+            # コピーしたファイルは登録済みのため、次回の保存先の確認では変更なしとする
+            for target_folder, created in pipeline.target_folders.items():
+                self.snapshot.refresh(target_folder, created)
+            self.snapshot.flush(target_path)
+            self.conn.commit()
+        finally:
+            self.scanned += pipeline.scanned
+            self.copied += pipeline.copied
+            self.duplicated += pipeline.duplicated
+            for method, count in pipeline.copy_methods.items():
+                self.copy_methods[method] = self.copy_methods.get(method, 0) + count
+            # 索引はパイプラインで更新されたため、次回は読み込み直す
+            self.index = None
+
+    def check_near_duplicate(self, file_info: FileInfo) -> bool:
+        """見た目が同じ画像が登録済みの場合は通知し、near_duplicate_action = 'skip'の場合はTrueを返す"""
+        if self.near_duplicate_distance is None:
+            return False
+        similar = self.load_similar_index().find(file_info, self.near_duplicate_distance)
+        if similar is None:
+            return False
+
+        distance, save_to, name = similar
+        self.near_duplicated += 1
+        metrics.inc('near_duplicates')
+        similar_file = os.path.join(save_to, name)
+        self.report('near_duplicate', path=file_info.full_name, similar=similar_file, distance=distance)
+        logger.warning(f'Picture {file_info.full_name} looks like {similar_file} (distance {distance}).')
+        return self.near_duplicate_action == 'skip'
+
+    def count_files(self, source_path: str, journal: ImportJournal) -> None:
+        """取込処理と同じ条件（walker、再開した取込処理の処理済みファイル）で、元フォルダーのファイル数を数える"""
+        self.total_files = self.walker.count(source_path, skip=lambda path, name: (path, name) in journal.done)
+
+    def report_throughput(self) -> None:
+        """collect_metricsがTrueの場合、Metrics.report_interval秒ごとに処理速度と残り時間を通知する"""
+        throughput = metrics.poll(self.scanned, self.total_files)
+        if throughput is None:
+            return
+        self.report('throughput', **throughput)
+        eta = f", ETA {throughput['eta']}s" if throughput.get('eta') is not None else ''
+        logger.info(f"{throughput['files']} files, {throughput['files_per_sec']} files/s, "
+                    f"{throughput['bytes_per_sec'] / 1024 / 1024:.1f} MiB/s{eta}")
+
+    def is_collected(self, index: CatalogIndex, deduplicator: StagedDeduplicator, file_info: FileInfo) -> bool:
+        """dedup_modeに応じて、同一ファイルが登録済みかをチェックする"""
+        if self.dedup_mode == 'staged':
+            return deduplicator.find_same_file(file_info) is not None
+        return index.contains(file_info)
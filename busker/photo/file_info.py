@@ -1,14 +1,25 @@
 import os
-import hashlib
-from PIL import Image
-from datetime import datetime
+import sys
+import shutil
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
 import logging
-from typing import List, Optional
+from typing import TYPE_CHECKING, Any, Deque, Iterable, Iterator, List, Optional, Tuple, Union
+from busker.photo.hasher import HashEngine
+from busker.photo.metadata import (HEADER_SIZE, UnsupportedFormat, parse_image_captured_at, read_image_captured_at,
+                                   read_video_captured_at)
+from busker.photo.perceptual import read_dhash
+from busker.photo.metrics import metrics
+
+if TYPE_CHECKING:
+    from busker.photo.hash_cache import HashCache
+    from busker.photo.walker import WalkItem
 
 
 logger = logging.getLogger("busker.file.sql")
 logger.setLevel(logging.INFO)
-logging.getLogger("PIL.TiffImagePlugin").setLevel(logging.WARNING)
 
 
 class FileType:
@@ -27,20 +38,86 @@ class FileType:
             return cls.UNKNOWN
 
 
+# 遅延読込のフィールドが未読込であることを表す目印
+_UNLOADED: Any = object()
+# 日時は0001-01-01 00:00:00からのマイクロ秒数（タイムゾーンなし）で保持する
+_TICK = timedelta(microseconds=1)
+
+
+def _to_ticks(value: Union[datetime, str, int, None]) -> Union[int, str, datetime, None]:
+    """日時（datetimeまたはDBの文字列）を整数に変換する、変換できない値はそのまま返す"""
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+        # DBに登録する文字列が変わらない場合のみ変換する
+        if str(parsed) != value:
+            return value
+        value = parsed
+    if isinstance(value, datetime) and value.tzinfo is None:
+        return (value - datetime.min) // _TICK
+    return value
+
+
+def _from_ticks(value: Union[int, str, datetime, None]) -> Union[datetime, str, None]:
+    if isinstance(value, int):
+        return datetime.min + value * _TICK
+    return value
+
+
+def to_digest(value: Optional[str]) -> Union[bytes, str, None]:
+    """16進数のhashをバイト列に変換する、16進数の小文字以外の値はそのまま返す"""
+    if value is None:
+        return None
+    try:
+        digest = bytes.fromhex(value)
+    except ValueError:
+        return value
+    return digest if digest.hex() == value else value
+
+
+def _from_digest(value: Union[bytes, str, None]) -> Optional[str]:
+    return value.hex() if isinstance(value, bytes) else value
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value is not None else None
+
+
 class FileInfo:
-    block_size = 8192
+    """ファイル情報
+
+    数百万件のファイル情報をメモリに保持できるよう、__slots__で属性を固定し、
+    パス・保存先・種別などの繰り返し出現する文字列はintern、日時は整数、hashはバイト列で保持する。
+    属性は従来どおりhashは16進数の文字列、日時はdatetimeで読み書きできる。
+    create(lazy=True)で生成した場合、hashと撮影日時は最初に参照したときにファイルを読み込む。
+    """
+    __slots__ = ('id', 'name', '_path', 'size', '_digest', '_created_at', '_modified_at', '_file_type',
+                 '_captured_at', '_save_to', '_sample_digest', '_hash_algorithm', '_copy_method', 'phash', '_pending')
+
+    # hash計算に使用するアルゴリズムと読み込み方式
+    hash_engine = HashEngine('md5')
+    # サンプルhashで読み込む先頭・末尾のバイト数
+    sample_size = 65536
+    # 画像の知覚hash（busker.photo.perceptual.read_dhash）を計算する
+    with_phash = False
 
     def __init__(self,
                  id: Optional[int],
                  name: str,
                  path: str,
                  size: int,
-                 hash: str,
-                 created_at: datetime,
-                 modified_at: datetime,
+                 hash: Optional[str],
+                 created_at: Union[datetime, str, None],
+                 modified_at: Union[datetime, str, None],
                  file_type: str,
-                 captured_at: Optional[datetime],
-                 save_to: str) -> None:
+                 captured_at: Union[datetime, str, None],
+                 save_to: Optional[str],
+                 sample_hash: Optional[str] = None,
+                 hash_algorithm: Optional[str] = None,
+                 copy_method: Optional[str] = None,
+                 phash: Optional[int] = None) -> None:
         if name is None or path is None:
             raise TypeError("Both 'name' and 'path' parameters are required.")
         self.id = id
@@ -53,6 +130,165 @@ class FileInfo:
         self.file_type = file_type
         self.captured_at = captured_at
         self.save_to = save_to
+        self.sample_hash = sample_hash
+        self.hash_algorithm = hash_algorithm
+        # 保存先へのコピー方式（busker.file.fastcopy）
+        self.copy_method = copy_method
+        # 画像の知覚hash、見た目が同じ画像の判定に使う
+        self.phash = phash
+        # 遅延読込の場合の(ファイルのstat, HashCache)、読込後にキャッシュへ登録する
+        self._pending: Optional[Tuple[os.stat_result, Optional['HashCache']]] = None
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @path.setter
+    def path(self, value: str) -> None:
+        self._path = sys.intern(value)
+
+    @property
+    def hash(self) -> Optional[str]:
+        if self._digest is _UNLOADED:
+            self._load()
+        return _from_digest(self._digest)
+
+    @hash.setter
+    def hash(self, value: Optional[str]) -> None:
+        self._digest = to_digest(value)
+
+    @property
+    def digest(self) -> Union[bytes, str, None]:
+        """hashのバイト列（to_digest()を参照）、索引のキーに使う"""
+        if self._digest is _UNLOADED:
+            self._load()
+        return self._digest
+
+    @property
+    def sample_hash(self) -> Optional[str]:
+        return _from_digest(self._sample_digest)
+
+    @sample_hash.setter
+    def sample_hash(self, value: Optional[str]) -> None:
+        self._sample_digest = to_digest(value)
+
+    @property
+    def created_at(self) -> Optional[datetime]:
+        return _from_ticks(self._created_at)        # type: ignore
+
+    @created_at.setter
+    def created_at(self, value: Union[datetime, str, None]) -> None:
+        self._created_at = _to_ticks(value)
+
+    @property
+    def modified_at(self) -> Optional[datetime]:
+        return _from_ticks(self._modified_at)       # type: ignore
+
+    @modified_at.setter
+    def modified_at(self, value: Union[datetime, str, None]) -> None:
+        self._modified_at = _to_ticks(value)
+
+    @property
+    def captured_at(self) -> Optional[datetime]:
+        if self._captured_at is _UNLOADED:
+            self._load()
+        return _from_ticks(self._captured_at)       # type: ignore
+
+    @captured_at.setter
+    def captured_at(self, value: Union[datetime, str, None]) -> None:
+        self._captured_at = _to_ticks(value)
+
+    @property
+    def save_to(self) -> Optional[str]:
+        if self._save_to is _UNLOADED:
+            self.save_to = datetime.strftime(self.captured_at, "%Y" + os.path.sep + "%m")  # type: ignore
+        return self._save_to
+
+    @save_to.setter
+    def save_to(self, value: Optional[str]) -> None:
+        self._save_to = _intern(value)
+
+    @property
+    def file_type(self) -> str:
+        return self._file_type
+
+    @file_type.setter
+    def file_type(self, value: str) -> None:
+        self._file_type = _intern(value)
+
+    @property
+    def hash_algorithm(self) -> Optional[str]:
+        return self._hash_algorithm
+
+    @hash_algorithm.setter
+    def hash_algorithm(self, value: Optional[str]) -> None:
+        self._hash_algorithm = _intern(value)
+
+    @property
+    def copy_method(self) -> Optional[str]:
+        return self._copy_method
+
+    @copy_method.setter
+    def copy_method(self, value: Optional[str]) -> None:
+        self._copy_method = _intern(value)
+
+    def _load(self) -> None:
+        """遅延読込のhashと撮影日時を読み込み、キャッシュに登録する"""
+        stat, cache = self._pending         # type: ignore
+        self._pending = None
+        full_name = self.full_name
+        if self._digest is _UNLOADED:
+            self._digest = to_digest(self.read_hash(full_name))
+        modified_at = self.modified_at
+        self.captured_at = self.read_captured_at(full_name, self.file_type, modified_at)     # type: ignore
+        if self.with_phash and self.file_type == FileType.IMAGE:
+            self.phash = self.read_phash(full_name)
+        if cache:
+            cache.put(self.path, self.name, stat, self.hash_engine.name, self.hash, self.captured_at, self.phash)
+
+    def load_copying(self, staging_file: str) -> bool:
+        """遅延読込のhashと撮影日時を、元ファイルをstaging_fileにコピーしながら1回の読み込みで読み込む
+
+        EXIFは読み込んだ先頭のバイト列から解析し、先頭だけで解析できない画像、動画の撮影日時と知覚hashは
+        コピー先（staging_file）から読み込むため、元ファイルは1回しか読まない。読込済みの場合はコピーせずにFalseを返す。
+        """
+        if self._pending is None:
+            return False
+        stat, cache = self._pending
+        self._pending = None
+        full_name = self.full_name
+        hash = self.hash_engine.new()
+        header = b''
+        with metrics.timer('fused_copy'), open(full_name, 'rb') as fsrc, open(staging_file, 'wb') as fdst:
+            buffer = bytearray(self.hash_engine.buffer_size)
+            view = memoryview(buffer)
+            while True:
+                length = fsrc.readinto(buffer)
+                if not length:
+                    break
+                hash.update(view[:length])
+                fdst.write(view[:length])
+                if len(header) < HEADER_SIZE:
+                    header += view[:HEADER_SIZE - len(header)].tobytes()
+        shutil.copystat(full_name, staging_file)
+        self.hash = hash.hexdigest()
+
+        captured_at = None
+        if self.file_type == FileType.IMAGE:
+            with metrics.timer('exif'):
+                try:
+                    captured_at = parse_image_captured_at(header)
+                except UnsupportedFormat:
+                    captured_at = read_image_captured_at(staging_file)
+            if self.with_phash:
+                self.phash = self.read_phash(staging_file)
+        elif self.file_type == FileType.VIDEO:
+            with metrics.timer('video'):
+                captured_at = read_video_captured_at(staging_file)
+        self.captured_at = captured_at or self.modified_at
+        if cache:
+            cache.put(self.path, self.name, stat, self.hash_engine.name, self.hash, self.captured_at, self.phash)
+        return True
 
     @property
     def full_name(self) -> str:
@@ -63,52 +299,179 @@ class FileInfo:
             relative_root += os.path.sep
         return self.path.replace(relative_root, '')
 
+    def compute_hash(self) -> str:
+        """hashが未計算の場合、ファイルを読み込んで計算する"""
+        if self.hash is None:
+            self.hash = self.read_hash(self.full_name)
+            self.hash_algorithm = self.hash_engine.name
+        return self.hash        # type: ignore
+
+    def compute_sample_hash(self) -> str:
+        """サンプルhashが未計算の場合、ファイルの先頭と末尾を読み込んで計算する"""
+        if self.sample_hash is None:
+            self.sample_hash = self.read_sample_hash(self.full_name, self.size)
+        return self.sample_hash     # type: ignore
+
     @classmethod
-    def create(cls, name: str, path: str) -> 'FileInfo':
-        """ファイルからFileInfoを生成する"""
+    def create(cls,
+               name: str,
+               path: str,
+               cache: Optional['HashCache'] = None,
+               with_hash: bool = True,
+               stat: Optional[os.stat_result] = None,
+               lazy: bool = False) -> 'FileInfo':
+        """ファイルからFileInfoを生成する、cacheのstat情報が一致する場合はhash計算とEXIF読込を省略する
+
+        with_hashがFalseの場合、hashは計算せずにNoneのままとする（必要時にcompute_hash()で計算する）
+        statを指定した場合はstatを取得し直さない（走査時に取得したstatを使う）
+        lazyがTrueの場合、キャッシュにないhashと撮影日時（と保存先）は最初に参照したときに読み込む
+        """
         full_name = os.path.join(path, name)
-        size = os.path.getsize(full_name)
+        if stat is None:
+            with metrics.timer('stat'):
+                stat = os.stat(full_name)
+        metrics.inc('files')
+        modified_at = datetime.fromtimestamp(stat.st_mtime)
+        file_type = FileType.create(name)
+        file_info = FileInfo(None,
+                             name,
+                             path,
+                             stat.st_size,
+                             None,
+                             datetime.fromtimestamp(stat.st_ctime),
+                             modified_at,
+                             file_type,
+                             None,
+                             None,
+                             hash_algorithm=cls.hash_engine.name)
 
-        hash = None
-        with open(full_name, "rb") as f:
-            md5_hash = hashlib.md5()
-            for byte_block in iter(lambda: f.read(cls.block_size), b""):
-                md5_hash.update(byte_block)
-            hash = md5_hash.hexdigest()
+        cached = cache.get(path, name, stat, cls.hash_engine.name) if cache else None
+        if cached:
+            hash, cached_captured_at, phash = cached
+            file_info.hash = hash
+            file_info.captured_at = cached_captured_at or modified_at
+            file_info.phash = phash
+            if phash is None and cls.with_phash and file_type == FileType.IMAGE:
+                # 知覚hashの計算前に作成したキャッシュは、知覚hashだけ計算して更新する
+                file_info.phash = cls.read_phash(full_name)
+                cache.put(path, name, stat, cls.hash_engine.name, hash, file_info.captured_at,   # type: ignore
+                          file_info.phash)
+        elif lazy:
+            if with_hash:
+                file_info._digest = _UNLOADED
+            file_info._captured_at = _UNLOADED
+            file_info._save_to = _UNLOADED
+            file_info._pending = (stat, cache)
+            return file_info
+        else:
+            if with_hash:
+                file_info.hash = cls.read_hash(full_name)
+            file_info.captured_at = cls.read_captured_at(full_name, file_type, modified_at)
+            if cls.with_phash and file_type == FileType.IMAGE:
+                file_info.phash = cls.read_phash(full_name)
+            if cache:
+                cache.put(path, name, stat, cls.hash_engine.name, file_info.hash, file_info.captured_at,
+                          file_info.phash)
 
-        created_at = datetime.fromtimestamp(os.path.getctime(full_name))
-        modified_at = datetime.fromtimestamp(os.path.getmtime(full_name))
-        file_type = FileType.create(name)
+        # 保存先フォルダーは撮影日時の年・月
+        file_info.save_to = datetime.strftime(file_info.captured_at, "%Y" + os.path.sep + "%m")  # type: ignore
+        return file_info
+
+    @classmethod
+    def read_hash(cls, full_name: str) -> str:
+        """ファイル全体のhashを計算する"""
+        with metrics.timer('hash'):
+            return cls.hash_engine.hash_file(full_name)
+
+    @classmethod
+    def read_sample_hash(cls, full_name: str, size: int) -> str:
+        """ファイルの先頭と末尾sample_sizeバイトとファイルサイズからhashを計算する"""
+        sample_hash = cls.hash_engine.new(str(size).encode())
+        with metrics.timer('sample_hash'), open(full_name, "rb") as f:
+            if size <= cls.sample_size * 2:
+                sample_hash.update(f.read())
+            else:
+                sample_hash.update(f.read(cls.sample_size))
+                f.seek(-cls.sample_size, os.SEEK_END)
+                sample_hash.update(f.read(cls.sample_size))
+        return sample_hash.hexdigest()
 
-        captured_at = modified_at
+    @classmethod
+    def read_phash(cls, full_name: str) -> Optional[int]:
+        """画像の知覚hashを計算する"""
+        with metrics.timer('phash'):
+            return read_dhash(full_name)
+
+    @classmethod
+    def read_captured_at(cls, full_name: str, file_type: str, modified_at: datetime) -> datetime:
+        """撮影日時を読み込む、取得できない場合は更新日時を返す"""
+        captured_at = None
         if file_type == FileType.IMAGE:
-            try:
-                with Image.open(full_name) as img:
-                    exif = img.getexif()
-                    if exif:
-                        datetime_str = exif.get(0x9003)
-                        captured_at = datetime.strptime(datetime_str, "%Y:%m:%d %H:%M:%S")    # type: ignore
-            except Exception:
-                pass
-        
-        save_to = datetime.strftime(captured_at, "%Y" + os.path.sep + "%m")
-        return FileInfo(None,
-                        name,
-                        path,
-                        size,
-                        hash,
-                        created_at,
-                        modified_at,
-                        file_type,
-                        captured_at,
-                        save_to)
-
-
-def read_all_files(directory: str, batch_size: int) -> List[List[FileInfo]]:
+            with metrics.timer('exif'):
+                captured_at = read_image_captured_at(full_name)
+        elif file_type == FileType.VIDEO:
+            with metrics.timer('video'):
+                captured_at = read_video_captured_at(full_name)
+
+        return captured_at or modified_at
+
+
+def read_all_files(directory: str,
+                   batch_size: int,
+                   workers: int = 0,
+                   executor: str = 'thread',
+                   max_pending: Optional[int] = None,
+                   cache: Optional['HashCache'] = None,
+                   with_hash: bool = True,
+                   walk: Optional[Iterable['WalkItem']] = None,
+                   lazy: bool = False) -> Iterator[List[FileInfo]]:
+    """フォルダー配下の全ファイルのFileInfoをbatch_size件ずつ返す
+
+    workersが1以上の場合、FileInfo.create（MD5計算、EXIF読込）をスレッド（executor='thread'）
+    またはプロセス（executor='process'）のプールで並列実行する。処理中のファイル数はmax_pending件
+    （省略時はworkers * 4件）までに制限し、呼び出し側の処理が遅い場合は走査を待機させる。
+    cacheを指定した場合、stat情報が変わっていないファイルはhash計算とEXIF読込を省略する。
+    with_hashがFalseの場合、hashは計算しない（FileInfo.createを参照）。
+    walkを指定した場合、walkが返す(フォルダー, [(ファイル名, stat)])のファイルを処理する、
+    省略時はFileWalker（busker.photo.walker）で全てのファイルを走査する。
+    lazyがTrueかつ逐次処理の場合、hashと撮影日時は参照したときに読み込む（FileInfo.createを参照）。
+    """
+    if walk is None:
+        # walkerはFileTypeを使うため、循環importにならないようここでimportする
+        from busker.photo.walker import FileWalker
+        walk = FileWalker().walk(directory)
+    if workers < 1:
+        yield from _read_all_files_serial(walk, batch_size, cache, with_hash, lazy)
+    else:
+        yield from _read_all_files_parallel(walk, batch_size, workers, executor, max_pending or workers * 4,
+                                            cache, with_hash)
+
+
+def _create_executor(workers: int, executor: str) -> Executor:
+    if executor == 'thread':
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='busker-scan')
+    elif executor == 'process':
+        # ワーカープロセスでも呼び出し元と同じhash計算方式を使う
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(FileInfo.hash_engine, FileInfo.with_phash))
+    else:
+        raise ValueError(f"Unknown executor '{executor}', use 'thread' or 'process'.")
+
+
+def _init_worker(hash_engine: HashEngine, with_phash: bool) -> None:
+    FileInfo.hash_engine = hash_engine
+    FileInfo.with_phash = with_phash
+
+
+def _read_all_files_serial(walk: Iterable['WalkItem'],
+                           batch_size: int,
+                           cache: Optional['HashCache'],
+                           with_hash: bool,
+                           lazy: bool) -> Iterator[List[FileInfo]]:
     file_infos: List[FileInfo] = []
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            file_infos.append(FileInfo.create(file, root))
+    for root, files in walk:
+        for file, stat in files:
+            file_infos.append(FileInfo.create(file, root, cache, with_hash, stat, lazy))
             if len(file_infos) >= batch_size:
                 yield file_infos
                 file_infos = []
@@ -116,3 +479,68 @@ def read_all_files(directory: str, batch_size: int) -> List[List[FileInfo]]:
     # Check if there are remaining files in the last batch
     if file_infos:
         yield file_infos
+
+
+def _submit_with_local_cache(pool: Executor,
+                             cache: 'HashCache',
+                             with_hash: bool,
+                             name: str,
+                             path: str,
+                             stat: os.stat_result) -> Future:
+    if cache.contains(path, name, stat, FileInfo.hash_engine.name):
+        future: Future = Future()
+        future.set_result(FileInfo.create(name, path, cache, with_hash, stat))
+        return future
+
+    def put_cache(done: Future) -> None:
+        if not done.cancelled() and done.exception() is None:
+            file_info = done.result()
+            cache.add_miss()
+            cache.put(path, name, stat, file_info.hash_algorithm, file_info.hash, file_info.captured_at,
+                      file_info.phash)
+
+    future = pool.submit(FileInfo.create, name, path, None, with_hash, stat)
+    future.add_done_callback(put_cache)
+    return future
+
+
+def _read_all_files_parallel(walk: Iterable['WalkItem'],
+                             batch_size: int,
+                             workers: int,
+                             executor: str,
+                             max_pending: int,
+                             cache: Optional['HashCache'],
+                             with_hash: bool) -> Iterator[List[FileInfo]]:
+    file_infos: List[FileInfo] = []
+    # 走査順を保つため、投入順に結果を取り出す
+    pending: Deque[Future] = deque()
+    with _create_executor(workers, executor) as pool:
+        if executor == 'process' and cache:
+            # キャッシュはプロセス間で共有できないため、キャッシュの参照と更新は呼び出し元のプロセスで行う
+            submit = partial(_submit_with_local_cache, pool, cache, with_hash)
+        else:
+            submit = partial(pool.submit, FileInfo.create, cache=cache, with_hash=with_hash)
+        try:
+            for root, files in walk:
+                for file, stat in files:
+                    pending.append(submit(file, root, stat=stat))
+                    # 処理中の件数が上限に達した場合、先頭の結果を待ってから次のファイルを投入する
+                    while len(pending) >= max_pending:
+                        file_infos.append(pending.popleft().result())
+                        if len(file_infos) >= batch_size:
+                            yield file_infos
+                            file_infos = []
+
+            while pending:
+                file_infos.append(pending.popleft().result())
+                if len(file_infos) >= batch_size:
+                    yield file_infos
+                    file_infos = []
+        finally:
+            # 途中で中断された場合、未着手のファイルは処理しない
+            for future in pending:
+                future.cancel()
+
+    # Check if there are remaining files in the last batch
+    if file_infos:
+        yield file_infos
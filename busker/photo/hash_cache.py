@@ -0,0 +1,87 @@
+import os
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from busker.photo import sql
+
+
+logger = logging.getLogger("busker.photo.hash_cache")
+logger.setLevel(logging.INFO)
+
+
+class HashCache:
+    """ファイルのstat情報（パス、名称、サイズ、更新日時、inode）をキーに、hash、撮影日時、知覚hashをキャッシュする
+
+    hashはアルゴリズム名とともに保持し、アルゴリズムが異なる場合はキャッシュなしとして扱う。
+
+    キャッシュはload()でDBからメモリに読み込み、get()/put()はメモリ上で行うため、
+    並列処理のスレッドから呼び出してもよい（未登録分とヒット数・ミス数はlockで保護する）。追加・更新分はflush()でDBに書き込む。
+    """
+
+    def __init__(self, conn) -> None:
+        self.conn = conn
+        self.entries: Dict[Tuple[str, str], Tuple[int, int, int, str, str, Optional[datetime], Optional[int]]] = {}
+        self.pending: List[tuple] = []
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # テーブル定義
+        sql.create_table_file_cache(conn)
+
+    def load(self, directory: str) -> None:
+        """フォルダー配下のキャッシュをDBから読み込む"""
+        for path, name, size, mtime_ns, inode, hash_algorithm, hash, captured_at, phash \
+                in sql.get_file_cache(self.conn, directory):
+            if isinstance(captured_at, str):
+                captured_at = datetime.fromisoformat(captured_at)
+            self.entries[(path, name)] = (size, mtime_ns, inode, hash_algorithm, hash, captured_at, phash)
+        logger.info(f'{len(self.entries)} hash cache entries have been loaded.')
+
+    def contains(self, path: str, name: str, stat: os.stat_result, hash_algorithm: str) -> bool:
+        """stat情報とアルゴリズムが一致するキャッシュがあるかを返す、ヒット数・ミス数には計上しない"""
+        entry = self.entries.get((path, name))
+        return entry is not None and entry[:4] == (stat.st_size, stat.st_mtime_ns, stat.st_ino, hash_algorithm)
+
+    def get(self,
+            path: str,
+            name: str,
+            stat: os.stat_result,
+            hash_algorithm: str) -> Optional[Tuple[str, Optional[datetime], Optional[int]]]:
+        """stat情報とアルゴリズムが一致する場合、キャッシュ済みの(hash, 撮影日時, 知覚hash)を返す"""
+        if self.contains(path, name, stat, hash_algorithm):
+            entry = self.entries[(path, name)]
+            with self.lock:
+                self.hits += 1
+            return entry[4], entry[5], entry[6]
+
+        self.add_miss()
+        return None
+
+    def add_miss(self) -> None:
+        """キャッシュを使わずにhashを計算したファイルを、ミス数に計上する"""
+        with self.lock:
+            self.misses += 1
+
+    def put(self,
+            path: str,
+            name: str,
+            stat: os.stat_result,
+            hash_algorithm: Optional[str],
+            hash: Optional[str],
+            captured_at: Optional[datetime],
+            phash: Optional[int] = None) -> None:
+        """キャッシュを追加・更新する、hashが未計算の場合はキャッシュしない"""
+        if hash is None or hash_algorithm is None:
+            return
+        entry = (stat.st_size, stat.st_mtime_ns, stat.st_ino, hash_algorithm, hash, captured_at, phash)
+        with self.lock:
+            self.entries[(path, name)] = entry
+            self.pending.append((path, name) + entry)
+
+    def flush(self) -> None:
+        """追加・更新したキャッシュをDBに書き込む、commitは呼び出し側で行う"""
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if pending:
+            sql.register_file_cache(self.conn, pending)
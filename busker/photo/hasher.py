@@ -0,0 +1,76 @@
+import os
+import mmap
+import hashlib
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import xxhash
+except ImportError:     # pragma: no cover
+    xxhash = None
+
+try:
+    import blake3
+except ImportError:     # pragma: no cover
+    blake3 = None
+
+
+# アルゴリズム名とhashオブジェクトの生成関数
+_ALGORITHMS: Dict[str, Callable[[], Any]] = {
+    'md5': hashlib.md5,
+    'sha1': hashlib.sha1,
+    'sha256': hashlib.sha256,
+    'blake2b': hashlib.blake2b,
+}
+if xxhash:      # pragma: no cover
+    _ALGORITHMS['xxh64'] = xxhash.xxh64
+    _ALGORITHMS['xxh3_128'] = xxhash.xxh3_128
+if blake3:      # pragma: no cover
+    _ALGORITHMS['blake3'] = blake3.blake3
+
+
+def available_algorithms() -> List[str]:
+    """利用可能なハッシュアルゴリズム名の一覧、xxhash、blake3はインストール済みの場合のみ"""
+    return list(_ALGORITHMS)
+
+
+class HashEngine:
+    """ハッシュアルゴリズムとファイルの読み込み方式
+
+    ファイルはbuffer_sizeバイトずつ同じバッファーに読み込む（readinto）、use_mmapがTrueの場合はmmapで読み込む。
+    生成関数ではなくアルゴリズム名を保持するため、プロセスプールのワーカーにも渡せる。
+    """
+    default_buffer_size = 1024 * 1024
+
+    def __init__(self, name: str, buffer_size: Optional[int] = None, use_mmap: bool = False) -> None:
+        if name not in _ALGORITHMS:
+            raise ValueError(f"Unknown hash algorithm '{name}', available: {', '.join(available_algorithms())}.")
+        self.name = name
+        self.buffer_size = buffer_size or self.default_buffer_size
+        self.use_mmap = use_mmap
+
+    def __repr__(self) -> str:
+        return f'HashEngine({self.name!r}, buffer_size={self.buffer_size}, use_mmap={self.use_mmap})'
+
+    def new(self, data: bytes = b''):
+        """hashオブジェクトを生成する"""
+        hash = _ALGORITHMS[self.name]()
+        if data:
+            hash.update(data)
+        return hash
+
+    def hash_file(self, full_name: str) -> str:
+        """ファイル全体のhashを計算する"""
+        hash = self.new()
+        with open(full_name, 'rb') as f:
+            if self.use_mmap and os.fstat(f.fileno()).st_size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    hash.update(mapped)
+            else:
+                buffer = bytearray(self.buffer_size)
+                view = memoryview(buffer)
+                while True:
+                    length = f.readinto(buffer)
+                    if not length:
+                        break
+                    hash.update(view[:length])
+        return hash.hexdigest()
@@ -0,0 +1,118 @@
+import os
+import shutil
+import logging
+from typing import List, Optional, Set, Tuple
+from busker.photo import sql
+
+
+logger = logging.getLogger("busker.photo.journal")
+logger.setLevel(logging.INFO)
+
+# コピー中のファイルの拡張子、コピー完了後に本来のファイル名に変更する
+PARTIAL_SUFFIX = '.busker-partial'
+# 読み込みと同時にコピーしたファイルを、保存先フォルダーが決まるまで置く保存先直下のフォルダー
+STAGING_FOLDER = 'staging'
+
+
+def partial_name(file_name: str, run_id: Optional[int] = None) -> str:
+    """コピー中のファイル名、run_idを指定した場合は取込処理ごとの名前にする（ImportJournal.remove_partial_files）"""
+    if run_id is None:
+        return file_name + PARTIAL_SUFFIX
+    return f'{file_name}.{run_id}{PARTIAL_SUFFIX}'
+
+
+class ImportJournal:
+    """取込処理の処理済みファイルを記録し、中断した取込処理を途中から再開する
+
+    処理済みの元ファイルはadd()で記録し、flush()でバッチのファイル情報と同じトランザクションに書き込む。
+    resumeがTrueの場合、保存先と元フォルダーが同じ未完了の取込処理を引き継ぎ、処理済みのファイルは
+    hash計算とEXIF読込の前にスキップする（is_done()）。
+    コピーは取込処理ごとのPARTIAL_SUFFIX付きのファイル名（partial_name）で行い、コピー先のフォルダーはコピー前に
+    commitしておくため、中断時にコピー途中だったファイルは同じ取込処理の次回の開始時（start()）に削除する。
+    """
+
+    def __init__(self, conn, source_path: str, target_path: str) -> None:
+        self.conn = conn
+        self.source_path = source_path
+        self.target_path = target_path
+        self.run_id: Optional[int] = None
+        self.done: Set[Tuple[str, str]] = set()
+        self.folders: Set[str] = set()
+        self.pending: List[Tuple[str, str, str]] = []
+        self.files = 0
+        self.skipped = 0
+        # テーブル定義
+        sql.create_table_import_journal(conn)
+
+    def start(self, resume: bool = False) -> None:
+        """取込処理を開始する、元フォルダーと保存先が同じ未完了の取込処理のコピー途中のファイルは削除する
+
+        元フォルダーと保存先が同じ取込処理は同時に実行しないため、未完了のものは中断したものとする。
+        元フォルダーが異なる未完了の取込処理は、実行中の場合があるため、コピー途中のファイルも含めて記録を残す。
+        """
+        for run_id, source_path, walk_path, files in sql.get_unfinished_import_runs(self.conn, self.target_path):
+            if source_path != self.source_path:
+                continue
+            self.remove_partial_files(run_id)
+            if resume and self.run_id is None:
+                self.run_id = run_id
+                self.files = files
+                self.done = set(sql.get_import_journal(self.conn, run_id))
+                self.folders = set(sql.get_import_folders(self.conn, run_id))
+                logger.info(f'Resuming import run {run_id} after {walk_path}, {files} files have been processed.')
+            else:
+                # 元フォルダーが同じで引き継がない取込処理は、中断したものとして記録を削除する
+                sql.update_import_run(self.conn, run_id, 'failed', walk_path, files)
+                sql.delete_import_run(self.conn, run_id)
+
+        if self.run_id is None:
+            self.run_id = sql.register_import_run(self.conn, self.source_path, self.target_path)
+        self.conn.commit()
+
+    def remove_partial_files(self, run_id: int) -> None:
+        """取込処理がコピーに使用したフォルダーから、その取込処理のコピー途中のファイルを削除する"""
+        staging_folder = os.path.join(self.target_path, partial_name(STAGING_FOLDER, run_id))
+        if os.path.isdir(staging_folder):
+            logger.warning(f'Partially copied files in {staging_folder} have been removed.')
+            shutil.rmtree(staging_folder)
+        suffix = partial_name('', run_id)
+        for save_to in sql.get_import_folders(self.conn, run_id):
+            folder = os.path.join(self.target_path, save_to)
+            if not os.path.isdir(folder):
+                continue
+            for entry in os.scandir(folder):
+                if entry.name.endswith(suffix) and entry.is_file():
+                    logger.warning(f'Partially copied file {entry.path} has been removed.')
+                    os.remove(entry.path)
+
+    def is_done(self, path: str, name: str) -> bool:
+        """再開した取込処理で処理済みのファイルかを返す"""
+        if (path, name) in self.done:
+            self.skipped += 1
+            return True
+        return False
+
+    def add_folder(self, save_to: str) -> None:
+        """コピー先のフォルダーを記録する、初めて使用するフォルダーはコピー前にcommitする"""
+        if save_to not in self.folders:
+            self.folders.add(save_to)
+            sql.register_import_folder(self.conn, self.run_id, save_to)     # type: ignore
+            self.conn.commit()
+
+    def add(self, path: str, name: str, status: str) -> None:
+        """処理済みの元ファイルを記録する、statusは'copied'、'duplicated'または'near_duplicated'"""
+        self.pending.append((path, name, status))
+
+    def flush(self, walk_path: Optional[str]) -> None:
+        """記録した処理済みファイルと走査位置を書き込む、commitは呼び出し側でバッチのファイル情報と一緒に行う"""
+        self.files += len(self.pending)
+        if self.pending:
+            pending, self.pending = self.pending, []
+            sql.register_import_journal(self.conn, self.run_id, pending)     # type: ignore
+        sql.update_import_run(self.conn, self.run_id, 'running', walk_path, self.files)     # type: ignore
+
+    def finish(self) -> None:
+        """取込処理を完了する、処理済みファイルの記録は不要になるため削除する"""
+        sql.update_import_run(self.conn, self.run_id, 'finished', None, self.files)     # type: ignore
+        sql.delete_import_run(self.conn, self.run_id)       # type: ignore
+        self.conn.commit()
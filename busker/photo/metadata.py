@@ -0,0 +1,297 @@
+import os
+import struct
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, Optional
+
+
+logger = logging.getLogger("busker.photo.metadata")
+logger.setLevel(logging.INFO)
+logging.getLogger("PIL.TiffImagePlugin").setLevel(logging.WARNING)
+
+# 撮影日時の読込で、ファイルの先頭から読み込むバイト数
+HEADER_SIZE = 64 * 1024
+
+_TAG_EXIF_IFD = 0x8769
+_TAG_DATETIME_ORIGINAL = 0x9003
+_TYPE_ASCII = 2
+
+# 動画のヘッダーの解析で読み飛ばす要素（atom、element、chunk）の上限、壊れたファイルで探索が終わらないようにする
+_MAX_VIDEO_ELEMENTS = 1000
+
+# MP4/MOVの日時は1904-01-01、MKVのDateUTCは2001-01-01（UTC）からの経過時間
+_MP4_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+_MKV_EPOCH = datetime(2001, 1, 1, tzinfo=timezone.utc)
+
+# MKVのEBMLの要素ID
+_EBML_HEADER = 0x1A45DFA3
+_MKV_SEGMENT = 0x18538067
+_MKV_INFO = 0x1549A966
+_MKV_DATE_UTC = 0x4461
+_MKV_CLUSTER = 0x1F43B675
+
+# AVIのIDITの日時の形式
+_AVI_DATE_FORMATS = ('%a %b %d %H:%M:%S %Y', '%Y:%m:%d %H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S')
+
+
+class UnsupportedFormat(ValueError):
+    """ヘッダーの解析に対応していない形式、またはヘッダーが読み込んだ範囲に収まっていない"""
+
+
+def read_image_captured_at(full_name: str) -> Optional[datetime]:
+    """画像ファイルのEXIFから撮影日時（DateTimeOriginal）を読み込む、取得できない場合はNone
+
+    JPEG、TIFFはファイルの先頭HEADER_SIZEバイトだけを解析し、解析できない形式の場合のみPillowで読み込む。
+    """
+    try:
+        with open(full_name, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+    except OSError:
+        return None
+
+    try:
+        return parse_image_captured_at(header)
+    except UnsupportedFormat:
+        return _read_with_pillow(full_name)
+
+
+def parse_image_captured_at(header: bytes) -> Optional[datetime]:
+    """ファイル先頭のバイト列から撮影日時を解析する、解析できない場合はUnsupportedFormatを送出する"""
+    if header[:2] == b'\xff\xd8':
+        tiff = _find_jpeg_exif(header)
+        return _parse_tiff(tiff) if tiff is not None else None
+    elif header[:4] in (b'II*\x00', b'MM\x00*'):
+        return _parse_tiff(header)
+    elif header[:6] in (b'GIF87a', b'GIF89a') or header[:2] == b'BM':
+        # GIF、BMPにはEXIFがない
+        return None
+    raise UnsupportedFormat('Unknown image header.')
+
+
+def _find_jpeg_exif(data: bytes) -> Optional[bytes]:
+    """JPEGのAPP1（Exif）セグメントからTIFF部分を返す、EXIFがない場合はNone"""
+    offset = 2
+    while offset + 2 <= len(data):
+        if data[offset] != 0xFF:
+            raise UnsupportedFormat('Broken JPEG segment.')
+        marker = data[offset + 1]
+        if marker == 0xFF:      # パディング
+            offset += 1
+            continue
+        if marker in (0xD9, 0xDA):      # EOI、SOS以降にEXIFはない
+            return None
+        if offset + 4 > len(data):
+            break
+        length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+        if marker == 0xE1 and data[offset + 4:offset + 10] == b'Exif\x00\x00':
+            # セグメントが読み込んだ範囲を超える場合も、必要なIFDが範囲内にあれば解析できる
+            return data[offset + 10:offset + 2 + length]
+        offset += 2 + length
+    raise UnsupportedFormat('JPEG header is longer than the read size.')
+
+
+def _parse_tiff(tiff: bytes) -> Optional[datetime]:
+    if tiff[:2] == b'II':
+        order = '<'
+    elif tiff[:2] == b'MM':
+        order = '>'
+    else:
+        raise UnsupportedFormat('Unknown TIFF byte order.')
+
+    try:
+        ifd0 = struct.unpack(order + 'I', tiff[4:8])[0]
+        entry = _find_ifd_entry(tiff, order, ifd0, _TAG_EXIF_IFD)
+        if entry is None:
+            return None
+        exif_ifd = struct.unpack(order + 'I', entry[8:12])[0]
+        entry = _find_ifd_entry(tiff, order, exif_ifd, _TAG_DATETIME_ORIGINAL)
+        if entry is None:
+            return None
+
+        value_type, count = struct.unpack(order + 'HI', entry[2:8])
+        if value_type != _TYPE_ASCII:
+            return None
+        if count <= 4:
+            value = entry[8:8 + count]
+        else:
+            value_offset = struct.unpack(order + 'I', entry[8:12])[0]
+            value = tiff[value_offset:value_offset + count]
+            if len(value) < count:
+                raise UnsupportedFormat('TIFF value is out of the read range.')
+    except struct.error as e:
+        raise UnsupportedFormat('TIFF IFD is out of the read range.') from e
+
+    return _to_datetime(value.split(b'\x00', 1)[0].decode('ascii', 'replace'))
+
+
+def _find_ifd_entry(tiff: bytes, order: str, ifd: int, tag: int) -> Optional[bytes]:
+    count = struct.unpack(order + 'H', tiff[ifd:ifd + 2])[0]
+    for i in range(count):
+        offset = ifd + 2 + i * 12
+        entry = tiff[offset:offset + 12]
+        if len(entry) < 12:
+            raise UnsupportedFormat('TIFF IFD is out of the read range.')
+        if struct.unpack(order + 'H', entry[:2])[0] == tag:
+            return entry
+    return None
+
+
+def _to_datetime(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value.strip(), "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        # 未設定（0000:00:00 00:00:00）など
+        return None
+
+
+def _read_with_pillow(full_name: str) -> Optional[datetime]:
+    from PIL import Image
+
+    try:
+        with Image.open(full_name) as img:
+            exif = img.getexif()
+            return _to_datetime(exif.get_ifd(_TAG_EXIF_IFD).get(_TAG_DATETIME_ORIGINAL)
+                                or exif.get(_TAG_DATETIME_ORIGINAL))
+    except Exception:
+        return None
+
+
+def read_video_captured_at(full_name: str) -> Optional[datetime]:
+    """動画ファイルのコンテナのヘッダーから撮影日時を読み込む、取得できない場合はNone
+
+    MP4/MOVはmoov/mvhdのcreation_time、MKVはSegment/InfoのDateUTC、AVIはhdrlのIDITを読み込む。
+    ヘッダー以外の要素（mdat、Clusterなど）はseekで読み飛ばすため、ファイルサイズにかかわらず数KBしか読まない。
+    UTCで記録された日時は、更新日時（datetime.fromtimestamp）と同じくローカル時刻に変換する。
+    """
+    try:
+        with open(full_name, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            header = f.read(12)
+            f.seek(0)
+            if header[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot'):
+                return _parse_mp4(f, size)
+            elif header[:4] == struct.pack('>I', _EBML_HEADER):
+                return _parse_mkv(f, size)
+            elif header[:4] == b'RIFF' and header[8:12] == b'AVI ':
+                return _parse_avi(f, size)
+    except (OSError, ValueError, OverflowError, IndexError, struct.error) as e:
+        logger.debug(f'Failed to read the video header of {full_name}: {e}')
+    return None
+
+
+def _to_local(value: datetime) -> datetime:
+    """UTCの日時をローカル時刻（タイムゾーンなし）に変換する"""
+    return value.astimezone().replace(tzinfo=None)
+
+
+def _parse_mp4(f: BinaryIO, size: int) -> Optional[datetime]:
+    # moovはmdatの後（ファイルの末尾）にあることが多いため、atomのサイズで読み飛ばして探す
+    end = size
+    offset = 0
+    for _ in range(_MAX_VIDEO_ELEMENTS):
+        if offset + 8 > end:
+            return None
+        f.seek(offset)
+        atom_size, atom_type = struct.unpack('>I4s', f.read(8))
+        header_size = 8
+        if atom_size == 1:
+            atom_size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif atom_size == 0:
+            # ファイルの末尾まで
+            atom_size = end - offset
+        if atom_size < header_size:
+            return None
+
+        if atom_type == b'moov':
+            # moovの子要素を探す
+            end = offset + atom_size
+            offset += header_size
+        elif atom_type == b'mvhd':
+            version = f.read(1)[0]
+            f.seek(3, os.SEEK_CUR)
+            if version == 1:
+                creation_time = struct.unpack('>Q', f.read(8))[0]
+            else:
+                creation_time = struct.unpack('>I', f.read(4))[0]
+            # 未設定の場合は0
+            return _to_local(_MP4_EPOCH + timedelta(seconds=creation_time)) if creation_time else None
+        else:
+            offset += atom_size
+    return None
+
+
+def _read_ebml_id(f: BinaryIO) -> int:
+    first = f.read(1)[0]
+    length = 1
+    while length <= 4 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 4:
+        raise ValueError('Invalid EBML element ID.')
+    return int.from_bytes(bytes([first]) + f.read(length - 1), 'big')
+
+
+def _read_ebml_size(f: BinaryIO) -> Optional[int]:
+    """要素のサイズ、不明（全ビットが1）の場合はNone"""
+    first = f.read(1)[0]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        raise ValueError('Invalid EBML element size.')
+    value = first & (0xFF >> length)
+    rest = f.read(length - 1)
+    value = int.from_bytes(bytes([value]) + rest, 'big')
+    return None if value == (1 << (7 * length)) - 1 else value
+
+
+def _parse_mkv(f: BinaryIO, size: int) -> Optional[datetime]:
+    end = size
+    for _ in range(_MAX_VIDEO_ELEMENTS):
+        if f.tell() >= end:
+            return None
+        element_id = _read_ebml_id(f)
+        element_size = _read_ebml_size(f)
+        if element_id in (_MKV_SEGMENT, _MKV_INFO):
+            # 子要素を探す、サイズ不明のSegmentはファイルの末尾まで
+            if element_size is not None:
+                end = min(end, f.tell() + element_size)
+        elif element_id == _MKV_DATE_UTC:
+            nanoseconds = int.from_bytes(f.read(element_size or 0), 'big', signed=True)
+            return _to_local(_MKV_EPOCH + timedelta(microseconds=nanoseconds // 1000))
+        elif element_id == _MKV_CLUSTER or element_size is None:
+            # InfoはClusterより前にある
+            return None
+        else:
+            f.seek(element_size, os.SEEK_CUR)
+    return None
+
+
+def _parse_avi(f: BinaryIO, size: int) -> Optional[datetime]:
+    offset = 12
+    end = size
+    for _ in range(_MAX_VIDEO_ELEMENTS):
+        if offset + 8 > end:
+            return None
+        f.seek(offset)
+        chunk_id, chunk_size = struct.unpack('<4sI', f.read(8))
+        if chunk_id == b'LIST':
+            list_type = f.read(4)
+            if list_type == b'hdrl':
+                # hdrlの子要素を探す
+                end = min(end, offset + 8 + chunk_size)
+                offset += 12
+                continue
+        elif chunk_id == b'IDIT':
+            value = f.read(chunk_size).split(b'\x00', 1)[0].decode('ascii', 'replace').strip()
+            for date_format in _AVI_DATE_FORMATS:
+                try:
+                    return datetime.strptime(value, date_format)
+                except ValueError:
+                    pass
+            return None
+        # chunkは2バイト境界に揃える
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
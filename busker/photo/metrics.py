@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import nullcontext
+from typing import Any, ContextManager, Dict, List, Optional
+
+
+logger = logging.getLogger("busker.photo.metrics")
+logger.setLevel(logging.INFO)
+
+# Prometheusのメトリクス名の接頭辞
+PREFIX = 'busker_photo'
+
+
+class Histogram:
+    """処理時間（秒）の分布、バケットごとの件数を数える（Prometheusの形式では累積して出力する）"""
+    buckets = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+    def __init__(self) -> None:
+        # 最後の要素はbucketsの最大値を超えたもの
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """バケットの上限値で近似した分位数"""
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'count': self.count,
+                'sum': round(self.sum, 6),
+                'mean': self.sum / self.count if self.count else 0.0,
+                'p50': self.quantile(0.5),
+                'p95': self.quantile(0.95),
+                'p99': self.quantile(0.99),
+                'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], self.counts))}
+
+
+class _Timer:
+    """withブロックの処理時間を段階（stage）の分布に記録する"""
+    __slots__ = ('metrics', 'stage', 'started')
+
+    def __init__(self, metrics: 'Metrics', stage: str) -> None:
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self) -> '_Timer':
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.metrics.observe(self.stage, time.perf_counter() - self.started)
+
+
+class Metrics:
+    """取込処理の件数（counters）と段階ごとの処理時間（histograms）、enabledがTrueの場合のみ記録する
+
+    段階は'stat'、'hash'、'sample_hash'、'exif'、'video'、'phash'、'copy'、'fused_copy'、'sqlite'など。
+    ファイル情報の収集をプロセスプールで並列実行する場合、ワーカープロセスの記録は集計されない。
+    """
+    # 処理速度と残り時間をpoll()で返す間隔（秒）
+    report_interval = 10.0
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._null_timer = nullcontext()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters: Dict[str, float] = {}
+            self.histograms: Dict[str, Histogram] = {}
+            self.started_at = time.monotonic()
+            self.reported_at = self.started_at
+
+    def inc(self, name: str, value: float = 1) -> None:
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage: str, seconds: float) -> None:
+        if self.enabled:
+            with self._lock:
+                histogram = self.histograms.get(stage)
+                if histogram is None:
+                    histogram = self.histograms[stage] = Histogram()
+                histogram.observe(seconds)
+
+    def timer(self, stage: str) -> ContextManager:
+        """with metrics.timer('hash'): の形式で処理時間を記録する"""
+        return _Timer(self, stage) if self.enabled else self._null_timer
+
+    def throughput(self, done: int, total: Optional[int] = None) -> Dict[str, Any]:
+        """処理済みファイル数doneからの処理速度と、totalを指定した場合は残り時間（秒）の見積もり"""
+        elapsed = time.monotonic() - self.started_at
+        files_per_sec = done / elapsed if elapsed else 0.0
+        result = {'files': done,
+                  'elapsed': round(elapsed, 3),
+                  'files_per_sec': round(files_per_sec, 1),
+                  'bytes_per_sec': round(self.counters.get('copied_bytes', 0) / elapsed, 1) if elapsed else 0.0}
+        if total is not None:
+            result['total'] = total
+            result['eta'] = round(max(total - done, 0) / files_per_sec, 1) if files_per_sec else None
+        return result
+
+    def poll(self, done: int, total: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """前回からreport_interval秒以上経過した場合、処理速度と残り時間を返す"""
+        if not self.enabled or time.monotonic() - self.reported_at < self.report_interval:
+            return None
+        self.reported_at = time.monotonic()
+        return self.throughput(done, total)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'elapsed': round(time.monotonic() - self.started_at, 3),
+                    'counters': dict(self.counters),
+                    'stages': {stage: histogram.to_dict() for stage, histogram in self.histograms.items()}}
+
+    def to_prometheus(self) -> str:
+        """Prometheusのテキスト形式"""
+        lines: List[str] = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                metric = f'{PREFIX}_{name}_total'
+                lines += [f'# TYPE {metric} counter', f'{metric} {value:g}']
+
+            metric = f'{PREFIX}_stage_seconds'
+            lines.append(f'# TYPE {metric} histogram')
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip([f'{bound:g}' for bound in histogram.buckets] + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'{metric}_count{{stage="{stage}"}} {histogram.count}')
+
+            lines += [f'# TYPE {PREFIX}_elapsed_seconds gauge',
+                      f'{PREFIX}_elapsed_seconds {time.monotonic() - self.started_at:.3f}',
+                      f'# TYPE {PREFIX}_last_run_timestamp_seconds gauge',
+                      f'{PREFIX}_last_run_timestamp_seconds {time.time():.0f}']
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, file_name: str) -> None:
+        """JSONファイルに出力する"""
+        with open(file_name, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    def dump_prometheus(self, file_name: str) -> None:
+        """node_exporterのtextfile collector用のファイルに出力する、読込途中のファイルを読まれないよう置き換える"""
+        temp_name = file_name + '.tmp'
+        with open(temp_name, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(temp_name, file_name)
+
+    def log_summary(self) -> None:
+        summary = self.to_dict()
+        logger.info(f"Metrics: {summary['counters']}")
+        for stage, histogram in summary['stages'].items():
+            logger.info(f"Stage {stage}: {histogram['count']} calls, total {histogram['sum']:.3f}s, "
+                        f"p50 <= {histogram['p50'] * 1000:g}ms, p95 <= {histogram['p95'] * 1000:g}ms")
+
+
+metrics = Metrics()
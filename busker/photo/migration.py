@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import logging
+from typing import Tuple
+from busker.photo.file_info import FileInfo
+from busker.photo.hasher import HashEngine
+from busker.photo.store import ObjectStore
+from busker.photo import sql
+
+
+logger = logging.getLogger("busker.photo.migration")
+logger.setLevel(logging.INFO)
+
+
+def migrate_hash_algorithm(conn, target_path: str, hash_engine: HashEngine, batch_size: int = 1000) -> Tuple[int, int]:
+    """他のアルゴリズム（既存カタログのMD5など）で計算済みのhashを、hash_engineで再計算する
+
+    保存先のファイルを読み込んで再計算し、batch_size件ごとにcommitするため、中断しても続きから再実行できる。
+    保存先にファイルが存在しない行は変更しない。戻り値は(再計算した件数, ファイルが存在しない件数)。
+    内容を保存した保存先（busker.photo.store）では、新しいhashでも内容を参照できるようにする。
+    """
+    hash_algorithm = hash_engine.name
+    store = ObjectStore.open_existing(conn, target_path)
+    migrated = missing = 0
+    last_id = 0
+    while True:
+        file_infos = sql.get_files_by_other_hash_algorithm(conn, hash_algorithm, last_id, batch_size)
+        if not file_infos:
+            break
+
+        for file_info in file_infos:
+            last_id = file_info.id      # type: ignore
+            full_name = os.path.join(target_path, file_info.save_to, file_info.name)
+            if not os.path.isfile(full_name):
+                missing += 1
+                logger.warning(f'Collected file {full_name} does not exist, its hash is not migrated.')
+                continue
+
+            old_algorithm, old_hash = file_info.hash_algorithm, file_info.hash
+            file_info.hash = hash_engine.hash_file(full_name)
+            file_info.sample_hash = None
+            file_info.hash_algorithm = hash_algorithm
+            try:
+                sql.update_hashes(conn, file_info)
+                if store is not None:
+                    store.rekey(old_algorithm, old_hash, hash_algorithm, file_info.hash, file_info.size)
+                migrated += 1
+            except sqlite3.IntegrityError:
+                logger.warning(f'Collected file {full_name} has the same content as another file, skipped.')
+        conn.commit()
+        logger.info(f'{migrated} file hashes have been migrated to {hash_algorithm}.')
+
+    return migrated, missing
+
+
+def backfill_perceptual_hashes(conn, target_path: str, batch_size: int = 1000) -> Tuple[int, int]:
+    """知覚hashのない登録済み画像（見た目が同じ画像の判定を有効にする前に登録した画像）の知覚hashを計算する
+
+    保存先のファイルから計算し、batch_size件ごとにcommitする。戻り値は(計算した件数, 計算できなかった件数)。
+    読み込めない画像と保存先にない画像は知覚hashのないままとし、次回の実行で計算し直す。
+    """
+    backfilled = failed = 0
+    last_id = 0
+    while True:
+        rows = sql.get_images_without_perceptual_hash(conn, last_id, batch_size)
+        if not rows:
+            break
+
+        phashes = []
+        for file_id, save_to, name in rows:
+            last_id = file_id
+            full_name = os.path.join(target_path, save_to, name)
+            phash = FileInfo.read_phash(full_name) if os.path.isfile(full_name) else None
+            if phash is None:
+                failed += 1
+                logger.debug(f'Perceptual hash of collected file {full_name} can not be calculated.')
+            else:
+                phashes.append((phash, file_id))
+        sql.update_perceptual_hashes(conn, phashes)
+        conn.commit()
+        backfilled += len(phashes)
+        logger.info(f'Perceptual hashes of {backfilled} collected images have been calculated.')
+
+    return backfilled, failed
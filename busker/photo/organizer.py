@@ -1,14 +1,16 @@
 import sqlite3
 import tkinter as tk
 import os
-import shutil
+import time
+import queue
 import logging
+import threading
 import traceback
+from typing import Any, Dict, Optional
 from tkinter import filedialog, messagebox
 from busker.tkinter import center_window, MessagePanel
 from busker.utils import init_i18n, init_logging
-from busker.photo.file_info import read_all_files
-from busker.photo import sql
+from busker.photo.engine import PhotoImporter
 
 
 # init_logging('photo_organizer.log', logging.INFO, 'utf-8')
@@ -17,12 +19,22 @@ logger.setLevel(logging.INFO)
 
 
 class PhotoOrganizer:
-    batch_size = 100
+    """写真の自動整理の画面、取込処理はPhotoImporterで行う（設定はPhotoImporterのクラス属性を参照）
+
+    取込処理はワーカースレッドで実行し、進捗はキュー経由でprogress_intervalミリ秒ごとに画面に反映する。
+    ワーカースレッドでDBを使うため、connはcheck_same_thread=Falseで接続すること。
+    """
+    progress_interval = 100
 
     def __init__(self, conn):
         self.conn = conn
-        # テーブル定義
-        sql.create_table_file_info(conn)
+        # ワーカースレッドからの進捗
+        self.events: queue.Queue = queue.Queue()
+        self.importer = PhotoImporter(conn, self.events.put)
+        self.worker: Optional[threading.Thread] = None
+        # 取込対象のファイル数（残り時間の見積もり用）、数え終わるまではNone
+        self.total_files: Optional[int] = None
+        self.started_at = 0.0
 
         self.window = tk.Tk()
         self.window.title(_("Collect Photos Automatically"))        # noqa F821
@@ -57,6 +69,11 @@ class PhotoOrganizer:
         self.message_panel = MessagePanel(42, 30, master=self.window, max_lines=50)
         self.message_panel.grid(row=row, column=0, columnspan=2, pady=10, sticky='e')
 
+        # 処理件数、処理速度と残り時間
+        row += 1
+        self.status_label = tk.Label(self.window, anchor='w')
+        self.status_label.grid(row=row, column=0, columnspan=3, padx=10, sticky='we')
+
         # buttons
         row += 1
         self.collect_button = tk.Button(self.window, text=_("Collect photos"), command=self.collect_photos)   # noqa F821
@@ -110,99 +127,98 @@ class PhotoOrganizer:
                 if not result:
                     return
 
+        self.close_button.config(state=tk.DISABLED)
+        self.collect_button.config(state=tk.DISABLED)
+        self.message_panel.text_widget.config(state=tk.NORMAL)
+        self.status_label.config(text='')
+        self.total_files = None
+        self.started_at = time.monotonic()
+        source_folder = self.src_entry.get()
+        self.worker = threading.Thread(target=self.import_photos, args=(source_folder, target_folder),
+                                       name='busker-import', daemon=True)
+        self.worker.start()
+        threading.Thread(target=self.count_files, args=(source_folder,), name='busker-count', daemon=True).start()
+        self.window.after(self.progress_interval, self.poll_progress)
+
+    def import_photos(self, source_folder: str, target_folder: str) -> None:
+        """ワーカースレッドで取込処理を実行し、終了または失敗をキューに通知する"""
         try:
-            self.close_button.config(state=tk.DISABLED)
-            self.close_button.update()
-            self.message_panel.text_widget.config(state=tk.NORMAL)
-            self.message_panel.text_widget.update()
-
-            # 保存先フォルダーにあるファイルの情報がDBに未登録の場合は追加登録する
-            if sql.get_count(self.conn):
-                self.message_panel.add_message(_('Collecting photo information...'))        # noqa F821
-                logger.info('Collecting photo information...')
-                self.inspect_collected_files(self.tgt_entry.get())
-                self.message_panel.add_message(_('Collecting photo information has finished.'))        # noqa F821
-                logger.info('Collecting photo information has finished.')
-
+            self.importer.collect(source_folder, target_folder)
+            self.events.put(dict(event='done', **self.importer.stats()))
+        except Exception as e:
+            self.events.put({'event': 'failed', 'error': f"{e}\n{traceback.format_exc()}"})
+
+    def count_files(self, source_folder: str) -> None:
+        """取込処理と同じ条件で元フォルダーのファイル数を数え、残り時間の見積もり用にキューに通知する"""
+        self.events.put({'event': 'total', 'files': self.importer.walker.count(source_folder)})
+
+    def poll_progress(self) -> None:
+        """キューに溜まった進捗をまとめて画面に反映する、取込処理が終わるまで繰り返す"""
+        finished = False
+        while True:
+            try:
+                progress = self.events.get_nowait()
+            except queue.Empty:
+                break
+            finished = self.on_progress(progress) or finished
+        if not finished:
+            self.window.after(self.progress_interval, self.poll_progress)
+
+    def on_progress(self, progress: Dict[str, Any]) -> bool:
+        """取込処理の進捗を画面に表示する、取込処理が終わった場合はTrueを返す"""
+        event = progress['event']
+        if event == 'inspect_started':
+            self.message_panel.add_message(_('Collecting photo information...'))        # noqa F821
+        elif event == 'inspect_finished':
+            self.message_panel.add_message(_('Collecting photo information has finished.'))        # noqa F821
+        elif event == 'copy_started':
             self.message_panel.add_message(_('Copying and collecting photos...'))        # noqa F821
-            logger.info('Copying and collecting photos...')
-
-            # 写真を元の場所から保存先にコピーし、DBにファイル情報を登録する
-            self.copy_photos(self.src_entry.get(), self.tgt_entry.get())
-
+            # 処理速度は保存先の確認を除いたコピー処理で計算する
+            self.started_at = time.monotonic()
+        elif event == 'directory':
+            self.message_panel.add_message(progress['path'])
+        elif event == 'total':
+            self.total_files = progress['files']
+        elif event == 'batch' and 'scanned' in progress:
+            self.show_status(progress['scanned'], progress['copied'], progress['duplicated'])
+        elif event == 'done':
+            self.show_status(progress['scanned'], progress['copied'], progress['duplicated'])
             self.message_panel.add_message(_('Coping and collecting photos has finished.'))      # noqa F821
             self.message_panel.text_widget.config(state=tk.DISABLED)
-            logger.info('Coping and collecting photos has finished.')
             self.close_button.config(state=tk.NORMAL)
-        except Exception as e:
-            logger.error(f"An unknown error occurred: {e}\n{traceback.format_exc()}")
-            print(f"An unknown error occurred: {e}\n{traceback.format_exc()}")
+            self.collect_button.config(state=tk.NORMAL)
+            return True
+        elif event == 'failed':
+            logger.error(f"An unknown error occurred: {progress['error']}")
+            print(f"An unknown error occurred: {progress['error']}")
             messagebox.showerror(_("Unknown Error"), "System error happened, we will close the window.")     # noqa F821
             self.window.destroy()
-
-    def inspect_collected_files(self, target_path: str) -> None:
-        """保存先フォルダーにあるファイル情報が未収集の場合、DBに追加収集する"""
-        for file_infos in read_all_files(target_path, 1000):
-            for file_info in file_infos:
-                save_to = file_info.get_relative_path(target_path)
-                # ファイルがすでに収集済みかをチェックする、収集済みの場合は特に処理なし
-                if not sql.get_file_by_save_to__name(self.conn, save_to, file_info.name):
-                    # 未収集の場合、ファイルの名称、サイズとMD5で同一ファイルが既に収集済みかをチェックする
-                    existing = sql.get_same_file(self.conn, file_info)
-                    if existing:    # 同一ファイルが既に収集済の場合は特に処理なし
-                        if logging.getLogger().isEnabledFor(logging.DEBUG):
-                            logger.debug(f'Picture[{existing.full_name}] info already exists, the file {file_info.full_name} will not be collected.')     # noqa
-                    else:           # 同ファイルが未収集の場合、追加収集する
-                        file_info.save_to = save_to
-                        sql.register_file_info(self.conn, file_info)
-                        logger.debug(f'File {file_info.full_name} has been added to the database.')     # noqa
-
-    def copy_photos(self, source_path: str, target_path: str) -> None:
-        """指定フォルダー下にある写真ファイルを保存先にコピーし、ファイル情報をDBに収集する"""
-        current_path = ''
-        for file_infos in read_all_files(source_path, 500):
-            for file_info in file_infos:
-                # 現在処理中のフォルダー名を画面表示する
-                if current_path != file_info.path:
-                    current_path = file_info.path
-                    self.message_panel.add_message(f'{current_path}')        # noqa F821
-                    logger.info(f'Collecting files from directory {current_path}.')
-
-                # ファイルの名称、サイズとMD5で同一ファイルが既に収集済みかをチェックする
-                existing = sql.get_same_file(self.conn, file_info)
-                if existing:    # 同一ファイルが既に収集済の場合は特に処理なし
-                    logger.debug(f'Picture[{existing.full_name}] already exists, the file {file_info.full_name} will not be copied.')     # noqa
-                else:           # 同ファイルが未収集の場合、追加収集する
-                    target_folder = os.path.join(target_path, file_info.save_to)
-                    # 保存先フォルダーに年・月ごとにサブフォルダーを作成する
-                    os.makedirs(target_folder, exist_ok=True)
-                    original_file = file_info.full_name
-
-                    count = 0
-                    # ファイル名重複チェック
-                    file_name = file_info.name
-                    while sql.get_file_by_save_to__name(self.conn, file_info.save_to, file_name):
-                        # ファイル名の重複がなくなるまでループする
-                        count += 1
-                        base, extension = os.path.splitext(file_info.name)
-                        file_name = base + '_' + str(count).zfill(2) + extension
-
-                    # 写真を保存先へコピー
-                    shutil.copy2(original_file, os.path.join(target_folder, file_name))
-
-                    # ファイル情報の収集
-                    file_info.name = file_name
-                    sql.register_file_info(self.conn, file_info)
-                    logger.info(f'\tFile {original_file} has been copied to {os.path.join(target_folder, file_name)}.')
-            self.conn.commit()
+            return True
+        return False
+
+    def show_status(self, scanned: int, copied: int, duplicated: int) -> None:
+        """処理件数、1秒あたりの処理ファイル数と残り時間を表示する"""
+        elapsed = time.monotonic() - self.started_at
+        rate = scanned / elapsed if elapsed > 0 else 0.0
+        status = f'{scanned} files ({copied} copied, {duplicated} duplicated), {rate:.1f} files/sec'
+        if self.total_files is not None and rate > 0:
+            remaining = max(self.total_files - scanned, 0) / rate
+            status += f', ETA {int(remaining // 60)}:{int(remaining % 60):02d}'
+        self.status_label.config(text=status)
 
     def run(self):
         self.window.mainloop()
 
 
-with sqlite3.connect('photo_organizer.db') as connection:
-    init_logging('photo_organizer.log', logging.INFO, 'utf-8')
-    localedir = os.path.join(os.path.dirname(__file__), 'locale')
-    init_i18n('busker', localedir, 'ja_JP')
-    app = PhotoOrganizer(connection)
-    app.run()
+def main() -> None:
+    # 取込処理はワーカースレッドで実行するため、作成したスレッド以外からも接続を使う
+    with sqlite3.connect('photo_organizer.db', check_same_thread=False) as connection:
+        init_logging('photo_organizer.log', logging.INFO, 'utf-8')
+        localedir = os.path.join(os.path.dirname(__file__), 'locale')
+        init_i18n('busker', localedir, 'ja_JP')
+        app = PhotoOrganizer(connection)
+        app.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import logging
+from typing import Any, Generic, List, Optional, Tuple, TypeVar
+
+
+logger = logging.getLogger("busker.photo.perceptual")
+logger.setLevel(logging.INFO)
+
+# dHashの1辺のサイズ、hash_size * hash_sizeビットのhashになる
+HASH_SIZE = 8
+_MASK = (1 << HASH_SIZE * HASH_SIZE) - 1
+_SIGN = 1 << (HASH_SIZE * HASH_SIZE - 1)
+
+T = TypeVar('T')
+
+
+def read_dhash(full_name: str) -> Optional[int]:
+    """画像のdHash（縮小した輝度の横方向の差分）を計算する、読み込めない場合はNone
+
+    サイズ変更、再圧縮、メタデータの削除ではほとんど変わらないため、見た目が同じ画像の判定に使う。
+    SQLiteのINTEGERに格納できるよう、符号付き64bitの整数で返す。
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(full_name) as img:
+            # JPEGは縮小したサイズで展開して、読み込みを軽くする
+            img.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+            small = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BILINEAR)
+            pixels = small.tobytes()
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.debug(f'Perceptual hash of {full_name} can not be computed: {e}')
+        return None
+
+    value = 0
+    for y in range(HASH_SIZE):
+        row = pixels[y * (HASH_SIZE + 1):(y + 1) * (HASH_SIZE + 1)]
+        for x in range(HASH_SIZE):
+            value = value << 1 | (row[x] < row[x + 1])
+    return value - (1 << HASH_SIZE * HASH_SIZE) if value & _SIGN else value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin((a ^ b) & _MASK).count('1')
+
+
+class BKTree(Generic[T]):
+    """Hamming距離のBK-tree、距離max_distance以内のhashを全件比較せずに検索する
+
+    ノードは[hash, 要素のリスト, {距離: 子ノード}]で、三角不等式により距離の範囲外の子ノードは探索しない。
+    """
+
+    def __init__(self) -> None:
+        self.root: Optional[List[Any]] = None
+        self.size = 0
+
+    def add(self, key: int, item: T) -> None:
+        self.size += 1
+        if self.root is None:
+            self.root = [key, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(key, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, [item], {}]
+                return
+            node = child
+
+    def search(self, key: int, max_distance: int) -> List[Tuple[int, T]]:
+        """距離max_distance以内の(距離, 要素)を距離の近い順に返す"""
+        results: List[Tuple[int, T]] = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(key, node[0])
+            if distance <= max_distance:
+                results.extend((distance, item) for item in node[1])
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        results.sort(key=lambda result: result[0])
+        return results
@@ -0,0 +1,267 @@
+import os
+import queue
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from busker.file.fastcopy import copy_file
+from busker.photo.file_info import FileInfo
+from busker.photo.hash_cache import HashCache
+from busker.photo.journal import partial_name
+from busker.photo.catalog_index import CatalogIndex
+from busker.photo.store import ObjectStore
+from busker.photo.walker import FileWalker
+from busker.photo.metrics import metrics
+from busker.photo import sql
+
+
+logger = logging.getLogger("busker.photo.pipeline")
+logger.setLevel(logging.INFO)
+
+# ステージの終了を下流に伝える目印
+_DONE = object()
+
+
+class _Stage:
+    """同じ処理を行うワーカースレッドの集まり、入力キューから取り出した結果を出力キューに渡す"""
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int,
+                 input: queue.Queue, output: queue.Queue) -> None:
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.input = input
+        self.output = output
+        self.running = workers
+
+
+class ImportPipeline:
+    """写真の取込（走査、hash計算、同一ファイル判定、コピー、DB登録）を段階ごとのスレッドで並行処理する
+
+    ステージ間は上限付きのキューでつなぎ、下流が遅い場合は上流を待機させる。
+    hash計算とコピーはそれぞれhash_workers、copy_workers個のスレッドで処理し、
+    同一ファイル判定とファイル名の決定は登録済みファイルの索引（CatalogIndex）を使って1スレッドで順に行う。
+    DBへの書き込みは1つの書き込みスレッドだけが行い、connectで開いた接続でbatch_size件ごと
+    （またはflush_interval秒ごと）にまとめてcommitする。
+    同一ファイルは全体hashで判定する（PhotoOrganizer.dedup_mode = 'full'と同じ）。
+    いずれかのステージで例外が発生した場合は残りの処理を中断し、run()で例外を送出する。
+    走査はwalker（省略時は全ファイル）で行い、走査時に取得したstatをhash計算で使い回す。
+    progressを指定した場合、処理中のフォルダー（'directory'）とcommitした件数（'batch'）を辞書で通知する。
+    通知はパイプラインのスレッドから呼び出される。
+    """
+    queue_size = 256
+    flush_interval = 1.0
+
+    def __init__(self,
+                 connect: Callable[[], Any],
+                 hash_workers: int = 2,
+                 copy_workers: int = 2,
+                 batch_size: int = 500,
+                 copy_hardlink: bool = False,
+                 progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 walker: Optional[FileWalker] = None) -> None:
+        self.connect = connect
+        self.hash_workers = hash_workers
+        self.copy_workers = copy_workers
+        self.batch_size = batch_size
+        self.copy_hardlink = copy_hardlink
+        self.progress = progress
+        self.walker = walker or FileWalker()
+        self.index: Optional[CatalogIndex] = None
+        self.hash_cache: Optional[HashCache] = None
+        self.scanned = 0
+        self.duplicated = 0
+        self.copied = 0
+        # コピー方式ごとのファイル数
+        self.copy_methods: Dict[str, int] = {}
+        # コピー先のフォルダーごとの、取込処理で作成したか（DirectorySnapshot.refresh）
+        self.target_folders: Dict[str, bool] = {}
+        self.exception: Optional[BaseException] = None
+        self._failed = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self, source_path: str, target_path: str) -> None:
+        """source_path配下のファイルをtarget_pathへ取り込む"""
+        scanned: queue.Queue = queue.Queue(self.queue_size)
+        hashed: queue.Queue = queue.Queue(self.queue_size)
+        decided: queue.Queue = queue.Queue(self.queue_size)
+        copied: queue.Queue = queue.Queue(self.queue_size)
+        self.target_path = target_path
+        self.current_path = ''
+
+        # 索引とキャッシュは書き込みスレッドの接続で読み込み、読み込み後に他のステージを開始する
+        ready = threading.Event()
+        writer = threading.Thread(target=self._write, args=(source_path, copied, ready), name='busker-writer')
+        writer.start()
+        ready.wait()
+        if self._failed.is_set():
+            writer.join()
+            raise self.exception      # type: ignore
+
+        stages = [_Stage('hash', self._hash, self.hash_workers, scanned, hashed),
+                  _Stage('decide', self._decide, 1, hashed, decided),
+                  _Stage('copy', self._copy, self.copy_workers, decided, copied)]
+        threads = [threading.Thread(target=self._scan, args=(source_path, scanned), name='busker-scan')]
+        for stage in stages:
+            threads += [threading.Thread(target=self._work, args=(stage,), name=f'busker-{stage.name}-{i}')
+                        for i in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads + [writer]:
+            thread.join()
+
+        logger.info(f'Pipeline: {self.scanned} scanned, {self.duplicated} duplicated, {self.copied} copied, '
+                    f'copied files by method: {self.copy_methods}')
+        if self.exception is not None:
+            raise self.exception
+
+    def _fail(self, e: BaseException) -> None:
+        with self._lock:
+            if self.exception is None:
+                self.exception = e
+                logger.error(f'Pipeline has been aborted: {e}')
+        self._failed.set()
+
+    def _report(self, event: str, **fields: Any) -> None:
+        if self.progress:
+            self.progress(dict(event=event, **fields))
+
+    def _scan(self, source_path: str, output: queue.Queue) -> None:
+        try:
+            for root, files in self.walker.walk(source_path):
+                for file, stat in files:
+                    if self._failed.is_set():
+                        return
+                    output.put((file, root, stat))
+                    self.scanned += 1
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            output.put(_DONE)
+
+    def _work(self, stage: _Stage) -> None:
+        while True:
+            item = stage.input.get()
+            if item is _DONE:
+                # 同じステージの他のワーカーにも終了を伝える
+                stage.input.put(_DONE)
+                break
+            if self._failed.is_set():
+                # 中断した場合も、上流が待機したままにならないよう読み捨てる
+                continue
+            try:
+                result = stage.func(item)
+            except BaseException as e:
+                self._fail(e)
+                continue
+            if result is not None:
+                stage.output.put(result)
+
+        with self._lock:
+            stage.running -= 1
+            last = stage.running == 0
+        if last:
+            stage.output.put(_DONE)
+
+    def _hash(self, item: Tuple[str, str, os.stat_result]) -> FileInfo:
+        name, path, stat = item
+        return FileInfo.create(name, path, self.hash_cache, stat=stat)
+
+    def _decide(self, file_info: FileInfo) -> Optional[Tuple[FileInfo, str]]:
+        """同一ファイルが登録済みの場合はNone、未登録の場合は保存先のファイル名を決めて(ファイル情報, 元ファイル)を返す"""
+        index: CatalogIndex = self.index       # type: ignore
+        if self.current_path != file_info.path:
+            self.current_path = file_info.path
+            logger.info(f'Collecting files from directory {self.current_path}.')
+            self._report('directory', path=self.current_path)
+
+        if index.contains(file_info):
+            # 同一ファイルが既に収集済の場合は特に処理なし
+            self.duplicated += 1
+            metrics.inc('duplicates')
+            logger.debug(f'Picture {file_info.full_name} already exists, it will not be copied.')     # noqa
+            return None
+
+        original_file = file_info.full_name
+        # ファイル名重複チェック
+        file_name = index.resolve_name(file_info.save_to, file_info.name)
+        if file_name != file_info.name:
+            metrics.inc('collisions')
+        file_info.name = file_name
+        index.add(file_info)
+        target_folder = os.path.join(self.target_path, file_info.save_to)
+        if target_folder not in self.target_folders:
+            self.target_folders[target_folder] = not os.path.isdir(target_folder)
+        return file_info, original_file
+
+    def _copy(self, item: Tuple[FileInfo, str]) -> Tuple[FileInfo, str, os.stat_result]:
+        file_info, original_file = item
+        target_folder = os.path.join(self.target_path, file_info.save_to)
+        # 保存先フォルダーに年・月ごとにサブフォルダーを作成する
+        os.makedirs(target_folder, exist_ok=True)
+        target_file = os.path.join(target_folder, file_info.name)
+        # 中断した場合にコピー途中のファイルが残らないよう、PARTIAL_SUFFIX付きの名前でコピーしてから名前を変更する
+        partial_file = os.path.join(target_folder, partial_name(file_info.name))
+        with metrics.timer('copy'):
+            file_info.copy_method = copy_file(original_file, partial_file, self.copy_hardlink)
+            os.replace(partial_file, target_file)
+        metrics.inc('copied_files')
+        metrics.inc('copied_bytes', file_info.size)
+        logger.info(f'\tFile {original_file} has been copied to {target_file} by {file_info.copy_method}.')
+        return file_info, target_folder, os.stat(target_file)
+
+    def _write(self, source_path: str, input: queue.Queue, ready: threading.Event) -> None:
+        conn = None
+        try:
+            conn = self.connect()
+            sql.create_table_file_info(conn)
+            self.index = CatalogIndex.load(conn, FileInfo.hash_engine.name, self.target_path,
+                                           ObjectStore.open_existing(conn, self.target_path))
+            self.hash_cache = HashCache(conn)
+            self.hash_cache.load(source_path)
+            conn.commit()
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            ready.set()
+        if conn is None:
+            return
+
+        try:
+            self._write_batches(conn, input)
+        finally:
+            conn.close()
+
+    def _write_batches(self, conn, input: queue.Queue) -> None:
+        file_infos: List[FileInfo] = []
+        done = False
+        while not done:
+            try:
+                item = input.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            if item is _DONE:
+                done = True
+            elif item is not None and not self._failed.is_set():
+                file_info, target_folder, stat = item
+                # コピー先のファイルも次回以降のhash計算を省略する
+                self.hash_cache.put(target_folder, file_info.name, stat,       # type: ignore
+                                    file_info.hash_algorithm, file_info.hash, file_info.captured_at,
+                                    file_info.phash)
+                file_infos.append(file_info)
+                self.copied += 1
+                self.copy_methods[file_info.copy_method] = self.copy_methods.get(file_info.copy_method, 0) + 1
+
+            # 重複だけの場合も、保存先のファイルから計算したhashは書き込む
+            if (file_infos or self.index.backfilled) \
+                    and (done or item is None or len(file_infos) >= self.batch_size) \
+                    and not self._failed.is_set():
+                try:
+                    sql.register_file_infos(conn, file_infos)
+                    self.index.flush(conn)      # type: ignore
+                    self.hash_cache.flush()     # type: ignore
+                    conn.commit()
+                    self._report('batch', scanned=self.scanned, copied=self.copied, duplicated=self.duplicated)
+                except BaseException as e:
+                    conn.rollback()
+                    self._fail(e)
+                file_infos = []
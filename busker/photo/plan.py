@@ -0,0 +1,125 @@
+import os
+import json
+import logging
+from datetime import datetime
+from typing import IO, Any, Dict, List, NamedTuple, Optional, Tuple
+from busker.photo.file_info import FileInfo, FileType
+
+
+logger = logging.getLogger("busker.photo.plan")
+logger.setLevel(logging.INFO)
+
+PLAN_VERSION = 1
+
+# 計画の処理
+COPY = 'copy'
+DUPLICATE = 'duplicate'
+NEAR_DUPLICATE = 'near_duplicate'
+
+# 計画の1行の列、元ファイルのフォルダーは元フォルダーからの相対パス
+COLUMNS = ('action', 'path', 'name', 'target_name', 'save_to', 'size', 'hash', 'captured_at', 'created_at',
+           'modified_at', 'phash')
+
+
+class PlanEntry(NamedTuple):
+    action: str
+    path: str
+    name: str
+    target_name: Optional[str]
+    save_to: Optional[str]
+    size: int
+    hash: Optional[str]
+    captured_at: Optional[str]
+    created_at: Optional[str]
+    modified_at: Optional[str]
+    phash: Optional[int]
+
+
+def _to_str(value: Optional[datetime]) -> Optional[str]:
+    # DBに登録する文字列と同じ形式
+    return str(value) if value is not None else None
+
+
+class PlanWriter:
+    """取込の計画をJSON Lines形式で書き込む
+
+    1行目は元フォルダー、保存先、hashのアルゴリズムなどのヘッダー、2行目以降は1ファイル1行の列の配列（COLUMNS）。
+    """
+
+    def __init__(self, file_name: str, source_path: str, target_path: str, hash_algorithm: str) -> None:
+        self.file_name = file_name
+        self.source_path = source_path
+        self.header = {'version': PLAN_VERSION,
+                       'source': source_path,
+                       'target': target_path,
+                       'hash_algorithm': hash_algorithm,
+                       'created_at': datetime.now().isoformat(timespec='seconds'),
+                       'columns': COLUMNS}
+        self.counts: Dict[str, int] = {}
+        self._file: Optional[IO[str]] = None
+
+    def __enter__(self) -> 'PlanWriter':
+        # 書き込み途中の計画を実行しないよう、別名で書き込んでから名前を変更する
+        self._file = open(self.file_name + '.tmp', 'w', encoding='utf-8')
+        self._write(self.header)
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        self._file.close()      # type: ignore
+        if exc_type is None:
+            os.replace(self.file_name + '.tmp', self.file_name)
+            logger.info(f'Import plan {self.file_name} has been written: {self.counts}')
+        else:
+            os.remove(self.file_name + '.tmp')
+
+    def _write(self, value: Any) -> None:
+        self._file.write(json.dumps(value, ensure_ascii=False, separators=(',', ':')) + '\n')     # type: ignore
+
+    def add(self, action: str, file_info: FileInfo, source_name: str) -> None:
+        """ファイルの処理を追加する、コピーする場合のfile_info.nameは保存先のファイル名"""
+        copy = action == COPY
+        self._write([action,
+                     os.path.relpath(file_info.path, self.source_path),
+                     source_name,
+                     file_info.name if copy else None,
+                     file_info.save_to if copy else None,
+                     file_info.size,
+                     file_info.hash,
+                     _to_str(file_info.captured_at),
+                     _to_str(file_info.created_at),
+                     _to_str(file_info.modified_at),
+                     file_info.phash])
+        self.counts[action] = self.counts.get(action, 0) + 1
+
+
+def read_plan(file_name: str) -> Tuple[Dict[str, Any], List[PlanEntry]]:
+    """計画を読み込み、ヘッダーとファイルごとの処理を返す"""
+    with open(file_name, encoding='utf-8') as f:
+        header = json.loads(f.readline() or '{}')
+        if header.get('version') != PLAN_VERSION or tuple(header.get('columns', ())) != COLUMNS:
+            raise ValueError(f'{file_name} is not an import plan of version {PLAN_VERSION}.')
+        return header, [PlanEntry(*json.loads(line)) for line in f if line.strip()]
+
+
+def create_file_info(header: Dict[str, Any], entry: PlanEntry) -> FileInfo:
+    """計画のコピーする行から、保存先に登録するファイル情報を生成する"""
+    return FileInfo(None,
+                    entry.target_name,      # type: ignore
+                    os.path.normpath(os.path.join(header['source'], entry.path)),
+                    entry.size,
+                    entry.hash,
+                    entry.created_at,
+                    entry.modified_at,
+                    FileType.create(entry.name),
+                    entry.captured_at,
+                    entry.save_to,
+                    hash_algorithm=header['hash_algorithm'],
+                    phash=entry.phash)
+
+
+def sort_for_locality(entries: List[PlanEntry]) -> List[PlanEntry]:
+    """コピーの順序を、元ファイルのフォルダー、保存先フォルダー、ファイル名の順にする
+
+    同じフォルダーのファイルを続けて読み書きすることで、ディスクのシークとディレクトリの読み込みを減らす。
+    """
+    return sorted(entries, key=lambda entry: (entry.path, entry.save_to or '', entry.name))
@@ -0,0 +1,192 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from busker.photo.hasher import HashEngine, available_algorithms
+from busker.photo.walker import FileWalker
+from busker.photo import sql
+
+
+logger = logging.getLogger("busker.photo.scrub")
+logger.setLevel(logging.INFO)
+
+# 確認結果
+OK = 'ok'
+MISSING = 'missing'
+CHANGED = 'changed'
+# hashのアルゴリズムが利用できない（xxhashなどが未インストール）ため、サイズだけを確認した
+SIZE_ONLY = 'size_only'
+# アクセス権限、読み込みエラーなどで確認できなかった
+UNREADABLE = 'unreadable'
+
+
+class TokenBucket:
+    """1秒あたりrate単位まで処理を制限する、超過した分は次の補充まで待つ
+
+    複数のスレッドで共有でき、スレッド全体でrateを超えないようにする。
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount: float) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # 不足分は前借りし、補充されるまで待つ
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+
+class Scrubber:
+    """保存先のファイルが登録済みのサイズ、hashと一致するかを確認する
+
+    確認日時の古い順（未確認が先）にworkers個のスレッドで読み込み、確認日時と結果をbatch_size件ずつDB（file_scrub）に
+    書き込む。中断しても確認済みのファイルは次回の確認が後回しになるため、続きから確認できる。
+    bytes_per_sec、iopsを指定した場合は、読み込みのバイト数と読み込み回数（open、stat、read）を1秒あたりの値に制限する。
+    """
+    batch_size = 100
+
+    def __init__(self,
+                 conn,
+                 target_path: str,
+                 workers: int = 2,
+                 bytes_per_sec: Optional[float] = None,
+                 iops: Optional[float] = None,
+                 walker: Optional[FileWalker] = None,
+                 progress: Optional[Callable[..., None]] = None) -> None:
+        self.conn = conn
+        self.target_path = target_path
+        self.workers = max(workers, 1)
+        self.bytes_bucket = TokenBucket(bytes_per_sec, HashEngine.default_buffer_size) if bytes_per_sec else None
+        self.iops_bucket = TokenBucket(iops) if iops else None
+        self.walker = walker or FileWalker()
+        self.progress = progress
+        self.engines: Dict[str, HashEngine] = {}
+        self.counts: Dict[str, int] = {}
+        self.missing: List[str] = []
+        self.changed: List[str] = []
+        self.unreadable: List[str] = []
+        self.orphaned: List[str] = []
+        # テーブル定義
+        sql.create_table_file_scrub(conn)
+
+    def run(self, limit: Optional[int] = None, orphans: bool = True) -> Dict[str, Any]:
+        """確認日時の古いファイルから最大limit件（Noneの場合は全件）を確認し、結果の件数を返す"""
+        started_at = datetime.now()
+        self.counts = {OK: 0, MISSING: 0, CHANGED: 0, SIZE_ONLY: 0, UNREADABLE: 0}
+        verified = 0
+        # 通知する結果ごとの保存先のファイル
+        failures = {MISSING: self.missing, CHANGED: self.changed, UNREADABLE: self.unreadable}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='busker-scrub') as pool:
+            while limit is None or verified < limit:
+                size = self.batch_size if limit is None else min(self.batch_size, limit - verified)
+                rows = sql.get_files_to_scrub(self.conn, started_at, size)
+                if not rows:
+                    break
+                results = list(pool.map(self.verify, rows))
+                sql.register_scrub_results(self.conn, [(row[0], datetime.now(), status)
+                                                       for row, status in zip(rows, results)])
+                self.conn.commit()
+                for (_, save_to, name, *_), status in zip(rows, results):
+                    self.counts[status] += 1
+                    if status in failures:
+                        full_name = os.path.join(self.target_path, save_to, name)
+                        failures[status].append(full_name)
+                        logger.warning(f'File {full_name} is {status}.')
+                verified += len(rows)
+                self.report('scrub_batch', verified=verified, **self.counts)
+
+        summary: Dict[str, Any] = dict(self.counts, verified=verified)
+        if orphans:
+            self.orphaned = self.find_orphans()
+            summary['orphaned'] = len(self.orphaned)
+        logger.info(f'Scrubbed {self.target_path}: {summary}')
+        return summary
+
+    def report(self, event: str, **fields: Any) -> None:
+        if self.progress:
+            self.progress(dict(event=event, **fields))
+
+    def engine(self, hash_algorithm: Optional[str]) -> Optional[HashEngine]:
+        if hash_algorithm not in available_algorithms():
+            return None
+        engine = self.engines.get(hash_algorithm)     # type: ignore
+        if engine is None:
+            engine = self.engines[hash_algorithm] = HashEngine(hash_algorithm)      # type: ignore
+        return engine
+
+    def verify(self, row: Tuple[int, str, str, int, Optional[str], Optional[str]]) -> str:
+        """登録済みファイル1件を確認し、結果を返す、確認用のスレッドで実行する
+
+        ファイルを読み込めない場合（OSError）は、他のファイルの確認を続けられるようUNREADABLEとする。
+        """
+        file_id, save_to, name, size, hash, hash_algorithm = row
+        full_name = os.path.join(self.target_path, save_to, name)
+        try:
+            return self.verify_file(full_name, size, hash, hash_algorithm)
+        except FileNotFoundError:
+            return MISSING
+        except OSError as e:
+            logger.debug(f'File {full_name} can not be read: {e}')
+            return UNREADABLE
+
+    def verify_file(self, full_name: str, size: int, hash: Optional[str], hash_algorithm: Optional[str]) -> str:
+        self.throttle(0, 1)
+        if os.stat(full_name).st_size != size:
+            return CHANGED
+        engine = self.engine(hash_algorithm)
+        if hash is None or engine is None:
+            return SIZE_ONLY
+        return OK if self.read_hash(engine, full_name) == hash else CHANGED
+
+    def read_hash(self, engine: HashEngine, full_name: str) -> str:
+        """HashEngine.hash_fileと同じhashを、読み込みを制限しながら計算する"""
+        hash = engine.new()
+        buffer = bytearray(engine.buffer_size)
+        view = memoryview(buffer)
+        self.throttle(0, 1)
+        with open(full_name, 'rb') as f:
+            while True:
+                length = f.readinto(buffer)
+                if not length:
+                    break
+                self.throttle(length, 1)
+                hash.update(view[:length])
+        return hash.hexdigest()
+
+    def throttle(self, size: int, operations: int) -> None:
+        if self.bytes_bucket and size:
+            self.bytes_bucket.consume(size)
+        if self.iops_bucket:
+            self.iops_bucket.consume(operations)
+
+    def find_orphans(self) -> List[str]:
+        """保存先にあり、DBに登録されていないファイル
+
+        読み込み回数は、フォルダーごとのstatと一覧の取得、ファイルごとのstatをそれぞれ1回として制限する。
+        """
+        names = sql.get_saved_names(self.conn)
+        orphans: List[str] = []
+        # walkはフォルダーの一覧の取得後にchanged、ファイルのstatの前にskipを呼び出す
+        walk = self.walker.walk(self.target_path,
+                                changed=lambda path, stat, entry_count: self.throttle(0, 2) or True,
+                                skip=lambda path, name: self.throttle(0, 1) or False)
+        for path, files in walk:
+            save_to = os.path.relpath(path, self.target_path)
+            for name, stat in files:
+                if (save_to, name) not in names:
+                    orphans.append(os.path.join(path, name))
+        for orphan in orphans:
+            logger.warning(f'File {orphan} is not in the catalog.')
+        return orphans
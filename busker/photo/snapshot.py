@@ -0,0 +1,91 @@
+import os
+import time
+import logging
+from typing import Dict, Iterator, Optional, Set, Tuple
+from busker.photo.walker import FileWalker, WalkItem
+from busker.photo import sql
+
+
+logger = logging.getLogger("busker.photo.snapshot")
+logger.setLevel(logging.INFO)
+
+
+class DirectorySnapshot:
+    """フォルダーごとの更新日時とエントリー数を保存し、前回の確認から変更されたフォルダーだけを返す
+
+    フォルダーにファイルを追加・削除・名前変更すると、そのフォルダーの更新日時が変わる。
+    更新日時とエントリー数が前回と同じフォルダーは、ファイルのstat取得とhash計算を省略する
+    （サブフォルダーの変更は親フォルダーに反映されないため、サブフォルダーは全て確認する）。
+    走査したフォルダーの状態はflush()で書き込むため、ファイル情報の登録と同じトランザクションでcommitすること。
+    """
+    # 更新日時の精度が粗いファイルシステムで、同じ時刻内の変更を見逃さないよう、
+    # 直近racy_window_ns以内に更新されたフォルダーは状態を保存しない
+    racy_window_ns = 2 * 10 ** 9
+
+    def __init__(self, conn) -> None:
+        self.conn = conn
+        # パスごとの(更新日時, エントリー数)
+        self.entries: Dict[str, Tuple[int, int]] = {}
+        self.pending: Dict[str, Tuple[int, int]] = {}
+        self.seen: Set[str] = set()
+        # load()以降に走査したフォルダー、登録済みのファイルだけであることを確認済み
+        self.verified: Set[str] = set()
+        self.unchanged = 0
+        self.changed = 0
+        # テーブル定義
+        sql.create_table_dir_snapshot(conn)
+
+    def load(self, directory: str) -> None:
+        """フォルダー配下の保存済みの状態を読み込む"""
+        self.entries = {path: (mtime_ns, entry_count)
+                        for path, mtime_ns, entry_count in sql.get_dir_snapshots(self.conn, directory)}
+        self.pending = {}
+        self.seen = set()
+        self.verified = set()
+        self.unchanged = self.changed = 0
+
+    def walk(self, directory: str, walker: Optional[FileWalker] = None) -> Iterator[WalkItem]:
+        """前回から変更されたフォルダーの(パス, [(ファイル名, stat)])を返す、走査はwalker（省略時は全ファイル）で行う"""
+        return (walker or FileWalker()).walk(directory, self.is_changed)
+
+    def is_changed(self, path: str, stat: os.stat_result, entry_count: int) -> bool:
+        self.seen.add(path)
+        self.verified.add(path)
+        state = (stat.st_mtime_ns, entry_count)
+        if self.entries.get(path) == state:
+            self.unchanged += 1
+            return False
+
+        self.changed += 1
+        if time.time_ns() - stat.st_mtime_ns > self.racy_window_ns:
+            self.pending[path] = state
+        return True
+
+    def refresh(self, path: str, created: bool = False) -> None:
+        """登録済みのファイルだけのフォルダーに、コピーしたファイルを登録した後の状態を保存する
+
+        保存先の確認で走査したフォルダーと、取込処理で作成したフォルダー（createdがTrue）だけを対象とする。
+        フォルダーの内容は書き込んだ処理が把握しているため、更新直後でもracy_window_nsを待たずに保存する
+        （保存後に他の処理がファイルを追加した場合は、エントリー数の変化で検出する）。
+        """
+        if not created and path not in self.verified:
+            return
+        try:
+            stat = os.stat(path)
+            self.pending[path] = (stat.st_mtime_ns, len(os.listdir(path)))
+        except OSError:
+            return
+
+    def flush(self, directory: str) -> None:
+        """走査したフォルダーの状態を書き込み、なくなったフォルダーの状態を削除する、commitは呼び出し側で行う"""
+        if self.pending:
+            sql.register_dir_snapshots(self.conn, [(path,) + state for path, state in self.pending.items()])
+            self.entries.update(self.pending)
+            self.pending = {}
+        if self.seen:
+            removed = [path for path in self.entries if path not in self.seen]
+            sql.delete_dir_snapshots(self.conn, removed)
+            for path in removed:
+                del self.entries[path]
+            self.seen = set()
+            logger.info(f'Directory snapshot of {directory}: {self.changed} changed, {self.unchanged} unchanged.')
@@ -1,8 +1,12 @@
+import json
 import logging
+import os
+import time
 from datetime import datetime, date
 from numbers import Number
-from typing import Any, Iterable, List, Optional
-from busker.file.file_info import FileInfo
+from typing import Any, Dict, Iterable, List, Optional, Set
+from busker.photo.file_info import FileInfo
+from busker.photo.metrics import Histogram, metrics
 
 
 logger = logging.getLogger("busker.file.sql")
@@ -14,34 +18,151 @@ def parameterize_query(query: str, parameters: Optional[Iterable[Any]] = None) -
     if parameters is None:
         return query
 
-    for parameter in parameters:
-        index = query.find('?')
-        if index != -1:
-            if isinstance(parameter, datetime):
-                parameter = "'" + parameter.strftime('%Y/%m/%d %H:%M:%S') + "'"
-            elif isinstance(parameter, date):
-                parameter = "'" + parameter.strftime('%Y/%m/%d') + "'"
-            elif isinstance(parameter, Number):
-                parameter = str(parameter)
-            elif parameter:
-                parameter = "'" + parameter + "'"
-            else:
-                parameter = 'NULL'
-
-            prefix = query[:index]
-            suffix = query[index + 1:]
-            query = prefix + parameter + suffix
-    return query
+    # プレースホルダーで一度だけ分割し、パラメーターを埋め込んで連結する
+    parts = query.split('?')
+    result = [parts[0]]
+    for index, parameter in enumerate(parameters, 1):
+        if index >= len(parts):
+            break
+        if isinstance(parameter, datetime):
+            parameter = "'" + parameter.strftime('%Y/%m/%d %H:%M:%S') + "'"
+        elif isinstance(parameter, date):
+            parameter = "'" + parameter.strftime('%Y/%m/%d') + "'"
+        elif isinstance(parameter, Number):
+            parameter = str(parameter)
+        elif parameter:
+            parameter = "'" + parameter + "'"
+        else:
+            parameter = 'NULL'
+        result.append(parameter)
+        result.append(parts[index])
+    return '?'.join([''.join(result)] + parts[len(result) // 2 + 1:])
+
+
+class StatementStats:
+    """SQL文ひとつ分の実行回数、実行時間（秒）、取得件数
+
+    実行時間は実行回数によらず一定のメモリで集計するよう、metrics.Histogramのバケットごとの件数で記録する。
+    """
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.rows = 0
+        self.latency = Histogram()
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.latency.observe(seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent: float) -> float:
+        """バケットの上限値で近似した分位数、最大値を超える場合は最大値"""
+        if not self.latency.count:
+            return 0.0
+        return min(self.latency.quantile(percent / 100), self.max)
+
+    def to_dict(self) -> Dict[str, Any]:
+        total = self.latency.sum
+        return {'calls': self.calls,
+                'rows': self.rows,
+                'total': total,
+                'mean': total / self.calls if self.calls else 0.0,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99),
+                'max': self.max}
+
+
+class QueryStats:
+    """SQL文ごとの実行統計、enabledがTrueの場合のみexec_queryで計測する"""
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.statements: Dict[str, StatementStats] = {}
+
+    def get(self, query: str) -> StatementStats:
+        stats = self.statements.get(query)
+        if stats is None:
+            stats = self.statements[query] = StatementStats()
+        return stats
+
+    def reset(self) -> None:
+        self.statements = {}
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        """SQL文（空白を詰めたもの）ごとの統計、合計実行時間の降順"""
+        summary = {' '.join(query.split()): stats.to_dict() for query, stats in self.statements.items()}
+        return dict(sorted(summary.items(), key=lambda item: item[1]['total'], reverse=True))
+
+    def dump(self, file_name: str) -> None:
+        """統計をJSONファイルに出力する"""
+        with open(file_name, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    def log_summary(self) -> None:
+        for query, stats in self.to_dict().items():
+            logger.info(f"{stats['calls']} calls, {stats['rows']} rows, total {stats['total']:.3f}s, "
+                        f"p50 {stats['p50'] * 1000:.3f}ms, p95 {stats['p95'] * 1000:.3f}ms: {query}")
+
+
+query_stats = QueryStats()
+
+
+class _StatsCursor:
+    """取得件数を計上するカーソル"""
+
+    def __init__(self, cursor, stats: StatementStats) -> None:
+        self._cursor = cursor
+        self._stats = stats
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._stats.rows += 1
+        return row
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._stats.rows += len(rows)
+        return rows
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
 
 
 def exec_query(conn, query: str, parameters: Optional[Iterable[Any]] = None):
-    logger.debug(parameterize_query(query, parameters))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(parameterize_query(query, parameters))
+    enabled = query_stats.enabled
+    start = time.perf_counter() if enabled or metrics.enabled else 0.0
     cursor = conn.cursor()
     if parameters:
         cursor.execute(query, parameters)
     else:
         cursor.execute(query)
-    return cursor
+    if metrics.enabled:
+        metrics.observe('sqlite', time.perf_counter() - start)
+    if not enabled:
+        return cursor
+
+    stats = query_stats.get(query)
+    stats.calls += 1
+    stats.observe(time.perf_counter() - start)
+    return _StatsCursor(cursor, stats)
+
+
+def exec_many(conn, query: str, rows: List[tuple]) -> None:
+    """同じSQL文を複数行のパラメーターで一括実行する"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f'{query} x {len(rows)}')
+    start = time.perf_counter()
+    conn.cursor().executemany(query, rows)
+    metrics.observe('sqlite', time.perf_counter() - start)
+    if query_stats.enabled:
+        stats = query_stats.get(query)
+        stats.calls += 1
+        stats.rows += len(rows)
+        stats.observe(time.perf_counter() - start)
 
 
 def create_table_file_info(conn) -> None:
@@ -58,12 +179,84 @@ def create_table_file_info(conn) -> None:
                 file_type TEXT,
                 captured_at DATETIME,
                 save_to TEXT,
+                sample_hash TEXT,
+                hash_algorithm TEXT DEFAULT 'md5',
+                copy_method TEXT,
+                phash INTEGER,
                 UNIQUE (save_to, name),
                 UNIQUE (size, hash, captured_at)
             )
         '''
     exec_query(conn, query)
 
+    # 既存DBのテーブル定義に追加列を反映する
+    add_column_if_not_exists(conn, 'file_info', 'sample_hash', 'TEXT')
+    # 列追加前に登録されたhashはMD5
+    add_column_if_not_exists(conn, 'file_info', 'hash_algorithm', "TEXT DEFAULT 'md5'")
+    add_column_if_not_exists(conn, 'file_info', 'copy_method', 'TEXT')
+    # 画像の知覚hash（busker.photo.perceptual）、見た目が同じ画像の判定に使う
+    add_column_if_not_exists(conn, 'file_info', 'phash', 'INTEGER')
+    exec_query(conn, 'CREATE INDEX IF NOT EXISTS file_info_size ON file_info (size, captured_at)')
+
+
+def add_column_if_not_exists(conn, table: str, column: str, definition: str) -> None:
+    """テーブルに列が存在しない場合、列を追加する"""
+    cursor = exec_query(conn, f'PRAGMA table_info({table})')
+    if column not in [row[1] for row in cursor.fetchall()]:
+        exec_query(conn, f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def create_table_file_cache(conn) -> None:
+    """ファイルのstat情報をキーにしたhash、撮影日時のキャッシュ用テーブル"""
+    query = '''
+            CREATE TABLE IF NOT EXISTS file_cache (
+                path TEXT not null,
+                name TEXT not null,
+                size INTEGER not null,
+                mtime_ns INTEGER not null,
+                inode INTEGER not null,
+                hash_algorithm TEXT not null DEFAULT 'md5',
+                hash TEXT not null,
+                captured_at DATETIME,
+                PRIMARY KEY (path, name)
+            )
+        '''
+    exec_query(conn, query)
+
+    # 既存DBのテーブル定義に追加列を反映する
+    add_column_if_not_exists(conn, 'file_cache', 'hash_algorithm', "TEXT not null DEFAULT 'md5'")
+    add_column_if_not_exists(conn, 'file_cache', 'phash', 'INTEGER')
+
+
+def escape_like(value: str) -> str:
+    """LIKE句のワイルドカード文字をエスケープする（ESCAPE '\\' と併用）"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def get_file_cache(conn, directory: str) -> List[tuple]:
+    """フォルダー配下（サブフォルダーを含む）のキャッシュを検索する"""
+    query = "SELECT path, name, size, mtime_ns, inode, hash_algorithm, hash, captured_at, phash FROM file_cache \
+             WHERE path = ? OR path LIKE ? ESCAPE '\\'"
+
+    directory = directory.rstrip(os.path.sep)
+    parameters = (directory, escape_like(directory + os.path.sep) + '%')
+    cursor = exec_query(conn, query, parameters)
+    return cursor.fetchall()
+
+
+def register_file_cache(conn, rows: List[tuple]) -> None:
+    """キャッシュを一括登録する、同じパス・名称のキャッシュは置き換える"""
+    query = 'INSERT OR REPLACE INTO file_cache (path, name, size, mtime_ns, inode, hash_algorithm, hash, \
+             captured_at, phash) values (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+
+    exec_many(conn, query, rows)
+
+
+def get_database_file(conn) -> str:
+    """接続中のDBファイル名、メモリ上のDBの場合は空文字"""
+    cursor = exec_query(conn, 'PRAGMA database_list')
+    return cursor.fetchone()[2]
+
 
 def get_count(conn):
     query = 'SELECT count(1) FROM file_info'
@@ -72,11 +265,43 @@ def get_count(conn):
     return cursor.fetchone()[0]
 
 
-def get_file_by_save_to__name(conn, save_to: str, name: str) -> List['FileInfo']:
-    """相対パスと名称を条件に、登録済みファイル情報を検索する"""
-    query = 'SELECT * FROM file_info WHERE save_to = ? AND name = ?'
+def get_index_rows(conn) -> List[tuple]:
+    """索引用に、全登録済みファイルの(ID, サイズ, hash, 撮影日時, hashアルゴリズム, 保存先の相対パス, 名称)を検索する"""
+    query = 'SELECT id, size, hash, captured_at, hash_algorithm, save_to, name FROM file_info'
+
+    cursor = exec_query(conn, query)
+    return cursor.fetchall()
+
+
+def get_perceptual_hashes(conn) -> List[tuple]:
+    """知覚hashの索引用に、知覚hashのある登録済みファイルの(知覚hash, 保存先の相対パス, 名称)を検索する"""
+    query = 'SELECT phash, save_to, name FROM file_info WHERE phash IS NOT NULL'
+
+    cursor = exec_query(conn, query)
+    return cursor.fetchall()
+
+
+def get_images_without_perceptual_hash(conn, last_id: int, limit: int) -> List[tuple]:
+    """知覚hashのない登録済み画像の(ID, 保存先の相対パス, 名称)を、ID順にlimit件検索する"""
+    query = "SELECT id, save_to, name FROM file_info WHERE phash IS NULL AND file_type = 'image' AND id > ? \
+             ORDER BY id LIMIT ?"
+
+    cursor = exec_query(conn, query, (last_id, limit))
+    return cursor.fetchall()
+
 
-    parameters = (save_to, name)
+def update_perceptual_hashes(conn, rows: List[tuple]) -> None:
+    """保存先のファイルから計算した(知覚hash, ID)を反映する"""
+    query = 'UPDATE file_info SET phash = ? WHERE id = ?'
+
+    exec_many(conn, query, rows)
+
+
+def get_files_by_size__captured_at(conn, size: int, captured_at) -> List[FileInfo]:
+    """サイズと撮影日時を条件に、登録済みファイル情報を検索する"""
+    query = 'SELECT * FROM file_info WHERE size = ? AND captured_at = ?'
+
+    parameters = (size, captured_at)
     cursor = exec_query(conn, query, parameters)
     results = cursor.fetchall()
 
@@ -87,31 +312,257 @@ def get_file_by_save_to__name(conn, save_to: str, name: str) -> List['FileInfo']
     return []
 
 
-def get_same_file(conn, file_info: FileInfo) -> Optional[FileInfo]:
-    """ファイル情報（サイズ、hash、撮影日時）を条件に、登録済みファイル情報を検索する"""
-    query = 'SELECT * FROM file_info WHERE size = ? AND hash = ? AND captured_at = ?'
+def update_hashes(conn, file_info: FileInfo) -> None:
+    """後から計算したhash、サンプルhashを登録済みファイル情報に反映する"""
+    query = 'UPDATE file_info SET hash = ?, sample_hash = ?, hash_algorithm = ? WHERE id = ?'
+
+    parameters = (file_info.hash, file_info.sample_hash, file_info.hash_algorithm, file_info.id)
+    exec_query(conn, query, parameters)
+
+
+def update_hashes_many(conn, file_infos: List[FileInfo]) -> None:
+    """update_hashesを複数のファイル情報にまとめて実行する"""
+    query = 'UPDATE file_info SET hash = ?, sample_hash = ?, hash_algorithm = ? WHERE id = ?'
+
+    rows = [(file_info.hash, file_info.sample_hash, file_info.hash_algorithm, file_info.id) for file_info in file_infos]
+    exec_many(conn, query, rows)
+
 
-    parameters = (file_info.size, file_info.hash, file_info.captured_at)
+def update_backfilled_hashes(conn, rows: List[tuple]) -> None:
+    """保存先のファイルから計算した(hash, アルゴリズム, ID)を反映する、異なるアルゴリズムのサンプルhashは消去する"""
+    # 同じサイズ、hash、撮影日時のファイルが登録済み（UNIQUE制約）の場合は反映しない
+    query = '''UPDATE OR IGNORE file_info SET hash = ?1,
+               sample_hash = CASE WHEN hash_algorithm = ?2 THEN sample_hash END, hash_algorithm = ?2 WHERE id = ?3'''
+
+    exec_many(conn, query, rows)
+
+
+def get_count_by_other_hash_algorithm(conn, hash_algorithm: str) -> int:
+    """指定アルゴリズム以外で計算したhashの登録件数"""
+    query = 'SELECT count(1) FROM file_info WHERE hash IS NOT NULL AND hash_algorithm <> ?'
+
+    cursor = exec_query(conn, query, (hash_algorithm,))
+    return cursor.fetchone()[0]
+
+
+def get_files_by_other_hash_algorithm(conn, hash_algorithm: str, last_id: int, limit: int) -> List[FileInfo]:
+    """指定アルゴリズム以外で計算したhashの登録済みファイル情報を、ID順にlimit件検索する"""
+    query = 'SELECT * FROM file_info WHERE hash IS NOT NULL AND hash_algorithm <> ? AND id > ? ORDER BY id LIMIT ?'
+
+    parameters = (hash_algorithm, last_id, limit)
     cursor = exec_query(conn, query, parameters)
-    result = cursor.fetchone()
+    results = cursor.fetchall()
 
-    if result:
-        return FileInfo(*result)
-    else:
-        return None
+    if results:
+        columns = [desc[0] for desc in cursor.description]
+        return [FileInfo(**dict(zip(columns, row))) for row in results]
+
+    return []
 
 
-def register_file_info(conn, file_info: FileInfo) -> None:
+def register_file_infos(conn, file_infos: List[FileInfo]) -> None:
+    """ファイル情報を一括登録する"""
     query = 'insert into file_info (name, path, size, hash, created_at, modified_at, file_type, captured_at, \
-             save_to) values (?, ?, ?, ?, ?, ?, ?, ?, ?)'
-
-    parameters = (file_info.name,
-                  file_info.path,
-                  file_info.size,
-                  file_info.hash,
-                  file_info.created_at,
-                  file_info.modified_at,
-                  file_info.file_type,
-                  file_info.captured_at,
-                  file_info.save_to)
-    exec_query(conn, query, parameters)
+             save_to, sample_hash, hash_algorithm, copy_method, phash) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+
+    rows = [(file_info.name,
+             file_info.path,
+             file_info.size,
+             file_info.hash,
+             file_info.created_at,
+             file_info.modified_at,
+             file_info.file_type,
+             file_info.captured_at,
+             file_info.save_to,
+             file_info.sample_hash,
+             file_info.hash_algorithm,
+             file_info.copy_method,
+             file_info.phash) for file_info in file_infos]
+    exec_many(conn, query, rows)
+
+
+def create_table_import_journal(conn) -> None:
+    """取込処理の再開用テーブル
+
+    import_run: 取込処理ごとの元フォルダー、保存先、状態（running、finished、failed）、走査位置
+    import_folder: 取込処理がコピーに使用した保存先のフォルダー（コピー前にcommitする）
+    import_journal: 取込処理で処理済みの元ファイル（バッチごとにcommitする）
+    """
+    exec_query(conn, '''
+            CREATE TABLE IF NOT EXISTS import_run (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source_path TEXT not null,
+                target_path TEXT not null,
+                status TEXT not null,
+                walk_path TEXT,
+                files INTEGER not null DEFAULT 0,
+                started_at DATETIME,
+                updated_at DATETIME
+            )
+        ''')
+    exec_query(conn, '''
+            CREATE TABLE IF NOT EXISTS import_folder (
+                run_id INTEGER not null,
+                save_to TEXT not null,
+                PRIMARY KEY (run_id, save_to)
+            )
+        ''')
+    exec_query(conn, '''
+            CREATE TABLE IF NOT EXISTS import_journal (
+                run_id INTEGER not null,
+                path TEXT not null,
+                name TEXT not null,
+                status TEXT not null,
+                PRIMARY KEY (run_id, path, name)
+            )
+        ''')
+
+
+def register_import_run(conn, source_path: str, target_path: str) -> int:
+    query = "INSERT INTO import_run (source_path, target_path, status, started_at, updated_at) \
+             VALUES (?, ?, 'running', ?, ?)"
+
+    now = datetime.now()
+    cursor = exec_query(conn, query, (source_path, target_path, now, now))
+    return cursor.lastrowid
+
+
+def get_unfinished_import_runs(conn, target_path: str) -> List[tuple]:
+    """保存先が同じ、完了していない取込処理の(id, 元フォルダー, 走査位置, 処理済みファイル数)を新しい順に検索する"""
+    query = "SELECT id, source_path, walk_path, files FROM import_run \
+             WHERE target_path = ? AND status = 'running' ORDER BY id DESC"
+
+    cursor = exec_query(conn, query, (target_path,))
+    return cursor.fetchall()
+
+
+def update_import_run(conn, run_id: int, status: str, walk_path: Optional[str], files: int) -> None:
+    query = 'UPDATE import_run SET status = ?, walk_path = ?, files = ?, updated_at = ? WHERE id = ?'
+
+    exec_query(conn, query, (status, walk_path, files, datetime.now(), run_id))
+
+
+def register_import_folder(conn, run_id: int, save_to: str) -> None:
+    exec_query(conn, 'INSERT OR IGNORE INTO import_folder (run_id, save_to) VALUES (?, ?)', (run_id, save_to))
+
+
+def get_import_folders(conn, run_id: int) -> List[str]:
+    cursor = exec_query(conn, 'SELECT save_to FROM import_folder WHERE run_id = ?', (run_id,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def register_import_journal(conn, run_id: int, rows: List[tuple]) -> None:
+    """処理済みの元ファイル(パス, 名称, 状態)を一括登録する"""
+    query = 'INSERT OR REPLACE INTO import_journal (run_id, path, name, status) VALUES (?, ?, ?, ?)'
+
+    exec_many(conn, query, [(run_id,) + row for row in rows])
+
+
+def get_import_journal(conn, run_id: int) -> List[tuple]:
+    cursor = exec_query(conn, 'SELECT path, name FROM import_journal WHERE run_id = ?', (run_id,))
+    return cursor.fetchall()
+
+
+def delete_import_run(conn, run_id: int) -> None:
+    """取込処理の処理済みファイルとフォルダーを削除する、import_runの行は履歴として残す"""
+    exec_query(conn, 'DELETE FROM import_journal WHERE run_id = ?', (run_id,))
+    exec_query(conn, 'DELETE FROM import_folder WHERE run_id = ?', (run_id,))
+
+
+def create_table_dir_snapshot(conn) -> None:
+    """保存先のフォルダーごとの更新日時とエントリー数、前回の確認から変更のないフォルダーの走査を省略する"""
+    query = '''
+            CREATE TABLE IF NOT EXISTS dir_snapshot (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER not null,
+                entry_count INTEGER not null
+            )
+        '''
+    exec_query(conn, query)
+
+
+def get_dir_snapshots(conn, directory: str) -> List[tuple]:
+    """フォルダー（サブフォルダーを含む）の(パス, 更新日時, エントリー数)を検索する"""
+    query = "SELECT path, mtime_ns, entry_count FROM dir_snapshot WHERE path = ? OR path LIKE ? ESCAPE '\\'"
+
+    directory = directory.rstrip(os.path.sep)
+    cursor = exec_query(conn, query, (directory, escape_like(directory + os.path.sep) + '%'))
+    return cursor.fetchall()
+
+
+def register_dir_snapshots(conn, rows: List[tuple]) -> None:
+    query = 'INSERT OR REPLACE INTO dir_snapshot (path, mtime_ns, entry_count) VALUES (?, ?, ?)'
+
+    exec_many(conn, query, rows)
+
+
+def delete_dir_snapshots(conn, paths: Iterable[str]) -> None:
+    exec_many(conn, 'DELETE FROM dir_snapshot WHERE path = ?', [(path,) for path in paths])
+
+
+def create_table_stored_object(conn) -> None:
+    """コンテンツアドレス方式の保存先（busker.photo.store）に保存したファイルの内容"""
+    query = '''
+            CREATE TABLE IF NOT EXISTS stored_object (
+                hash_algorithm TEXT not null,
+                hash TEXT not null,
+                size INTEGER not null,
+                stored_at DATETIME,
+                PRIMARY KEY (hash_algorithm, hash)
+            )
+        '''
+    exec_query(conn, query)
+
+
+def register_stored_objects(conn, rows: List[tuple]) -> None:
+    query = 'INSERT OR IGNORE INTO stored_object (hash_algorithm, hash, size, stored_at) VALUES (?, ?, ?, ?)'
+
+    exec_many(conn, query, rows)
+
+
+def get_stored_files(conn) -> List[tuple]:
+    """内容を保存したファイル情報の(保存先の相対パス, 名称, hash, アルゴリズム, 撮影日時)、撮影日時の順"""
+    query = '''SELECT f.save_to, f.name, f.hash, f.hash_algorithm, f.captured_at FROM file_info f
+               JOIN stored_object o ON o.hash_algorithm = f.hash_algorithm AND o.hash = f.hash
+               ORDER BY f.captured_at, f.id'''
+
+    cursor = exec_query(conn, query)
+    return cursor.fetchall()
+
+
+def create_table_file_scrub(conn) -> None:
+    """登録済みファイルの保存先のファイルを最後に確認した日時と結果（busker.photo.scrub）、file_infoの1行に1行"""
+    query = '''
+            CREATE TABLE IF NOT EXISTS file_scrub (
+                file_id INTEGER PRIMARY KEY,
+                verified_at DATETIME not null,
+                status TEXT not null
+            )
+        '''
+    exec_query(conn, query)
+
+
+def get_files_to_scrub(conn, verified_before: datetime, limit: int) -> List[tuple]:
+    """verified_beforeより前に確認した、または未確認の登録済みファイルを、確認日時の古い順（未確認が先）にlimit件検索する
+
+    戻り値は(ID, 保存先の相対パス, 名称, サイズ, hash, hashアルゴリズム)。
+    """
+    query = '''SELECT f.id, f.save_to, f.name, f.size, f.hash, f.hash_algorithm FROM file_info f
+               LEFT JOIN file_scrub s ON s.file_id = f.id
+               WHERE s.verified_at IS NULL OR s.verified_at < ?
+               ORDER BY s.verified_at IS NOT NULL, s.verified_at, f.id LIMIT ?'''
+
+    cursor = exec_query(conn, query, (verified_before, limit))
+    return cursor.fetchall()
+
+
+def register_scrub_results(conn, rows: List[tuple]) -> None:
+    query = 'INSERT OR REPLACE INTO file_scrub (file_id, verified_at, status) VALUES (?, ?, ?)'
+
+    exec_many(conn, query, rows)
+
+
+def get_saved_names(conn) -> Set[tuple]:
+    """全登録済みファイルの(保存先の相対パス, 名称)"""
+    cursor = exec_query(conn, 'SELECT save_to, name FROM file_info')
+    return set(cursor.fetchall())
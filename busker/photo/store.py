@@ -0,0 +1,134 @@
+import os
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from busker.photo.catalog_index import CatalogIndex
+from busker.photo.file_info import FileInfo
+from busker.photo.journal import partial_name
+from busker.photo import sql
+
+
+logger = logging.getLogger("busker.photo.store")
+logger.setLevel(logging.INFO)
+
+# 保存先直下の、ファイルの内容を保存するフォルダー
+OBJECTS_FOLDER = '.busker-objects'
+# 同じ内容のファイルが保存済みで、ハードリンクだけを作成した場合のコピー方式
+SHARED = 'shared'
+
+
+class ObjectStore:
+    """ファイルの内容をhashごとに1つだけ保存する、コンテンツアドレス方式の保存先
+
+    内容はOBJECTS_FOLDER/アルゴリズム/hashの先頭2文字/hashに保存し、年・月のフォルダーのファイル（ビュー）は
+    内容へのハードリンクにする。同じ内容のファイルは撮影日時などが異なって別に登録しても、ディスク上は1つになる。
+    ビューはbuild_view()でDBから作り直せるため、フォルダー構成の変更でファイルの内容はコピーしない。
+    保存した内容はflush()でDB（stored_object）に書き込むため、ファイル情報の登録と同じトランザクションでcommitすること。
+    """
+
+    def __init__(self, conn, target_path: str) -> None:
+        self.conn = conn
+        self.target_path = target_path
+        self.root = os.path.join(target_path, OBJECTS_FOLDER)
+        # 未登録の(アルゴリズム, hash, サイズ, 保存日時)
+        self.pending: List[tuple] = []
+        self.stored = 0
+        self.shared = 0
+        # テーブル定義
+        sql.create_table_stored_object(conn)
+
+    def object_path(self, hash_algorithm: str, hash: str) -> str:
+        return os.path.join(self.root, hash_algorithm, hash[:2], hash)
+
+    def add(self, file_info: FileInfo, source_file: str, copy: Callable[[str, str], str]) -> str:
+        """ファイルの内容を保存し、コピー方式を返す、同じ内容が保存済みの場合はコピーせずにSHAREDを返す
+
+        copy(source_file, 保存するファイル)で内容をコピーし、コピー方式を返すこと。
+        """
+        object_file = self.object_path(file_info.hash_algorithm, file_info.hash)      # type: ignore
+        if os.path.exists(object_file):
+            # 保存後、DBへの書き込み前に中断した内容も登録する（登録済みの場合は無視する）
+            self.pending.append((file_info.hash_algorithm, file_info.hash, file_info.size, datetime.now()))
+            self.shared += 1
+            return SHARED
+
+        os.makedirs(os.path.dirname(object_file), exist_ok=True)
+        # コピーのスレッドが同じ内容を同時に保存しても、コピー途中のファイルが重ならないようにする
+        partial_file = partial_name(f'{object_file}.{threading.get_ident()}')
+        method = copy(source_file, partial_file)
+        os.replace(partial_file, object_file)
+        self.pending.append((file_info.hash_algorithm, file_info.hash, file_info.size, datetime.now()))
+        self.stored += 1
+        return method
+
+    def link(self, file_info: FileInfo, view_file: str) -> None:
+        """ビューのファイルを、保存済みの内容へのハードリンクとして作成する、作成済みの場合はそのままにする"""
+        object_file = self.object_path(file_info.hash_algorithm, file_info.hash)      # type: ignore
+        if os.path.lexists(view_file) and os.path.samefile(view_file, object_file):
+            return
+        os.link(object_file, view_file)
+
+    def flush(self) -> None:
+        sql.register_stored_objects(self.conn, self.pending)
+        self.pending = []
+
+    def rekey(self, old_algorithm: Optional[str], old_hash: Optional[str], hash_algorithm: str, hash: str,
+              size: int) -> None:
+        """hashを再計算したファイルの内容を、新しいhashでも参照できるようにする、commitは呼び出し側で行う
+
+        保存済みの内容へのハードリンクを新しいhashの位置に作成して登録するため、ビューから見つからなくならない。
+        古いhashの内容がない（保存先に直接コピーした）ファイルは何もしない。
+        """
+        if old_algorithm is None or old_hash is None:
+            return
+        old_file = self.object_path(old_algorithm, old_hash)
+        if not os.path.exists(old_file):
+            return
+        object_file = self.object_path(hash_algorithm, hash)
+        if not os.path.exists(object_file):
+            os.makedirs(os.path.dirname(object_file), exist_ok=True)
+            os.link(old_file, object_file)
+        sql.register_stored_objects(self.conn, [(hash_algorithm, hash, size, datetime.now())])
+
+    def build_view(self, view_path: str, layout: Optional[str] = None) -> Dict[str, int]:
+        """登録済みファイル情報からビューのフォルダーを作成し、作成・作成済み・内容がない件数を返す
+
+        layoutは撮影日時のフォルダー構成（strftimeの形式、'%Y'、'%Y/%m/%d'など）、
+        Noneの場合は登録済みの保存先（save_to）とファイル名で、保存先のビューを作り直す。
+        作成済みのハードリンクはそのままにするため、繰り返し実行できる。
+        """
+        counts = {'linked': 0, 'existing': 0, 'missing': 0}
+        # 作成するビューのファイル名の重複チェック
+        names = CatalogIndex(FileInfo.hash_engine.name)
+        for save_to, name, hash, hash_algorithm, captured_at in sql.get_stored_files(self.conn):
+            object_file = self.object_path(hash_algorithm, hash)
+            if not os.path.exists(object_file):
+                counts['missing'] += 1
+                continue
+            if layout is not None:
+                folder = datetime.fromisoformat(str(captured_at)).strftime(layout.replace('/', os.path.sep))
+            else:
+                folder = save_to
+            os.makedirs(os.path.join(view_path, folder), exist_ok=True)
+            while True:
+                view_file = os.path.join(view_path, folder, names.resolve_name(folder, name))
+                if not os.path.exists(view_file):
+                    os.link(object_file, view_file)
+                    counts['linked'] += 1
+                    break
+                if os.path.samefile(view_file, object_file):
+                    counts['existing'] += 1
+                    break
+        logger.info(f'View {view_path} has been built: {counts}')
+        return counts
+
+    @classmethod
+    def open_existing(cls, conn, target_path: str) -> Optional['ObjectStore']:
+        """保存先に内容を保存したフォルダーがある場合はObjectStoreを返す、hashを再計算する処理で使う"""
+        if os.path.isdir(os.path.join(target_path, OBJECTS_FOLDER)):
+            return cls(conn, target_path)
+        return None
+
+    def log_summary(self) -> None:
+        logger.info(f'Object store {self.root}: {self.stored} stored, {self.shared} shared with stored contents.')
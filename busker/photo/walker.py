@@ -0,0 +1,124 @@
+import os
+import logging
+from fnmatch import fnmatch
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from busker.photo.file_info import FileType
+
+
+logger = logging.getLogger("busker.photo.walker")
+logger.setLevel(logging.INFO)
+
+# (フォルダー, [(ファイル名, stat)])
+WalkItem = Tuple[str, List[Tuple[str, os.stat_result]]]
+
+
+class FileWalker:
+    """os.scandirでフォルダー配下のファイルを走査し、ファイルごとに1回だけ取得したstatと一緒に返す
+
+    ファイル名がexcludeのパターン（fnmatch形式）に一致するファイルとフォルダー、includeを指定した場合に
+    一致しないファイル、media_onlyがTrueの場合に画像・動画以外のファイルは、statの取得前に除外する。
+    除外したファイル数は理由ごとにskippedに集計する。
+    """
+
+    def __init__(self,
+                 include: Iterable[str] = (),
+                 exclude: Iterable[str] = (),
+                 media_only: bool = False) -> None:
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self.media_only = media_only
+        self.files = 0
+        self.skipped: Dict[str, int] = {'excluded': 0, 'not_included': 0, 'not_media': 0, 'excluded_dirs': 0}
+
+    def is_excluded(self, name: str) -> bool:
+        return any(fnmatch(name, pattern) for pattern in self.exclude)
+
+    def accepts(self, name: str) -> bool:
+        """ファイル名で処理対象かを判定する、対象外の場合は理由ごとに計上する"""
+        if self.is_excluded(name):
+            self.skipped['excluded'] += 1
+            return False
+        if self.include and not any(fnmatch(name, pattern) for pattern in self.include):
+            self.skipped['not_included'] += 1
+            return False
+        if self.media_only and FileType.create(name) == FileType.UNKNOWN:
+            self.skipped['not_media'] += 1
+            return False
+        return True
+
+    def walk(self,
+             directory: str,
+             changed: Optional[Callable[[str, os.stat_result, int], bool]] = None,
+             skip: Optional[Callable[[str, str], bool]] = None) -> Iterator[WalkItem]:
+        """フォルダーごとに(フォルダー, [(ファイル名, stat)])を返す、os.walkと同じ順で走査する
+
+        changed(フォルダー, フォルダーのstat, エントリー数)がFalseを返すフォルダーのファイルは返さない
+        （サブフォルダーは走査する）。skip(フォルダー, ファイル名)がTrueを返すファイルはstatを取得せずに除外する。
+        シンボリックリンクのフォルダーはos.walkと同様にたどらない。
+        """
+        for path, names in self._walk_entries(directory, changed):
+            files: List[Tuple[str, os.stat_result]] = []
+            for entry in names:
+                if not self.accepts(entry.name) or (skip and skip(path, entry.name)):
+                    continue
+                try:
+                    files.append((entry.name, entry.stat()))
+                except OSError as e:
+                    # 走査中に削除されたファイルなど
+                    logger.warning(f'File {entry.path} can not be read: {e}')
+            self.files += len(files)
+            yield path, files
+
+    def _walk_entries(self,
+                      directory: str,
+                      changed: Optional[Callable[[str, os.stat_result, int], bool]] = None
+                      ) -> Iterator[Tuple[str, List[os.DirEntry]]]:
+        """フォルダーごとに(フォルダー, フォルダー以外のエントリー)を返す、ファイル名の条件は判定しない"""
+        stack = [directory]
+        while stack:
+            path = stack.pop()
+            try:
+                # 一覧の取得後に変更された場合も次回に検出できるよう、フォルダーのstatは一覧より先に取得する
+                dir_stat = os.stat(path) if changed else None
+                with os.scandir(path) as it:
+                    entries = list(it)
+            except OSError as e:
+                logger.warning(f'Directory {path} can not be read: {e}')
+                continue
+
+            dirs: List[str] = []
+            names: List[os.DirEntry] = []
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if self.is_excluded(entry.name):
+                        self.skipped['excluded_dirs'] += 1
+                    elif not entry.is_symlink():
+                        dirs.append(entry.path)
+                else:
+                    names.append(entry)
+            stack.extend(reversed(dirs))
+
+            if changed and not changed(path, dir_stat, len(entries)):       # type: ignore
+                continue
+            yield path, names
+
+    def count(self, directory: str, skip: Optional[Callable[[str, str], bool]] = None) -> int:
+        """walkと同じ条件で処理対象のファイル数を数える、進捗の残り時間の見積もりに使う
+
+        ファイルのstatは取得しない。件数は計上しないよう同じ条件の別のFileWalkerで走査するため、
+        走査中のwalkと並行して別のスレッドで実行してもよい。
+        """
+        counter = self.copy()
+        return sum(1 for path, names in counter._walk_entries(directory) for entry in names
+                   if counter.accepts(entry.name) and not (skip and skip(path, entry.name)))
+
+    def copy(self) -> 'FileWalker':
+        """同じ条件で走査し、件数は別に計上するFileWalkerを作成する"""
+        return FileWalker(self.include, self.exclude, self.media_only)
+
+    def log_summary(self) -> None:
+        logger.info(f'Walked {self.files} files, skipped: {self.skipped}')
@@ -0,0 +1,189 @@
+import os
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+from typing import Dict, List, Optional, Tuple
+from busker.photo.walker import FileWalker, WalkItem
+
+
+logger = logging.getLogger("busker.photo.watch")
+logger.setLevel(logging.INFO)
+
+# inotifyのイベント（linux/inotify.h）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# struct inotify_event の名前より前の部分(wd, mask, cookie, len)
+_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """Linuxのinotifyで、フォルダー配下に作成・書き込み・移動されたファイルを検出する
+
+    サブフォルダーにも監視を追加し、監視の追加前に作成されたファイルを見逃さないよう、新しいフォルダーは走査する。
+    イベントのキューがあふれた場合は、フォルダー配下を全て走査して返す。
+    """
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+
+    def __init__(self, directory: str, walker: FileWalker) -> None:
+        self.directory = directory
+        self.walker = walker
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f'inotify_init1 failed: {os.strerror(errno)}')
+        # 監視ディスクリプターごとのフォルダー
+        self.watches: Dict[int, str] = {}
+        self.add_tree(directory)
+
+    def add_watch(self, path: str) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            logger.warning(f'Directory {path} can not be watched: {os.strerror(errno)}')
+        else:
+            self.watches[wd] = path
+
+    def add_tree(self, directory: str) -> List[str]:
+        """フォルダー配下の全てのフォルダーを監視し、既にあるファイルを返す"""
+        files: List[str] = []
+        for path, entries in self.walker.walk(directory):
+            self.add_watch(path)
+            files += [os.path.join(path, name) for name, stat in entries]
+        return files
+
+    def poll(self, timeout: float) -> List[str]:
+        """timeout秒まで待ち、作成・変更されたファイルを返す"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        files: List[str] = []
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\x00'))
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                logger.warning(f'inotify event queue overflowed, rescanning {self.directory}.')
+                return self.add_tree(self.directory)
+            if mask & IN_IGNORED:
+                # 削除されたフォルダー
+                self.watches.pop(wd, None)
+                continue
+            path = self.watches.get(wd)
+            if path is None or not name:
+                continue
+            full_name = os.path.join(path, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and not self.walker.is_excluded(name):
+                    files += self.add_tree(full_name)
+            elif self.walker.accepts(name):
+                files.append(full_name)
+        return files
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """inotifyを使用できない場合に、interval秒ごとにフォルダー配下を走査し、前回から追加・変更されたファイルを返す
+
+    走査はos.scandirのstatを比較するだけで、ファイルの内容は読み込まない。作成時点で既にあるファイルは返さない。
+    """
+
+    def __init__(self, directory: str, walker: FileWalker, interval: float) -> None:
+        self.directory = directory
+        self.walker = walker
+        self.interval = interval
+        # ファイルごとの(サイズ, 更新日時)
+        self.entries: Dict[str, Tuple[int, int]] = {}
+        self.scan()
+        self.scanned_at = time.monotonic()
+
+    def scan(self) -> List[str]:
+        entries: Dict[str, Tuple[int, int]] = {}
+        for path, files in self.walker.walk(self.directory):
+            for name, stat in files:
+                entries[os.path.join(path, name)] = (stat.st_size, stat.st_mtime_ns)
+        changed = [file for file, key in entries.items() if self.entries.get(file) != key]
+        self.entries = entries
+        return changed
+
+    def poll(self, timeout: float) -> List[str]:
+        wait = self.scanned_at + self.interval - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(wait, 0))
+        self.scanned_at = time.monotonic()
+        return self.scan()
+
+    def close(self) -> None:
+        pass
+
+
+def create_watcher(directory: str, walker: FileWalker, polling: bool = False, interval: float = 5.0):
+    """inotifyの監視を作成する、使用できない場合、pollingがTrueの場合は定期的に走査する監視を作成する
+
+    監視の走査は取込処理の件数（walker.files、skipped）に計上しないよう、同じ条件の別のFileWalkerで行う。
+    """
+    walker = walker.copy()
+    if not polling:
+        try:
+            return InotifyWatcher(directory, walker)
+        except (OSError, AttributeError) as e:
+            # Linux以外（libcにinotify_init1がない）、監視数の上限など
+            logger.warning(f'inotify is not available, polling {directory} every {interval} seconds: {e}')
+    return PollingWatcher(directory, walker, interval)
+
+
+class Debouncer:
+    """作成・変更されたファイルを、settle_seconds秒の間サイズと更新日時が変わらなくなるまで待たせる
+
+    アップロード中のファイルを取り込まないよう、書き込みが終わったファイルだけをready()で返す。
+    """
+
+    def __init__(self, settle_seconds: float) -> None:
+        self.settle_seconds = settle_seconds
+        # ファイルごとの((サイズ, 更新日時), 最後に変化を確認した時刻)
+        self.pending: Dict[str, Optional[Tuple[Tuple[int, int], float]]] = {}
+
+    def add(self, full_name: str) -> None:
+        # 変更された場合は待ち直す
+        self.pending[full_name] = None
+
+    def ready(self, now: Optional[float] = None) -> List[WalkItem]:
+        """書き込みが終わったファイルを、フォルダーごとの(フォルダー, [(ファイル名, stat)])で返す"""
+        now = time.monotonic() if now is None else now
+        folders: Dict[str, List[Tuple[str, os.stat_result]]] = {}
+        for full_name, last in list(self.pending.items()):
+            try:
+                stat = os.stat(full_name)
+            except OSError:
+                # 削除・移動されたファイル
+                del self.pending[full_name]
+                continue
+            key = (stat.st_size, stat.st_mtime_ns)
+            if last is None or last[0] != key:
+                self.pending[full_name] = (key, now)
+            elif now - last[1] >= self.settle_seconds:
+                del self.pending[full_name]
+                path, name = os.path.split(full_name)
+                folders.setdefault(path, []).append((name, stat))
+        return [(path, sorted(files)) for path, files in sorted(folders.items())]
@@ -0,0 +1,38 @@
+import os
+import json
+import tempfile
+from unittest import mock
+import pytest
+from busker.benchmark.generator import TreeGenerator
+from busker.benchmark.runner import BenchmarkRunner, compare
+from busker.photo.metadata import read_image_captured_at
+
+
+def test_generator_is_reproducible():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        generator = TreeGenerator(50, duplicate_rate=0.2, collision_rate=0.2, video_rate=0.1, video_size=1024)
+        generator.files_per_folder = 10
+        first, second = os.path.join(temp_dir, 'first'), os.path.join(temp_dir, 'second')
+        files = generator.generate(first)
+        assert sum(files.values()) == 50 and all(files.values())
+        assert generator.generate(second) == files
+        assert generator.generate(first) == files
+
+        folder = os.path.join(first, 'DCIM', '100BUSKER')
+        assert sorted(os.listdir(folder)) == sorted(os.listdir(os.path.join(second, 'DCIM', '100BUSKER')))
+        assert read_image_captured_at(os.path.join(folder, 'IMG_0000000.JPG')).year >= 2015
+
+        with pytest.raises(FileExistsError):
+            TreeGenerator(10).generate(first)
+
+
+def test_runner_writes_comparable_results():
+    with tempfile.TemporaryDirectory() as temp_dir, mock.patch('busker.benchmark.runner.time.sleep'):
+        result = BenchmarkRunner(temp_dir, TreeGenerator(30, video_size=1024)).run()
+        result = json.loads(json.dumps(result))
+        assert set(result['results']) == {'read_all_files', 'copy_photos', 'sql.get_files_by_size__captured_at',
+                                          'catalog_index.load', 'catalog_index.contains',
+                                          'catalog_index.resolve_name', 'inspect_collected_files',
+                                          'inspect_collected_files.unchanged'}
+        assert result['results']['copy_photos']['stats']['scanned'] == 30
+        assert set(compare(result, result).values()) <= {1.0, None}
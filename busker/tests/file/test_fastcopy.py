@@ -0,0 +1,53 @@
+import os
+import errno
+import tempfile
+from unittest import mock
+from busker.file import fastcopy
+
+
+def _create_source(temp_dir):
+    src = os.path.join(temp_dir, 'src.jpg')
+    with open(src, 'wb') as f:
+        f.write(os.urandom(100000))
+    os.utime(src, (1600000000, 1600000000))
+    return src
+
+
+def _read(file):
+    with open(file, 'rb') as f:
+        return f.read()
+
+
+def test_copy_file_keeps_content_and_metadata():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        src = _create_source(temp_dir)
+        dst = os.path.join(temp_dir, 'dst.jpg')
+        method = fastcopy.copy_file(src, dst)
+        assert method in (fastcopy.REFLINK, fastcopy.COPY_FILE_RANGE, fastcopy.SENDFILE, fastcopy.BUFFERED)
+        assert _read(dst) == _read(src)
+        assert os.stat(dst).st_mtime == 1600000000
+        assert os.stat(dst).st_ino != os.stat(src).st_ino
+
+
+def test_copy_file_by_hardlink():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        src = _create_source(temp_dir)
+        dst = os.path.join(temp_dir, 'dst.jpg')
+        assert fastcopy.copy_file(src, dst, hardlink=True) == fastcopy.HARDLINK
+        assert os.stat(dst).st_ino == os.stat(src).st_ino
+
+
+def test_copy_file_falls_back_to_buffered_copy():
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, 'unsupported')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        src = _create_source(temp_dir)
+        dst = os.path.join(temp_dir, 'dst.jpg')
+        with mock.patch.object(fastcopy, 'fcntl', None), \
+                mock.patch.object(os, 'copy_file_range', unsupported, create=True), \
+                mock.patch.object(os, 'sendfile', unsupported, create=True), \
+                mock.patch.object(os, 'link', unsupported):
+            assert fastcopy.copy_file(src, dst, hardlink=True) == fastcopy.BUFFERED
+        assert _read(dst) == _read(src)
+        assert os.stat(dst).st_mtime == 1600000000
@@ -0,0 +1,61 @@
+import os
+import sqlite3
+import tempfile
+from datetime import datetime
+from busker.photo.file_info import FileInfo
+from busker.photo.catalog_index import CatalogIndex
+from busker.photo import sql
+
+
+def _file_info(name, save_to, size, hash, hash_algorithm='md5'):
+    captured_at = datetime(2023, 1, 2, 3, 4, 5, 678)
+    return FileInfo(None, name, '/source', size, hash, captured_at, captured_at, 'image', captured_at, save_to,
+                    hash_algorithm=hash_algorithm)
+
+
+def test_catalog_index_contains():
+    with sqlite3.connect(':memory:') as conn:
+        sql.create_table_file_info(conn)
+        sql.register_file_infos(conn, [_file_info('a.jpg', '2023/01', 1, 'aa'),
+                                       _file_info('b.jpg', '2023/01', 2, 'bb', 'blake2b')])
+        index = CatalogIndex.load(conn, 'md5')
+
+        # DBの撮影日時（文字列）とFileInfoの撮影日時（datetime）が一致する
+        assert index.contains(_file_info('x.jpg', '2023/02', 1, 'aa'))
+        assert not index.contains(_file_info('x.jpg', '2023/02', 1, 'ab'))
+        # 他のアルゴリズムのhashは一致しない
+        assert not index.contains(_file_info('x.jpg', '2023/02', 2, 'bb', 'blake2b'))
+        assert index.contains_size(_file_info('x.jpg', '2023/02', 2, None))
+        assert index.contains_name('2023/01', 'b.jpg')
+
+        index.add(_file_info('c.jpg', '2023/02', 3, 'cc'))
+        assert index.contains(_file_info('x.jpg', '2023/02', 3, 'cc'))
+        assert index.contains_name('2023/02', 'c.jpg')
+
+
+def test_catalog_index_resolve_name():
+    index = CatalogIndex('md5')
+    index.names['2023/01'] = {'IMG.jpg', 'IMG_01.jpg', 'IMG_03.jpg'}
+
+    assert index.resolve_name('2023/01', 'other.jpg') == 'other.jpg'
+    assert index.resolve_name('2023/01', 'IMG.jpg') == 'IMG_02.jpg'
+    assert index.resolve_name('2023/01', 'IMG.jpg') == 'IMG_04.jpg'
+    assert index.suffixes[('2023/01', 'IMG.jpg')] == 4
+    assert index.resolve_name(os.path.join('2023', '02'), 'IMG.jpg') == 'IMG.jpg'
+
+
+def test_catalog_index_backfills_unhashed_files():
+    with tempfile.TemporaryDirectory() as target_dir, sqlite3.connect(':memory:') as conn:
+        sql.create_table_file_info(conn)
+        os.makedirs(os.path.join(target_dir, '2023', '01'))
+        with open(os.path.join(target_dir, '2023', '01', 'a.jpg'), 'wb') as f:
+            f.write(b'a' * 10)
+        # 段階的な同一ファイル判定で、hashを計算せずに登録したファイル
+        sql.register_file_infos(conn, [_file_info('a.jpg', os.path.join('2023', '01'), 10, None)])
+        index = CatalogIndex.load(conn, 'md5', target_dir)
+
+        hash = FileInfo.hash_engine.hash_file(os.path.join(target_dir, '2023', '01', 'a.jpg'))
+        assert index.contains(_file_info('x.jpg', '2023/02', 10, hash))
+        assert not index.unhashed
+        index.flush(conn)
+        assert CatalogIndex.load(conn, 'md5').contains(_file_info('x.jpg', '2023/02', 10, hash))
@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import tempfile
+from unittest import mock
+from busker.photo.file_info import FileInfo
+from busker.photo.dedup import StagedDeduplicator
+from busker.photo import sql
+
+
+def _write(directory, name, data):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name), 'wb') as f:
+        f.write(data)
+
+
+def _register(conn, target_dir, name, data):
+    """保存先にファイルを作成し、hash未計算のままDBに登録する"""
+    _write(os.path.join(target_dir, '2023', '01'), name, data)
+    file_info = FileInfo.create(name, os.path.join(target_dir, '2023', '01'), with_hash=False)
+    file_info.save_to = os.path.join('2023', '01')
+    sql.register_file_infos(conn, [file_info])
+    return file_info
+
+
+def _create(directory, name, data, like: FileInfo):
+    _write(directory, name, data)
+    file_info = FileInfo.create(name, directory, with_hash=False)
+    # 撮影日時を登録済みファイルに合わせる
+    file_info.captured_at = like.captured_at
+    return file_info
+
+
+def test_unique_size_skips_hashing():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        sql.create_table_file_info(conn)
+        target_dir = os.path.join(temp_dir, 'target')
+        registered = _register(conn, target_dir, 'a.jpg', b'a' * 10)
+
+        source = _create(os.path.join(temp_dir, 'source'), 'b.jpg', b'b' * 20, registered)
+        deduplicator = StagedDeduplicator(conn, target_dir)
+        with mock.patch.object(FileInfo, 'read_hash') as read_hash, \
+                mock.patch.object(FileInfo, 'read_sample_hash') as read_sample_hash:
+            assert deduplicator.find_same_file(source) is None
+            read_hash.assert_not_called()
+            read_sample_hash.assert_not_called()
+        assert deduplicator.unique_size == 1
+
+
+def test_sample_hash_mismatch_skips_full_hash():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn, \
+            mock.patch.object(FileInfo, 'sample_size', 4):
+        sql.create_table_file_info(conn)
+        target_dir = os.path.join(temp_dir, 'target')
+        registered = _register(conn, target_dir, 'a.jpg', b'head' + b'x' * 100 + b'tail')
+
+        source = _create(os.path.join(temp_dir, 'source'), 'b.jpg', b'head' + b'x' * 100 + b'TAIL', registered)
+        deduplicator = StagedDeduplicator(conn, target_dir)
+        assert deduplicator.find_same_file(source) is None
+        assert source.hash is None
+        assert deduplicator.full_hashed == 0
+
+        # 登録済みファイルのサンプルhashはflush()でDBに反映される
+        deduplicator.flush()
+        [registered] = sql.get_files_by_size__captured_at(conn, registered.size, registered.captured_at)
+        assert registered.sample_hash is not None
+
+
+def test_same_file_is_found_and_hash_filled():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn, \
+            mock.patch.object(FileInfo, 'sample_size', 4):
+        sql.create_table_file_info(conn)
+        target_dir = os.path.join(temp_dir, 'target')
+        data = b'head' + b'x' * 100 + b'tail'
+        registered = _register(conn, target_dir, 'a.jpg', data)
+
+        source = _create(os.path.join(temp_dir, 'source'), 'b.jpg', data, registered)
+        deduplicator = StagedDeduplicator(conn, target_dir)
+        existing = deduplicator.find_same_file(source)
+        assert existing is not None
+        assert existing.name == 'a.jpg'
+        assert source.hash == existing.hash == FileInfo.read_hash(source.full_name)
+        deduplicator.flush()
+        [registered] = sql.get_files_by_size__captured_at(conn, registered.size, registered.captured_at)
+        assert registered.hash == source.hash
+
+
+def test_candidates_are_searched_once_per_batch():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn, \
+            mock.patch.object(FileInfo, 'sample_size', 4):
+        sql.create_table_file_info(conn)
+        target_dir = os.path.join(temp_dir, 'target')
+        data = b'head' + b'x' * 100 + b'tail'
+        registered = _register(conn, target_dir, 'a.jpg', data)
+
+        sources = [_create(os.path.join(temp_dir, 'source'), name, data, registered) for name in ('b.jpg', 'c.jpg')]
+        deduplicator = StagedDeduplicator(conn, target_dir)
+        get_files = sql.get_files_by_size__captured_at
+        with mock.patch.object(sql, 'get_files_by_size__captured_at', wraps=get_files) as get, \
+                mock.patch.object(FileInfo, 'read_hash', wraps=FileInfo.read_hash) as read_hash:
+            assert all(deduplicator.find_same_file(source) is not None for source in sources)
+        # 同じ条件の登録済みファイルの検索とhash計算はバッチ内で1回だけ行い、DBへの反映はflush()で行う
+        assert get.call_count == 1
+        registered_file = os.path.join(target_dir, '2023', '01', 'a.jpg')
+        assert [call.args[0] for call in read_hash.call_args_list].count(registered_file) == 1
+        assert conn.execute('SELECT hash FROM file_info').fetchone()[0] is None
+        deduplicator.flush()
+        assert conn.execute('SELECT hash FROM file_info').fetchone()[0] == sources[0].hash
@@ -0,0 +1,116 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import pytest
+from busker.photo.engine import PhotoImporter
+from busker.photo.file_info import FileInfo
+from busker.photo.metrics import metrics
+from busker.tests.photo.test_perceptual import _save_gradient
+
+
+def test_importer_rejects_unknown_option():
+    with sqlite3.connect(':memory:') as conn:
+        assert PhotoImporter(conn, scan_workers=2).scan_workers == 2
+        with pytest.raises(TypeError):
+            PhotoImporter(conn, scan_worker=2)
+
+
+def test_importer_skips_near_duplicates():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        source, target = os.path.join(temp_dir, 'source'), os.path.join(temp_dir, 'target')
+        os.makedirs(source)
+        _save_gradient(os.path.join(source, 'a.jpg'), (640, 480))
+        importer = PhotoImporter(conn, near_duplicate_distance=6, near_duplicate_action='skip')
+        importer.collect(source, target)
+        assert importer.copied == 1
+
+        _save_gradient(os.path.join(source, 'a_small.jpg'), (160, 120), quality=40)
+        importer.collect(source, target)
+        assert (importer.copied, importer.duplicated, importer.near_duplicated) == (0, 1, 1)
+
+
+def test_importer_backfills_perceptual_hashes():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        source, target = os.path.join(temp_dir, 'source'), os.path.join(temp_dir, 'target')
+        os.makedirs(source)
+        _save_gradient(os.path.join(source, 'a.jpg'), (640, 480))
+        PhotoImporter(conn).collect(source, target)
+        assert conn.execute('SELECT phash FROM file_info').fetchone()[0] is None
+
+        # 判定を有効にする前に登録した画像も、保存先のファイルから知覚hashを計算して判定する
+        _save_gradient(os.path.join(source, 'a_small.jpg'), (160, 120), quality=40)
+        importer = PhotoImporter(conn, near_duplicate_distance=6, near_duplicate_action='skip')
+        importer.collect(source, target)
+        assert (importer.copied, importer.near_duplicated) == (0, 1)
+        assert conn.execute('SELECT COUNT(*) FROM file_info WHERE phash IS NULL').fetchone()[0] == 0
+
+
+def test_importer_fused_copy():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        source, target = os.path.join(temp_dir, 'source'), os.path.join(temp_dir, 'target')
+        os.makedirs(os.path.join(source, 'sub'))
+        image = os.path.join(os.path.dirname(__file__), '..', 'file', 'IMG_20190417_114435.jpg')
+        shutil.copy2(image, os.path.join(source, 'a.jpg'))
+        shutil.copy2(image, os.path.join(source, 'sub', 'a.jpg'))
+        importer = PhotoImporter(conn, fused_copy=True)
+        importer.collect(source, target)
+
+        assert (importer.copied, importer.duplicated) == (1, 1)
+        assert importer.copy_methods == {'fused': 1}
+        with open(image, 'rb') as f1, open(os.path.join(target, '2019', '04', 'a.jpg'), 'rb') as f2:
+            assert f1.read() == f2.read()
+        assert os.listdir(target) == ['2019']
+
+
+def test_importer_full_dedup_after_staged():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        target = os.path.join(temp_dir, 'target')
+        image = os.path.join(os.path.dirname(__file__), '..', 'file', 'IMG_20190417_114435.jpg')
+        for source in ('source1', 'source2'):
+            os.makedirs(os.path.join(temp_dir, source))
+            shutil.copy2(image, os.path.join(temp_dir, source, 'a.jpg'))
+        importer = PhotoImporter(conn, dedup_mode='staged')
+        importer.collect(os.path.join(temp_dir, 'source1'), target)
+        assert importer.copied == 1
+
+        # hashなしで登録済みのファイルも、保存先のファイルから計算したhashで同一と判定する
+        importer = PhotoImporter(conn, dedup_mode='full')
+        importer.collect(os.path.join(temp_dir, 'source2'), target)
+        assert (importer.copied, importer.duplicated) == (0, 1)
+        assert conn.execute('SELECT COUNT(*) FROM file_info WHERE hash IS NULL').fetchone()[0] == 0
+
+
+def test_importer_restores_shared_settings():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        source, target = os.path.join(temp_dir, 'source'), os.path.join(temp_dir, 'target')
+        os.makedirs(source)
+        default = PhotoImporter(conn)
+        importer = PhotoImporter(conn, hash_algorithm='sha256', collect_metrics=True, near_duplicate_distance=6)
+        # 作成しただけでは他のPhotoImporterの設定を変更しない
+        assert (FileInfo.hash_engine.name, FileInfo.with_phash, metrics.enabled) == ('md5', False, False)
+        with importer.activate():
+            assert (FileInfo.hash_engine.name, FileInfo.with_phash, metrics.enabled) == ('sha256', True, True)
+        importer.collect(source, target)
+        assert (FileInfo.hash_engine.name, FileInfo.with_phash, metrics.enabled) == ('md5', False, False)
+        with default.activate():
+            assert FileInfo.hash_engine is default.hash_engine
+
+
+@pytest.mark.parametrize('options', [{}, {'pipeline_hash_workers': 2}])
+def test_inspect_skips_folders_written_by_import(options):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source, target = os.path.join(temp_dir, 'source'), os.path.join(temp_dir, 'target')
+        os.makedirs(source)
+        image = os.path.join(os.path.dirname(__file__), '..', 'file', 'IMG_20190417_114435.jpg')
+        shutil.copy2(image, os.path.join(source, 'a.jpg'))
+        with sqlite3.connect(os.path.join(temp_dir, 'photo.db')) as conn:
+            importer = PhotoImporter(conn, **options)
+            importer.collect(source, target)
+            assert importer.copied == 1
+
+            # 取込処理で作成したフォルダーは、更新直後でも次回の確認では走査しない
+            importer.inspect(target)
+            target_folder = os.path.join(target, '2019', '04')
+            assert target_folder in importer.snapshot.entries
+            assert importer.snapshot.unchanged == 1
@@ -0,0 +1,70 @@
+import pytest
+import os
+import tempfile
+from datetime import datetime
+from unittest import mock
+from busker.photo.file_info import FileInfo, FileType, read_all_files
+
+
+def _create_files(directory, count):
+    for i in range(count):
+        with open(os.path.join(directory, f'file{i}.txt'), 'w') as f:
+            f.write(f'file{i}')
+
+
+def _names(batches):
+    return [[file_info.name for file_info in file_infos] for file_infos in batches]
+
+
+def test_file_type_create():
+    assert FileType.create('IMG_0001.JPG') == FileType.IMAGE
+    assert FileType.create('MOV_0001.mov') == FileType.VIDEO
+    assert FileType.create('.DS_Store') == FileType.UNKNOWN
+
+
+def test_file_info_keeps_compact_values():
+    file_info = FileInfo(1, 'a.jpg', '/source', 10, 'd41d8cd98f00b204e9800998ecf8427e', '2023-01-02 03:04:05',
+                         datetime(2023, 1, 2, 3, 4, 5, 678), 'image', '2023-01-02 03:04:05', '2023/01')
+    assert not hasattr(file_info, '__dict__')
+    assert file_info.digest == bytes.fromhex('d41d8cd98f00b204e9800998ecf8427e')
+    assert file_info.hash == 'd41d8cd98f00b204e9800998ecf8427e'
+    assert str(file_info.captured_at) == '2023-01-02 03:04:05'
+    assert file_info.modified_at == datetime(2023, 1, 2, 3, 4, 5, 678)
+
+
+def test_file_info_create_lazy():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        _create_files(temp_dir, 1)
+        with mock.patch.object(FileInfo, 'read_hash', return_value='00ff') as read_hash:
+            file_info = FileInfo.create('file0.txt', temp_dir, lazy=True)
+            assert file_info.size == 5
+            read_hash.assert_not_called()
+            assert file_info.hash == '00ff'
+            assert file_info.captured_at == file_info.modified_at
+            assert file_info.save_to == file_info.modified_at.strftime('%Y' + os.path.sep + '%m')
+            read_hash.assert_called_once()
+
+
+def test_read_all_files_parallel_keeps_order_and_batch_shape():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        _create_files(temp_dir, 7)
+        expected = _names(read_all_files(temp_dir, 3))
+        assert [len(names) for names in expected] == [3, 3, 1]
+
+        output = _names(read_all_files(temp_dir, 3, workers=2, max_pending=2))
+        assert output == expected
+
+
+def test_read_all_files_parallel_with_process_pool():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        _create_files(temp_dir, 3)
+        batches = list(read_all_files(temp_dir, 2, workers=2, executor='process'))
+        assert _names(batches) == _names(read_all_files(temp_dir, 2))
+        assert batches[0][0].hash == list(read_all_files(temp_dir, 2))[0][0].hash
+
+
+def test_read_all_files_parallel_with_unknown_executor():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        _create_files(temp_dir, 1)
+        with pytest.raises(ValueError):
+            list(read_all_files(temp_dir, 2, workers=2, executor='fiber'))
@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from busker.photo.file_info import FileInfo, read_all_files
+from busker.photo.hash_cache import HashCache
+from busker.photo.hasher import HashEngine
+
+
+def test_hash_cache_reuses_hash_of_unchanged_file():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        with open(os.path.join(temp_dir, 'file1.txt'), 'w') as f:
+            f.write('file1')
+
+        cache = HashCache(conn)
+        first = FileInfo.create('file1.txt', temp_dir, cache)
+        cache.flush()
+        assert cache.misses == 1
+
+        # DBから読み込んだキャッシュでは、ファイルを読まずにhashを返す
+        cache = HashCache(conn)
+        cache.load(temp_dir)
+        with mock.patch.object(FileInfo, 'read_hash') as read:
+            second = FileInfo.create('file1.txt', temp_dir, cache)
+            read.assert_not_called()
+        assert cache.hits == 1
+        assert second.hash == first.hash
+        assert second.captured_at == first.captured_at
+
+
+def test_hash_cache_misses_when_file_changed():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        file = os.path.join(temp_dir, 'file1.txt')
+        with open(file, 'w') as f:
+            f.write('file1')
+
+        cache = HashCache(conn)
+        first = FileInfo.create('file1.txt', temp_dir, cache)
+
+        with open(file, 'w') as f:
+            f.write('file1 changed')
+        second = FileInfo.create('file1.txt', temp_dir, cache)
+        assert cache.hits == 0
+        assert second.hash != first.hash
+
+
+def test_hash_cache_load_only_directory_tree():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        os.mkdir(os.path.join(temp_dir, 'a'))
+        os.mkdir(os.path.join(temp_dir, 'a_b'))
+        for directory in ('a', 'a_b'):
+            with open(os.path.join(temp_dir, directory, 'file.txt'), 'w') as f:
+                f.write(directory)
+
+        cache = HashCache(conn)
+        list(read_all_files(temp_dir, 10, cache=cache))
+        cache.flush()
+
+        cache = HashCache(conn)
+        cache.load(os.path.join(temp_dir, 'a'))
+        assert list(cache.entries) == [(os.path.join(temp_dir, 'a'), 'file.txt')]
+
+
+def test_read_all_files_with_cache_in_process_pool():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        for i in range(3):
+            with open(os.path.join(temp_dir, f'file{i}.txt'), 'w') as f:
+                f.write(f'file{i}')
+
+        cache = HashCache(conn)
+        list(read_all_files(temp_dir, 2, workers=2, executor='process', cache=cache))
+        assert cache.misses == 3
+        assert len(cache.pending) == 3
+
+        list(read_all_files(temp_dir, 2, workers=2, executor='process', cache=cache))
+        assert cache.hits == 3
+
+
+def test_hash_cache_misses_when_hash_algorithm_changed():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        with open(os.path.join(temp_dir, 'file1.txt'), 'w') as f:
+            f.write('file1')
+
+        cache = HashCache(conn)
+        FileInfo.create('file1.txt', temp_dir, cache)
+        with mock.patch.object(FileInfo, 'hash_engine', HashEngine('blake2b')):
+            file_info = FileInfo.create('file1.txt', temp_dir, cache)
+        assert cache.hits == 0
+        assert file_info.hash_algorithm == 'blake2b'
+
+
+def test_hash_cache_put_and_flush_from_threads():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:', check_same_thread=False) as conn:
+        cache = HashCache(conn)
+        stat = os.stat(temp_dir)
+
+        def put(thread):
+            for i in range(2000):
+                cache.put(temp_dir, f'{thread}_{i}.jpg', stat, 'md5', 'hash', None)
+                cache.get(temp_dir, f'{thread}_{i}.jpg', stat, 'md5')
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(put, thread) for thread in range(4)]
+            # 追加中に書き込んでも、未登録分を失わない
+            while not all(future.done() for future in futures):
+                cache.flush()
+        cache.flush()
+        assert conn.execute('SELECT count(1) FROM file_cache').fetchone()[0] == 8000
+        assert cache.hits == 8000
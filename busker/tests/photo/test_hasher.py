@@ -0,0 +1,56 @@
+import pytest
+import os
+import hashlib
+import sqlite3
+import tempfile
+from busker.photo.file_info import FileInfo
+from busker.photo.hasher import HashEngine, available_algorithms
+from busker.photo.migration import migrate_hash_algorithm
+from busker.photo import sql
+
+
+def test_hash_engine_matches_hashlib():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file = os.path.join(temp_dir, 'file.bin')
+        data = os.urandom(10000)
+        with open(file, 'wb') as f:
+            f.write(data)
+
+        assert 'blake2b' in available_algorithms()
+        assert HashEngine('md5', buffer_size=4096).hash_file(file) == hashlib.md5(data).hexdigest()
+        assert HashEngine('blake2b', use_mmap=True).hash_file(file) == hashlib.blake2b(data).hexdigest()
+
+
+def test_hash_engine_with_empty_file_and_mmap():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file = os.path.join(temp_dir, 'empty.bin')
+        open(file, 'wb').close()
+        assert HashEngine('md5', use_mmap=True).hash_file(file) == hashlib.md5().hexdigest()
+
+
+def test_hash_engine_with_unknown_algorithm():
+    with pytest.raises(ValueError):
+        HashEngine('crc0')
+
+
+def test_migrate_hash_algorithm():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        sql.create_table_file_info(conn)
+        save_to = os.path.join('2023', '01')
+        os.makedirs(os.path.join(temp_dir, save_to))
+        for name in ('a.jpg', 'b.jpg'):
+            with open(os.path.join(temp_dir, save_to, name), 'w') as f:
+                f.write(name)
+            file_info = FileInfo.create(name, os.path.join(temp_dir, save_to))
+            file_info.save_to = save_to
+            sql.register_file_infos(conn, [file_info])
+        os.remove(os.path.join(temp_dir, save_to, 'b.jpg'))
+
+        # FileInfoのhashの計算方法（md5）にかかわらず、指定したアルゴリズムで再計算する
+        assert sql.get_count_by_other_hash_algorithm(conn, 'blake2b') == 2
+        assert migrate_hash_algorithm(conn, temp_dir, HashEngine('blake2b'), batch_size=1) == (1, 1)
+        assert sql.get_count_by_other_hash_algorithm(conn, 'blake2b') == 1
+
+        [migrated] = [row for row in sql.get_index_rows(conn) if row[6] == 'a.jpg']
+        assert migrated[4] == 'blake2b'
+        assert migrated[2] == hashlib.blake2b(b'a.jpg').hexdigest()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import mock
+from busker.photo.engine import PhotoImporter
+from busker.photo.file_info import FileInfo
+from busker.photo.journal import ImportJournal, partial_name
+from busker.photo import sql
+
+IMAGE = os.path.join(os.path.dirname(__file__), '..', 'file', 'IMG_20190417_114435.jpg')
+SAVE_TO = os.path.join('2019', '04')
+
+
+def _create_image(directory, name, suffix):
+    os.makedirs(directory, exist_ok=True)
+    shutil.copy(IMAGE, os.path.join(directory, name))
+    # 撮影日時が同じで内容が異なるファイル
+    with open(os.path.join(directory, name), 'ab') as f:
+        f.write(suffix)
+
+
+def test_resume_skips_processed_files_and_removes_partial_copies():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        source_dir = os.path.join(temp_dir, 'source')
+        target_dir = os.path.join(temp_dir, 'target')
+        _create_image(source_dir, 'a.jpg', b'a')
+        _create_image(source_dir, 'b.jpg', b'b')
+
+        # 1バッチ目をcommitした後に中断した取込処理
+        importer = PhotoImporter(conn)
+        journal = ImportJournal(conn, source_dir, target_dir)
+        journal.start()
+        importer.copy_photos(source_dir, target_dir, journal)
+        partial_file = os.path.join(target_dir, SAVE_TO, partial_name('c.jpg', journal.run_id))
+        open(partial_file, 'w').close()
+        _create_image(source_dir, 'c.jpg', b'c')
+
+        importer = PhotoImporter(conn, resume=True)
+        with mock.patch.object(FileInfo, 'create', wraps=FileInfo.create) as create:
+            importer.collect(source_dir, target_dir)
+        assert [call.args[0] for call in create.call_args_list if call.args[1] == source_dir] == ['c.jpg']
+        assert (importer.skipped, importer.copied) == (2, 1)
+        assert not os.path.exists(partial_file)
+        assert sorted(os.listdir(os.path.join(target_dir, SAVE_TO))) == ['a.jpg', 'b.jpg', 'c.jpg']
+        assert sql.get_count(conn) == 3
+        # 完了した取込処理は再開の対象にしない
+        assert sql.get_unfinished_import_runs(conn, target_dir) == []
+
+
+def test_new_run_discards_interrupted_run():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        source_dir = os.path.join(temp_dir, 'source')
+        target_dir = os.path.join(temp_dir, 'target')
+        _create_image(source_dir, 'a.jpg', b'a')
+
+        journal = ImportJournal(conn, source_dir, target_dir)
+        journal.start()
+        journal.add(source_dir, 'a.jpg', 'copied')
+        journal.flush(source_dir)
+        conn.commit()
+
+        journal = ImportJournal(conn, source_dir, target_dir)
+        journal.start(resume=False)
+        assert not journal.is_done(source_dir, 'a.jpg')
+        assert [row[0] for row in sql.get_unfinished_import_runs(conn, target_dir)] == [journal.run_id]
+
+
+def test_start_keeps_partial_files_of_other_sources():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        target_dir = os.path.join(temp_dir, 'target')
+        os.makedirs(os.path.join(target_dir, SAVE_TO))
+        partial_files = {}
+        for source in ('source1', 'source2'):
+            journal = ImportJournal(conn, os.path.join(temp_dir, source), target_dir)
+            journal.start()
+            journal.add_folder(SAVE_TO)
+            partial_files[source] = os.path.join(target_dir, SAVE_TO, partial_name('a.jpg', journal.run_id))
+            open(partial_files[source], 'w').close()
+
+        # 中断したsource1の取込処理のファイルだけを削除し、実行中の場合があるsource2の取込処理のファイルは残す
+        ImportJournal(conn, os.path.join(temp_dir, 'source1'), target_dir).start()
+        assert not os.path.exists(partial_files['source1'])
+        assert os.path.exists(partial_files['source2'])
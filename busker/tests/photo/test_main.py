@@ -0,0 +1,79 @@
+import os
+import json
+import shutil
+import sqlite3
+import tempfile
+import pytest
+from busker.photo.__main__ import main, EXIT_OK, EXIT_ERROR, EXIT_USAGE
+from busker.photo import sql
+
+IMAGE = os.path.join(os.path.dirname(__file__), '..', 'file', 'IMG_20190417_114435.jpg')
+
+
+def _read_progress(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_import_prints_progress_and_summary(capsys):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'source')
+        target_dir = os.path.join(temp_dir, 'target')
+        database = os.path.join(temp_dir, 'photo.db')
+        os.makedirs(source_dir)
+        shutil.copy(IMAGE, os.path.join(source_dir, 'a.jpg'))
+        shutil.copy(IMAGE, os.path.join(source_dir, 'b.jpg'))
+
+        assert main(['--db', database, 'import', source_dir, target_dir]) == EXIT_OK
+        progress = _read_progress(capsys)
+        assert progress[0]['event'] == 'copy_started'
+        assert {'event': 'directory', 'path': source_dir} in progress
+        summary = progress[-1]
+        assert summary['event'] == 'summary'
+        assert (summary['scanned'], summary['copied'], summary['duplicated']) == (2, 1, 1)
+
+        # 2回目は保存先の登録を確認してから、全て登録済みとしてスキップする
+        assert main(['--db', database, '--workers', '2', 'import', '--pipeline', source_dir, target_dir]) == EXIT_OK
+        progress = _read_progress(capsys)
+        events = [p['event'] for p in progress]
+        assert events.index('inspect_started') < events.index('inspect_finished') < events.index('copy_started')
+        assert (progress[-1]['copied'], progress[-1]['duplicated']) == (0, 2)
+
+        with sqlite3.connect(database) as conn:
+            assert sql.get_count(conn) == 1
+
+
+def test_exit_codes(capsys):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        database = os.path.join(temp_dir, 'photo.db')
+        assert main(['--db', database, 'inspect', os.path.join(temp_dir, 'missing')]) == EXIT_USAGE
+        assert _read_progress(capsys)[-1]['event'] == 'error'
+
+        # 保存先がファイルのため、コピーできない
+        source_dir = os.path.join(temp_dir, 'source')
+        os.makedirs(source_dir)
+        shutil.copy(IMAGE, os.path.join(source_dir, 'a.jpg'))
+        target = os.path.join(temp_dir, 'target')
+        open(target, 'w').close()
+        assert main(['--db', database, 'import', source_dir, target]) == EXIT_ERROR
+        assert _read_progress(capsys)[-1]['event'] == 'error'
+
+
+def test_skip_near_duplicates_requires_near_duplicates(capsys):
+    with tempfile.TemporaryDirectory() as temp_dir, pytest.raises(SystemExit) as e:
+        main(['--db', os.path.join(temp_dir, 'photo.db'), 'import', '--skip-near-duplicates', temp_dir, temp_dir])
+    assert e.value.code == 2
+    assert '--skip-near-duplicates requires --near-duplicates' in capsys.readouterr().err
+
+
+def test_migrate_rehashes_with_hash_option(capsys):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir, target_dir = os.path.join(temp_dir, 'source'), os.path.join(temp_dir, 'target')
+        database = os.path.join(temp_dir, 'photo.db')
+        os.makedirs(source_dir)
+        shutil.copy(IMAGE, os.path.join(source_dir, 'a.jpg'))
+        assert main(['--db', database, 'import', source_dir, target_dir]) == EXIT_OK
+
+        assert main(['--db', database, '--hash', 'blake2b', 'migrate', target_dir]) == EXIT_OK
+        assert {'event': 'migrate_finished', 'migrated': 1, 'missing': 0} in _read_progress(capsys)
+        with sqlite3.connect(database) as conn:
+            assert sql.get_count_by_other_hash_algorithm(conn, 'blake2b') == 0
@@ -0,0 +1,120 @@
+import pytest
+import os
+import struct
+import tempfile
+from datetime import datetime, timezone
+from unittest import mock
+from busker.photo import metadata
+
+
+TEST_FILE_DIR = os.path.join(os.path.dirname(__file__), '..', 'file')
+
+
+def _tiff(order: str, value: bytes) -> bytes:
+    """IFD0 -> Exif IFD -> DateTimeOriginalだけのTIFFデータを作成する"""
+    prefix = b'II*\x00' if order == '<' else b'MM\x00*'
+    ifd0 = struct.pack(order + 'H', 1) + struct.pack(order + 'HHII', 0x8769, 4, 1, 26) + struct.pack(order + 'I', 0)
+    exif_ifd = struct.pack(order + 'H', 1) + struct.pack(order + 'HHII', 0x9003, 2, len(value), 44) \
+        + struct.pack(order + 'I', 0)
+    return prefix + struct.pack(order + 'I', 8) + ifd0 + exif_ifd + value
+
+
+def _jpeg(tiff: bytes) -> bytes:
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + b'\x00' * 9
+    app1 = b'\xff\xe1' + struct.pack('>H', len(tiff) + 8) + b'Exif\x00\x00' + tiff
+    return b'\xff\xd8' + app0 + app1 + b'\xff\xda'
+
+
+def test_read_image_captured_at_from_jpeg_without_pillow():
+    file = os.path.join(TEST_FILE_DIR, 'IMG_20190417_114435.jpg')
+    with mock.patch.object(metadata, '_read_with_pillow') as pillow:
+        assert metadata.read_image_captured_at(file) == datetime(2019, 4, 17, 11, 44, 37)
+        pillow.assert_not_called()
+
+
+def test_read_image_captured_at_falls_back_to_pillow():
+    # PNGはPillowで読み込む、撮影日時はない
+    file = os.path.join(TEST_FILE_DIR, 'screenshot20231009.png')
+    assert metadata.read_image_captured_at(file) is None
+    assert metadata.read_image_captured_at('not_exists.jpg') is None
+
+
+@pytest.mark.parametrize('order', ['<', '>'])
+def test_parse_image_captured_at(order):
+    tiff = _tiff(order, b'2021:12:31 23:59:58\x00')
+    assert metadata.parse_image_captured_at(tiff) == datetime(2021, 12, 31, 23, 59, 58)
+    assert metadata.parse_image_captured_at(_jpeg(tiff)) == datetime(2021, 12, 31, 23, 59, 58)
+
+
+def test_parse_image_captured_at_without_datetime():
+    assert metadata.parse_image_captured_at(_jpeg(_tiff('<', b'0000:00:00 00:00:00\x00'))) is None
+    # EXIFのないJPEG
+    assert metadata.parse_image_captured_at(b'\xff\xd8\xff\xda') is None
+    assert metadata.parse_image_captured_at(b'GIF89a') is None
+
+
+def test_parse_image_captured_at_unsupported():
+    with pytest.raises(metadata.UnsupportedFormat):
+        metadata.parse_image_captured_at(b'\x89PNG\r\n\x1a\n')
+    # 値がヘッダーの範囲外
+    with pytest.raises(metadata.UnsupportedFormat):
+        metadata.parse_image_captured_at(_tiff('<', b'2021:12:31 23:59:58\x00')[:50])
+
+
+def _atom(atom_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), atom_type) + payload
+
+
+def _ebml(element_id: bytes, payload: bytes) -> bytes:
+    # サイズは8バイトのvint
+    return element_id + bytes([0x01]) + len(payload).to_bytes(7, 'big') + payload
+
+
+def _write(file_name: str, data: bytes) -> None:
+    with open(file_name, 'wb') as f:
+        f.write(data)
+
+
+def _local(utc: datetime) -> datetime:
+    return utc.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+
+
+def test_read_video_captured_at():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # moovが大きなmdat（スパースファイル）の後にあるMP4、mdatは読まずに読み飛ばす
+        mp4 = os.path.join(temp_dir, 'a.mp4')
+        seconds = int((datetime(2020, 5, 6, 7, 8, 9) - datetime(1904, 1, 1)).total_seconds())
+        mvhd = _atom(b'mvhd', b'\x00\x00\x00\x00' + struct.pack('>II', seconds, seconds) + b'\x00' * 88)
+        mdat_size = 3 * 1024 ** 3
+        with open(mp4, 'wb') as f:
+            f.write(_atom(b'ftyp', b'isom\x00\x00\x02\x00'))
+            f.write(struct.pack('>I4sQ', 1, b'mdat', mdat_size))
+            f.seek(mdat_size - 16, os.SEEK_CUR)
+            f.write(_atom(b'moov', mvhd))
+        assert metadata.read_video_captured_at(mp4) == _local(datetime(2020, 5, 6, 7, 8, 9))
+
+        mkv = os.path.join(temp_dir, 'a.mkv')
+        nanoseconds = int((datetime(2021, 1, 2, 3, 4, 5) - datetime(2001, 1, 1)).total_seconds()) * 10 ** 9
+        info = _ebml(b'\x2a\xd7\xb1', struct.pack('>I', 1000000)) + _ebml(b'\x44\x61', struct.pack('>q', nanoseconds))
+        _write(mkv, _ebml(b'\x1a\x45\xdf\xa3', b'\x42\x82\x88matroska')
+               + b'\x18\x53\x80\x67\x01\xff\xff\xff\xff\xff\xff\xff'
+               + _ebml(b'\x11\x4d\x9b\x74', b'\x00' * 10) + _ebml(b'\x15\x49\xa9\x66', info))
+        assert metadata.read_video_captured_at(mkv) == _local(datetime(2021, 1, 2, 3, 4, 5))
+
+        avi = os.path.join(temp_dir, 'a.avi')
+        idit = b'IDIT' + struct.pack('<I', 26) + b'THU OCT 22 10:12:45 2009\n\x00'
+        avih = b'avih' + struct.pack('<I', 56) + b'\x00' * 56
+        hdrl = b'LIST' + struct.pack('<I', 4 + len(avih) + len(idit)) + b'hdrl' + avih + idit
+        _write(avi, b'RIFF' + struct.pack('<I', 4 + len(hdrl)) + b'AVI ' + hdrl)
+        assert metadata.read_video_captured_at(avi) == datetime(2009, 10, 22, 10, 12, 45)
+
+
+def test_read_video_captured_at_without_datetime():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        mp4 = os.path.join(temp_dir, 'a.mov')
+        _write(mp4, _atom(b'ftyp', b'qt  ') + _atom(b'moov', _atom(b'mvhd', b'\x00' * 100)))
+        assert metadata.read_video_captured_at(mp4) is None
+        broken = os.path.join(temp_dir, 'b.mp4')
+        _write(broken, _atom(b'ftyp', b'isom') + b'\x00\x00\x10\x00moov')
+        assert metadata.read_video_captured_at(broken) is None
+        assert metadata.read_video_captured_at(os.path.join(temp_dir, 'not_exists.mp4')) is None
@@ -0,0 +1,55 @@
+import os
+import sqlite3
+import tempfile
+from busker.photo.engine import PhotoImporter
+from busker.photo.metrics import Metrics, metrics
+
+
+def test_metrics_histogram_and_prometheus_output():
+    collector = Metrics()
+    collector.enabled = True
+    collector.inc('files', 3)
+    for seconds in (0.0002, 0.0003, 0.02):
+        collector.observe('hash', seconds)
+    with collector.timer('copy'):
+        pass
+
+    summary = collector.to_dict()
+    assert summary['counters'] == {'files': 3}
+    assert summary['stages']['hash']['count'] == 3
+    assert summary['stages']['hash']['p50'] == 0.0005
+
+    text = collector.to_prometheus()
+    assert 'busker_photo_files_total 3' in text
+    assert 'busker_photo_stage_seconds_bucket{stage="hash",le="0.0005"} 2' in text
+    assert 'busker_photo_stage_seconds_bucket{stage="hash",le="+Inf"} 3' in text
+    assert 'busker_photo_stage_seconds_count{stage="copy"} 1' in text
+
+    throughput = collector.throughput(5, total=10)
+    assert throughput['files'] == 5 and throughput['total'] == 10
+
+
+def test_importer_collects_metrics():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        source = os.path.join(temp_dir, 'source')
+        os.makedirs(source)
+        for name, data in (('a.jpg', b'a'), ('b.jpg', b'b'), ('c.jpg', b'a')):
+            with open(os.path.join(source, name), 'wb') as f:
+                f.write(data)
+            # 撮影日時のない画像は更新日時を撮影日時とするため、同じ日時にする
+            os.utime(os.path.join(source, name), (1500000000, 1500000000))
+        importer = PhotoImporter(conn, collect_metrics=True)
+        try:
+            importer.collect(source, os.path.join(temp_dir, 'target'))
+            summary = metrics.to_dict()
+        finally:
+            metrics.enabled = False
+
+        assert importer.total_files == 3
+        assert summary['counters']['copied_files'] == 2
+        assert summary['counters']['duplicates'] == 1
+        assert {'hash', 'exif', 'copy', 'sqlite'} <= set(summary['stages'])
+
+        prom_file = os.path.join(temp_dir, 'busker.prom')
+        metrics.dump_prometheus(prom_file)
+        assert 'busker_photo_copied_bytes_total 2' in open(prom_file).read()
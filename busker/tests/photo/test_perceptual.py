@@ -0,0 +1,44 @@
+import os
+import random
+import tempfile
+from PIL import Image
+from busker.photo.perceptual import BKTree, hamming_distance, read_dhash
+
+
+def _save_gradient(full_name, size, reverse=False, quality=90):
+    width, height = size
+    img = Image.new('L', size)
+    img.putdata([((width - x if reverse else x) * 255 // width + y * 64 // height) % 256
+                 for y in range(height) for x in range(width)])
+    img.convert('RGB').save(full_name, quality=quality)
+
+
+def test_read_dhash_ignores_resize_and_recompression():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        original, resized, other = (os.path.join(temp_dir, name) for name in ('a.jpg', 'b.jpg', 'c.jpg'))
+        _save_gradient(original, (640, 480))
+        _save_gradient(resized, (160, 120), quality=40)
+        _save_gradient(other, (640, 480), reverse=True)
+
+        assert hamming_distance(read_dhash(original), read_dhash(resized)) <= 4
+        assert hamming_distance(read_dhash(original), read_dhash(other)) > 16
+        assert -2 ** 63 <= read_dhash(other) < 2 ** 63
+
+        broken = os.path.join(temp_dir, 'broken.jpg')
+        with open(broken, 'wb') as f:
+            f.write(b'not an image')
+        assert read_dhash(broken) is None
+
+
+def test_bk_tree_search_matches_linear_scan():
+    rand = random.Random(0)
+    keys = [rand.getrandbits(64) - 2 ** 63 for _ in range(500)]
+    tree: BKTree[int] = BKTree()
+    for i, key in enumerate(keys):
+        tree.add(key, i)
+
+    query = keys[10] ^ 0b1011
+    expected = sorted((hamming_distance(query, key), i) for i, key in enumerate(keys)
+                      if hamming_distance(query, key) <= 12)
+    assert sorted(tree.search(query, 12)) == expected
+    assert tree.search(query, 3)[0] == (3, 10)
@@ -0,0 +1,88 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from functools import partial
+from unittest import mock
+import pytest
+from busker.photo.journal import PARTIAL_SUFFIX
+from busker.photo.pipeline import ImportPipeline
+from busker.photo import sql
+
+IMAGE = os.path.join(os.path.dirname(__file__), '..', 'file', 'IMG_20190417_114435.jpg')
+
+
+def _create_sources(source_dir):
+    os.makedirs(os.path.join(source_dir, 'a'))
+    os.makedirs(os.path.join(source_dir, 'b'))
+    shutil.copy(IMAGE, os.path.join(source_dir, 'a', 'IMG.jpg'))
+    shutil.copy(IMAGE, os.path.join(source_dir, 'b', 'dup.jpg'))
+    # 同名の別ファイル
+    shutil.copy(IMAGE, os.path.join(source_dir, 'b', 'IMG.jpg'))
+    with open(os.path.join(source_dir, 'b', 'IMG.jpg'), 'ab') as f:
+        f.write(b'x')
+
+
+def _list_files(directory):
+    return sorted(os.path.relpath(os.path.join(root, file), directory)
+                  for root, dirs, files in os.walk(directory) for file in files)
+
+
+def test_pipeline_copies_unique_files():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'source')
+        target_dir = os.path.join(temp_dir, 'target')
+        database = os.path.join(temp_dir, 'photo.db')
+        _create_sources(source_dir)
+
+        pipeline = ImportPipeline(partial(sqlite3.connect, database), hash_workers=2, copy_workers=2)
+        pipeline.run(source_dir, target_dir)
+        assert (pipeline.scanned, pipeline.duplicated, pipeline.copied) == (3, 1, 2)
+        # 同一ファイルのどちらがコピーされるかは走査順による
+        files = _list_files(target_dir)
+        assert len(files) == 2
+        assert os.path.join('2019', '04', 'IMG.jpg') in files
+
+        # 2回目は全て登録済み
+        pipeline = ImportPipeline(partial(sqlite3.connect, database))
+        pipeline.run(source_dir, target_dir)
+        assert (pipeline.duplicated, pipeline.copied) == (3, 0)
+
+        with sqlite3.connect(database) as conn:
+            assert sql.get_count(conn) == 2
+
+
+def test_pipeline_raises_stage_error():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'source')
+        database = os.path.join(temp_dir, 'photo.db')
+        _create_sources(source_dir)
+        # 保存先がファイルのため、フォルダーを作成できない
+        target_dir = os.path.join(temp_dir, 'target')
+        open(target_dir, 'w').close()
+
+        pipeline = ImportPipeline(partial(sqlite3.connect, database))
+        with pytest.raises(OSError):
+            pipeline.run(source_dir, target_dir)
+        with sqlite3.connect(database) as conn:
+            assert sql.get_count(conn) == 0
+
+
+def test_pipeline_leaves_no_truncated_file():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'source')
+        target_dir = os.path.join(temp_dir, 'target')
+        database = os.path.join(temp_dir, 'photo.db')
+        _create_sources(source_dir)
+
+        def interrupted_copy(src, dst, hardlink):
+            with open(dst, 'wb') as f:
+                f.write(b'x')
+            raise OSError('No space left on device')
+
+        # コピー途中で中断した場合、保存先の名前のファイルは作成しない
+        pipeline = ImportPipeline(partial(sqlite3.connect, database))
+        with mock.patch('busker.photo.pipeline.copy_file', interrupted_copy), pytest.raises(OSError):
+            pipeline.run(source_dir, target_dir)
+        files = _list_files(target_dir)
+        assert files and all(file.endswith(PARTIAL_SUFFIX) for file in files)
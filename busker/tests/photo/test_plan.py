@@ -0,0 +1,48 @@
+import os
+import sqlite3
+import tempfile
+from busker.photo.engine import PhotoImporter
+from busker.photo import plan, sql
+
+
+def test_plan_and_execute():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        source, target = os.path.join(temp_dir, 'source'), os.path.join(temp_dir, 'target')
+        plan_file = os.path.join(temp_dir, 'plan.jsonl')
+        os.makedirs(os.path.join(source, 'sub'))
+        for name, data in (('a.txt', b'a'), ('b.txt', b'b'), (os.path.join('sub', 'a.txt'), b'a')):
+            with open(os.path.join(source, name), 'wb') as f:
+                f.write(data)
+        for name in ('a.txt', os.path.join('sub', 'a.txt')):
+            os.utime(os.path.join(source, name), (1600000000, 1600000000))
+
+        importer = PhotoImporter(conn)
+        importer.plan_photos(source, target, plan_file)
+        header, entries = plan.read_plan(plan_file)
+        assert header['target'] == target
+        assert sorted(entry.action for entry in entries) == [plan.COPY, plan.COPY, plan.DUPLICATE]
+        assert not os.path.exists(target)
+        assert sql.get_count(conn) == 0
+
+        importer.execute_plan(plan_file)
+        assert importer.copied == 2
+        assert sql.get_count(conn) == 2
+        # 再実行した場合はコピー済みのファイルをスキップする
+        importer.execute_plan(plan_file)
+        assert (importer.copied, importer.duplicated) == (0, 2)
+
+
+def test_execute_skips_files_changed_after_planning():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        source, target = os.path.join(temp_dir, 'source'), os.path.join(temp_dir, 'target')
+        plan_file = os.path.join(temp_dir, 'plan.jsonl')
+        os.makedirs(source)
+        with open(os.path.join(source, 'a.txt'), 'wb') as f:
+            f.write(b'a')
+
+        importer = PhotoImporter(conn)
+        importer.plan_photos(source, target, plan_file)
+        with open(os.path.join(source, 'a.txt'), 'wb') as f:
+            f.write(b'changed')
+        importer.execute_plan(plan_file)
+        assert (importer.copied, importer.skipped) == (0, 1)
@@ -0,0 +1,79 @@
+import os
+import time
+import sqlite3
+import tempfile
+from unittest import mock
+from busker.photo.engine import PhotoImporter
+from busker.photo.scrub import Scrubber, TokenBucket
+
+
+def test_scrub_reports_missing_changed_and_orphaned_files():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        source, target = os.path.join(temp_dir, 'source'), os.path.join(temp_dir, 'target')
+        os.makedirs(source)
+        for name in ('a.txt', 'b.txt', 'c.txt'):
+            with open(os.path.join(source, name), 'wb') as f:
+                f.write(name.encode())
+        importer = PhotoImporter(conn, scrub_bytes_per_sec=1024 * 1024, scrub_iops=1000)
+        importer.collect(source, target)
+        [folder] = {root for root, dirs, files in os.walk(target) if files}
+        os.remove(os.path.join(folder, 'a.txt'))
+        with open(os.path.join(folder, 'b.txt'), 'wb') as f:
+            f.write(b'B.txt')
+        with open(os.path.join(folder, 'd.txt'), 'wb') as f:
+            f.write(b'd')
+
+        summary = importer.scrub(target)
+        assert summary == {'ok': 1, 'missing': 1, 'changed': 1, 'size_only': 0, 'unreadable': 0,
+                           'verified': 3, 'orphaned': 1}
+        # 確認日時の古いファイルから確認するため、2回で全てのファイルを確認し直す
+        verified_at = conn.execute('SELECT max(verified_at) FROM file_scrub').fetchone()[0]
+        assert importer.scrub(target, limit=2, orphans=False)['verified'] == 2
+        assert importer.scrub(target, limit=2, orphans=False)['verified'] == 2
+        assert conn.execute('SELECT min(verified_at) FROM file_scrub').fetchone()[0] > verified_at
+
+
+def test_scrub_records_unreadable_files():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        source, target = os.path.join(temp_dir, 'source'), os.path.join(temp_dir, 'target')
+        os.makedirs(source)
+        for name in ('a.txt', 'b.txt'):
+            with open(os.path.join(source, name), 'wb') as f:
+                f.write(name.encode())
+        importer = PhotoImporter(conn)
+        importer.collect(source, target)
+
+        read_hash = Scrubber.read_hash
+
+        def unreadable_a(self, engine, full_name):
+            if full_name.endswith('a.txt'):
+                raise PermissionError(13, 'Permission denied', full_name)
+            return read_hash(self, engine, full_name)
+
+        # 読み込めないファイルがあっても、他のファイルの確認を続ける
+        with mock.patch.object(Scrubber, 'read_hash', unreadable_a):
+            summary = importer.scrub(target, orphans=False)
+        assert (summary['ok'], summary['unreadable']) == (1, 1)
+        assert sorted(conn.execute('SELECT status FROM file_scrub').fetchall()) == [('ok',), ('unreadable',)]
+
+
+def test_find_orphans_throttles_each_stat():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        os.makedirs(os.path.join(temp_dir, 'sub'))
+        for name in ('a.txt', os.path.join('sub', 'b.txt'), os.path.join('sub', 'c.txt')):
+            open(os.path.join(temp_dir, name), 'w').close()
+        PhotoImporter(conn)
+        scrubber = Scrubber(conn, temp_dir, iops=1000)
+        with mock.patch.object(scrubber.iops_bucket, 'consume') as consume:
+            assert len(scrubber.find_orphans()) == 3
+        # フォルダーごとにstatと一覧の取得の2回、ファイルごとにstatの1回
+        assert sum(call.args[0] for call in consume.call_args_list) == 2 * 2 + 3
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(1000)
+    started = time.monotonic()
+    for _ in range(3):
+        bucket.consume(500)
+    # 最初の1000は補充済み、残りの500は0.5秒待つ
+    assert 0.4 <= time.monotonic() - started < 2.0
@@ -0,0 +1,43 @@
+import os
+import sqlite3
+import tempfile
+from unittest import mock
+from busker.photo.snapshot import DirectorySnapshot
+
+
+def _write(directory, name):
+    os.makedirs(directory, exist_ok=True)
+    open(os.path.join(directory, name), 'w').close()
+
+
+def _walk(conn, directory):
+    snapshot = DirectorySnapshot(conn)
+    snapshot.load(directory)
+    walked = {os.path.relpath(path, directory): sorted(name for name, stat in files)
+              for path, files in snapshot.walk(directory)}
+    snapshot.flush(directory)
+    return walked
+
+
+def test_walk_returns_changed_directories_only():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn, \
+            mock.patch.object(DirectorySnapshot, 'racy_window_ns', 0):
+        _write(os.path.join(temp_dir, '2023', '01'), 'a.jpg')
+        _write(os.path.join(temp_dir, '2023', '02'), 'b.jpg')
+        assert _walk(conn, temp_dir) == {'.': [],
+                                         '2023': [],
+                                         os.path.join('2023', '01'): ['a.jpg'],
+                                         os.path.join('2023', '02'): ['b.jpg']}
+        assert _walk(conn, temp_dir) == {}
+
+        # 手作業で追加したファイルのフォルダーだけを返す
+        _write(os.path.join(temp_dir, '2023', '02'), 'c.jpg')
+        assert _walk(conn, temp_dir) == {os.path.join('2023', '02'): ['b.jpg', 'c.jpg']}
+
+
+def test_recently_modified_directory_is_checked_again():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        _write(temp_dir, 'a.jpg')
+        # 更新直後のフォルダーは、同じ時刻内に変更される可能性があるため状態を保存しない
+        assert _walk(conn, temp_dir) == {'.': ['a.jpg']}
+        assert _walk(conn, temp_dir) == {'.': ['a.jpg']}
@@ -0,0 +1,71 @@
+import os
+import json
+import sqlite3
+import tempfile
+from datetime import date, datetime
+from unittest import mock
+from busker.photo.file_info import FileInfo
+from busker.photo import sql
+
+
+def _file_info(name, save_to, size, hash):
+    captured_at = datetime(2023, 1, 2, 3, 4, 5)
+    return FileInfo(None, name, '/source', size, hash, captured_at, captured_at, 'image', captured_at, save_to,
+                    hash_algorithm='md5')
+
+
+def test_register_file_infos_and_get_index_rows():
+    with sqlite3.connect(':memory:') as conn:
+        sql.create_table_file_info(conn)
+        save_to = os.path.join('2023', '01')
+        sql.register_file_infos(conn, [_file_info('a.jpg', save_to, 1, 'aaa'), _file_info('b.jpg', save_to, 2, None)])
+        assert sql.get_count(conn) == 2
+        assert [row[1:3] + row[4:] for row in sql.get_index_rows(conn)] == [(1, 'aaa', 'md5', save_to, 'a.jpg'),
+                                                                            (2, None, 'md5', save_to, 'b.jpg')]
+
+
+def test_parameterize_query():
+    query = "UPDATE table SET column1 = ?, column2 = ? WHERE id = ?"
+    assert sql.parameterize_query(query, [42, None, date(2023, 1, 15)]) == \
+        "UPDATE table SET column1 = 42, column2 = NULL WHERE id = '2023/01/15'"
+    assert sql.parameterize_query("SELECT ? FROM t WHERE c = ?", ['a?b']) == "SELECT 'a?b' FROM t WHERE c = ?"
+    assert sql.parameterize_query("SELECT 1", None) == "SELECT 1"
+
+
+def test_exec_query_does_not_format_without_debug():
+    with sqlite3.connect(':memory:') as conn, mock.patch.object(sql, 'parameterize_query') as parameterize:
+        sql.exec_query(conn, 'SELECT ?', (1,))
+        parameterize.assert_not_called()
+
+
+def test_query_stats():
+    with sqlite3.connect(':memory:') as conn, mock.patch.object(sql, 'query_stats', sql.QueryStats()):
+        sql.create_table_file_info(conn)
+        sql.query_stats.enabled = True
+        sql.register_file_infos(conn, [_file_info('a.jpg', '2023/01', 1, 'a'), _file_info('b.jpg', '2023/01', 2, 'b')])
+        for _ in range(3):
+            sql.get_count(conn)
+        sql.get_files_by_size__captured_at(conn, 1, datetime(2023, 1, 2, 3, 4, 5))
+
+        summary = sql.query_stats.to_dict()
+        count = summary['SELECT count(1) FROM file_info']
+        assert count['calls'] == 3
+        assert count['rows'] == 3
+        assert count['p50'] <= count['max']
+        assert summary['SELECT * FROM file_info WHERE size = ? AND captured_at = ?']['rows'] == 1
+        assert [stats['rows'] for query, stats in summary.items() if query.startswith('insert')] == [2]
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            sql.query_stats.dump(os.path.join(temp_dir, 'stats.json'))
+            with open(os.path.join(temp_dir, 'stats.json'), encoding='utf-8') as f:
+                assert json.load(f) == summary
+
+
+def test_statement_stats_keep_fixed_buckets():
+    stats = sql.StatementStats()
+    for i in range(10000):
+        stats.observe(0.0002 if i % 100 else 60.0)
+    # 実行回数によらずバケットごとの件数だけを保持し、分位数はバケットの上限値と最大値で近似する
+    assert len(stats.latency.counts) == len(stats.latency.buckets) + 1
+    assert (stats.percentile(50), stats.percentile(99), stats.percentile(100)) == (0.0005, 0.0005, 60.0)
+    assert stats.to_dict()['max'] == 60.0
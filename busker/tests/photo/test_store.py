@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import tempfile
+from busker.photo.engine import PhotoImporter
+from busker.photo.hasher import HashEngine
+from busker.photo.migration import migrate_hash_algorithm
+from busker.photo.store import OBJECTS_FOLDER, ObjectStore
+
+
+def _write(file, data, mtime):
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    with open(file, 'wb') as f:
+        f.write(data)
+    os.utime(file, (mtime, mtime))
+
+
+def test_content_store_shares_contents_and_builds_views():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        source, target = os.path.join(temp_dir, 'source'), os.path.join(temp_dir, 'target')
+        os.makedirs(source)
+        # 内容が同じで更新日時（撮影日時）が異なるファイルは、別に登録して内容を共有する
+        for name, mtime in (('a.txt', 1500000000), ('b.txt', 1600000000), ('c.txt', 1600000000)):
+            with open(os.path.join(source, name), 'wb') as f:
+                f.write(b'c' if name == 'c.txt' else b'a')
+            os.utime(os.path.join(source, name), (mtime, mtime))
+        importer = PhotoImporter(conn, content_store=True)
+        importer.collect(source, target)
+        assert importer.copied == 3
+        assert importer.copy_methods['shared'] == 1
+
+        files = [os.path.join(root, name) for root, dirs, names in os.walk(target) for name in names]
+        objects = [file for file in files if OBJECTS_FOLDER in file]
+        assert len(objects) == 2
+        assert sorted(os.stat(file).st_nlink for file in objects) == [2, 3]
+
+        view = os.path.join(temp_dir, 'view')
+        importer.build_view(target, view, '%Y')
+        assert sorted(os.listdir(view)) == ['2017', '2020']
+        assert sorted(os.listdir(os.path.join(view, '2020'))) == ['b.txt', 'c.txt']
+        # 内容、保存先の2ファイル、ビューの2ファイル
+        assert os.stat(os.path.join(view, '2017', 'a.txt')).st_nlink == 5
+        # 作成済みのビューはそのまま
+        assert ObjectStore(conn, target).build_view(view, '%Y') == {'linked': 0, 'existing': 3, 'missing': 0}
+
+
+def test_content_store_recovers_unregistered_objects_and_existing_names():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        source, target = os.path.join(temp_dir, 'source'), os.path.join(temp_dir, 'target')
+        os.makedirs(source)
+        _write(os.path.join(source, 'a.txt'), b'a', 1500000000)
+        importer = PhotoImporter(conn, content_store=True)
+        importer.collect(source, target)
+        # 内容の保存後、DBへの書き込み前に中断した場合
+        conn.execute('DELETE FROM stored_object')
+        # 登録されていないファイルが保存先にある
+        _write(os.path.join(target, '2020', '01', 'b.txt'), b'other', 1600000000)
+
+        _write(os.path.join(source, 'b.txt'), b'a', 1580000000)
+        importer.collect(source, target)
+        assert importer.copy_methods == {'shared': 1}
+        assert sorted(os.listdir(os.path.join(target, '2020', '01'))) == ['b.txt', 'b_01.txt']
+        assert ObjectStore(conn, target).build_view(os.path.join(temp_dir, 'view'))['linked'] == 2
+
+
+def test_migrate_rekeys_stored_objects():
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:') as conn:
+        source, target = os.path.join(temp_dir, 'source'), os.path.join(temp_dir, 'target')
+        _write(os.path.join(source, 'a.txt'), b'a', 1500000000)
+        PhotoImporter(conn, content_store=True).collect(source, target)
+
+        assert migrate_hash_algorithm(conn, target, HashEngine('blake2b')) == (1, 0)
+        with PhotoImporter(conn, hash_algorithm='blake2b').activate():
+            assert ObjectStore(conn, target).build_view(os.path.join(temp_dir, 'view')) == \
+                {'linked': 1, 'existing': 0, 'missing': 0}
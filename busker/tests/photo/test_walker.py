@@ -0,0 +1,56 @@
+import os
+import tempfile
+from busker.photo.walker import FileWalker
+
+
+def _write(directory, name):
+    os.makedirs(directory, exist_ok=True)
+    open(os.path.join(directory, name), 'w').close()
+
+
+def _walk(walker, directory, **kwargs):
+    return {os.path.relpath(path, directory): sorted(name for name, stat in files)
+            for path, files in walker.walk(directory, **kwargs)}
+
+
+def test_walk_filters_files_before_stat():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        _write(temp_dir, 'a.jpg')
+        _write(temp_dir, 'notes.txt')
+        _write(temp_dir, 'Thumbs.db')
+        _write(os.path.join(temp_dir, '@eaDir'), 'a.jpg')
+        _write(os.path.join(temp_dir, '2023'), 'b.MOV')
+
+        walker = FileWalker(exclude=('Thumbs.db', '@eaDir'), media_only=True)
+        assert _walk(walker, temp_dir) == {'.': ['a.jpg'], '2023': ['b.MOV']}
+        assert walker.files == 2
+        assert walker.skipped == {'excluded': 1, 'not_included': 0, 'not_media': 1, 'excluded_dirs': 1}
+
+
+def test_walk_include_and_skip():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name in ('a.jpg', 'b.jpg', 'c.png'):
+            _write(temp_dir, name)
+
+        walker = FileWalker(include=('*.jpg',))
+        assert _walk(walker, temp_dir, skip=lambda path, name: name == 'a.jpg') == {'.': ['b.jpg']}
+        assert walker.skipped['not_included'] == 1
+
+        # 走査時に取得したstatを返す
+        (name, stat), = next(FileWalker().walk(temp_dir, skip=lambda path, name: name != 'c.png'))[1]
+        assert stat.st_size == os.stat(os.path.join(temp_dir, name)).st_size
+
+
+def test_count_uses_same_filters_as_walk():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name in ('a.jpg', 'b.jpg', 'notes.txt', 'Thumbs.db'):
+            _write(temp_dir, name)
+        _write(os.path.join(temp_dir, '@eaDir'), 'a.jpg')
+        _write(os.path.join(temp_dir, '2023'), 'c.MOV')
+
+        walker = FileWalker(exclude=('Thumbs.db', '@eaDir'), media_only=True)
+        assert walker.count(temp_dir) == 3
+        assert walker.count(temp_dir, skip=lambda path, name: name == 'a.jpg') == 2
+        # 走査の件数には計上しない
+        assert walker.files == 0
+        assert walker.skipped == {'excluded': 0, 'not_included': 0, 'not_media': 0, 'excluded_dirs': 0}
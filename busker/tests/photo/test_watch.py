@@ -0,0 +1,95 @@
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+import pytest
+from busker.photo.engine import PhotoImporter
+from busker.photo.walker import FileWalker
+from busker.photo.watch import Debouncer, create_watcher
+
+
+def test_debouncer_waits_until_files_stop_growing():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file = os.path.join(temp_dir, 'a.jpg')
+        with open(file, 'wb') as f:
+            f.write(b'a')
+        debouncer = Debouncer(2.0)
+        debouncer.add(file)
+        assert debouncer.ready(0.0) == []
+        assert debouncer.ready(1.0) == []
+        # 書き込まれた場合は待ち直す
+        with open(file, 'ab') as f:
+            f.write(b'b')
+        assert debouncer.ready(2.5) == []
+        [(path, [(name, stat)])] = debouncer.ready(4.5)
+        assert (path, name, stat.st_size) == (temp_dir, 'a.jpg', 2)
+        assert debouncer.ready(10.0) == []
+
+
+@pytest.mark.parametrize('polling', [False, True])
+def test_watcher_does_not_count_walked_files(polling):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name in ('a.jpg', 'Thumbs.db'):
+            open(os.path.join(temp_dir, name), 'w').close()
+        walker = FileWalker(exclude=('Thumbs.db',))
+        watcher = create_watcher(temp_dir, walker, polling, interval=0.0)
+        try:
+            open(os.path.join(temp_dir, 'b.jpg'), 'w').close()
+            watcher.poll(0.5)
+        finally:
+            watcher.close()
+        # 監視の走査は、取込処理の走査件数に計上しない
+        assert (walker.files, walker.skipped['excluded']) == (0, 0)
+
+
+@pytest.mark.parametrize('polling', [False, True])
+def test_watch_imports_added_files(polling):
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:', check_same_thread=False) as conn:
+        source, target = os.path.join(temp_dir, 'source'), os.path.join(temp_dir, 'target')
+        os.makedirs(source)
+        with open(os.path.join(source, 'a.txt'), 'wb') as f:
+            f.write(b'a')
+        importer = PhotoImporter(conn, watch_settle_seconds=0.1, watch_polling=polling, watch_poll_interval=0.1)
+        stop = threading.Event()
+        thread = threading.Thread(target=importer.watch, args=(source, target, stop))
+        thread.start()
+        try:
+            time.sleep(0.5)
+            os.makedirs(os.path.join(source, 'sub'))
+            with open(os.path.join(source, 'sub', 'b.txt'), 'wb') as f:
+                f.write(b'b')
+            deadline = time.monotonic() + 10
+            while importer.copied < 2 and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            stop.set()
+            thread.join()
+        assert importer.copied == 2
+
+
+@pytest.mark.parametrize('polling', [False, True])
+def test_watch_imports_files_added_during_collect(polling):
+    with tempfile.TemporaryDirectory() as temp_dir, sqlite3.connect(':memory:', check_same_thread=False) as conn:
+        source, target = os.path.join(temp_dir, 'source'), os.path.join(temp_dir, 'target')
+        os.makedirs(source)
+
+        def progress(event):
+            # 開始時のcollectの走査が終わった後に追加されたファイル
+            if event['event'] == 'copy_finished':
+                with open(os.path.join(source, 'a.txt'), 'wb') as f:
+                    f.write(b'a')
+
+        importer = PhotoImporter(conn, progress, watch_settle_seconds=0.1, watch_polling=polling,
+                                 watch_poll_interval=0.1)
+        stop = threading.Event()
+        thread = threading.Thread(target=importer.watch, args=(source, target, stop))
+        thread.start()
+        try:
+            deadline = time.monotonic() + 10
+            while importer.copied < 1 and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            stop.set()
+            thread.join()
+        assert importer.copied == 1
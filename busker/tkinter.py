@@ -20,11 +20,22 @@ def center_window(window, offsetx: int = 0, offsety: int = 0):
 
 
 class MessagePanel(tk.Frame):
+    """メッセージを末尾に追加して表示する、表示はmax_lines行まで
+
+    add_message()はメッセージを溜めるだけで、frame_intervalミリ秒ごとにまとめて末尾に追加し、
+    max_linesを超えた先頭の行を削除する。メッセージが多い場合も再描画はframe_intervalごとに1回になる。
+    add_message()はTkのメインスレッドから呼び出すこと。
+    """
+    frame_interval = 100
+
     def __init__(self, width, height, master=None, max_lines=10):
         super().__init__(master)
         self.create_widgets(width, height)
-        self.messages = []
         self.max_lines = max_lines
+        # 表示中の行数と、表示待ちのメッセージ
+        self.line_count = 0
+        self.pending = []
+        self.scheduled = None
 
     def create_widgets(self, width, height):
         # Create a Text widget to display messages
@@ -39,14 +50,28 @@ class MessagePanel(tk.Frame):
         self.text_widget.config(yscrollcommand=self.scrollbar.set)
 
     def add_message(self, message):
-        self.messages.append(message)
-        if len(self.messages) > self.max_lines:
-            self.messages.pop(0)
-        
-        # Clear existing text
-        self.text_widget.delete(1.0, tk.END)
-        self.text_widget.insert(tk.END, '\n'.join(self.messages))
-        self.text_widget.yview(tk.END)
+        self.pending.append(message)
+        if self.scheduled is None:
+            self.scheduled = self.after(self.frame_interval, self.flush)
+
+    def flush(self):
+        """表示待ちのメッセージを末尾に追加する"""
+        self.scheduled = None
+        if not self.pending:
+            return
+        # 表示しきれないメッセージは追加しない
+        messages = self.pending[-self.max_lines:]
+        self.pending = []
 
-        # Update the Tkinter event loop to reflect changes
-        self.update()
+        # 読み取り専用の場合も表示を更新する
+        state = self.text_widget.cget('state')
+        self.text_widget.config(state=tk.NORMAL)
+        text = '\n'.join(messages)
+        self.text_widget.insert(tk.END, ('\n' if self.line_count else '') + text)
+        self.line_count += text.count('\n') + 1
+        if self.line_count > self.max_lines:
+            excess = self.line_count - self.max_lines
+            self.text_widget.delete('1.0', f'{excess + 1}.0')
+            self.line_count = self.max_lines
+        self.text_widget.yview(tk.END)
+        self.text_widget.config(state=state)